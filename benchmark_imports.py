@@ -0,0 +1,56 @@
+import argparse, statistics, subprocess, sys
+
+# The modules each entry point imports before it does any work
+ENTRY_POINTS = (
+    'p3dephaser.__main__',
+    'p3dephaser.Multifile',
+    'p3dephaser.Repacker',
+    'p3dephaser.WordlistVerifier',
+    'p3dephaser.ScanEngine',
+    'p3dephaser.Daemon',
+    'p3dephaser.Dephaser'
+)
+
+# Imports that should only happen once they are needed
+HEAVY_MODULES = ('PySide6', 'psutil', 'mem_edit', 'numpy', 'p3dephaser.AES', 'p3dephaser.Blowfish')
+
+MEASURE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(name for name in {heavy!r} if name in sys.modules))
+'''
+
+def measure(module, runs):
+    # Every run uses a fresh interpreter, so nothing is imported yet
+    times = []
+    loaded = ''
+
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', MEASURE.format(module=module, heavy=HEAVY_MODULES)], capture_output=True, text=True)
+
+        if result.returncode:
+            return None, result.stderr.strip().splitlines()[-1]
+
+        elapsed, _, loaded = result.stdout.strip().partition(' ')
+        times.append(float(elapsed) * 1000)
+
+    return statistics.median(times), loaded
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how long each p3dephaser entry point takes to import.')
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per module; the median is reported')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help='modules to import')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        elapsed, loaded = measure(module, args.runs)
+
+        if elapsed is None:
+            print(f'{module:32} failed: {loaded}')
+        else:
+            print(f'{module:32} {elapsed:8.1f} ms   {loaded or "-"}')
+
+if __name__ == '__main__':
+    main()
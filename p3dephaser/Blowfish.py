@@ -1,211 +1,192 @@
 from struct import Struct, error as struct_error
 from itertools import cycle as iter_cycle
 
-PI_P_ARRAY = (
-  0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344, 0xa4093822, 0x299f31d0,
-  0x082efa98, 0xec4e6c89, 0x452821e6, 0x38d01377, 0xbe5466cf, 0x34e90c6c,
-  0xc0ac29b7, 0xc97c50dd, 0x3f84d5b5, 0xb5470917, 0x9216d5d9, 0x8979fb1b,
-)
-PI_S_BOXES = (
-  (
-    0xd1310ba6, 0x98dfb5ac, 0x2ffd72db, 0xd01adfb7, 0xb8e1afed, 0x6a267e96,
-    0xba7c9045, 0xf12c7f99, 0x24a19947, 0xb3916cf7, 0x0801f2e2, 0x858efc16,
-    0x636920d8, 0x71574e69, 0xa458fea3, 0xf4933d7e, 0x0d95748f, 0x728eb658,
-    0x718bcd58, 0x82154aee, 0x7b54a41d, 0xc25a59b5, 0x9c30d539, 0x2af26013,
-    0xc5d1b023, 0x286085f0, 0xca417918, 0xb8db38ef, 0x8e79dcb0, 0x603a180e,
-    0x6c9e0e8b, 0xb01e8a3e, 0xd71577c1, 0xbd314b27, 0x78af2fda, 0x55605c60,
-    0xe65525f3, 0xaa55ab94, 0x57489862, 0x63e81440, 0x55ca396a, 0x2aab10b6,
-    0xb4cc5c34, 0x1141e8ce, 0xa15486af, 0x7c72e993, 0xb3ee1411, 0x636fbc2a,
-    0x2ba9c55d, 0x741831f6, 0xce5c3e16, 0x9b87931e, 0xafd6ba33, 0x6c24cf5c,
-    0x7a325381, 0x28958677, 0x3b8f4898, 0x6b4bb9af, 0xc4bfe81b, 0x66282193,
-    0x61d809cc, 0xfb21a991, 0x487cac60, 0x5dec8032, 0xef845d5d, 0xe98575b1,
-    0xdc262302, 0xeb651b88, 0x23893e81, 0xd396acc5, 0x0f6d6ff3, 0x83f44239,
-    0x2e0b4482, 0xa4842004, 0x69c8f04a, 0x9e1f9b5e, 0x21c66842, 0xf6e96c9a,
-    0x670c9c61, 0xabd388f0, 0x6a51a0d2, 0xd8542f68, 0x960fa728, 0xab5133a3,
-    0x6eef0b6c, 0x137a3be4, 0xba3bf050, 0x7efb2a98, 0xa1f1651d, 0x39af0176,
-    0x66ca593e, 0x82430e88, 0x8cee8619, 0x456f9fb4, 0x7d84a5c3, 0x3b8b5ebe,
-    0xe06f75d8, 0x85c12073, 0x401a449f, 0x56c16aa6, 0x4ed3aa62, 0x363f7706,
-    0x1bfedf72, 0x429b023d, 0x37d0d724, 0xd00a1248, 0xdb0fead3, 0x49f1c09b,
-    0x075372c9, 0x80991b7b, 0x25d479d8, 0xf6e8def7, 0xe3fe501a, 0xb6794c3b,
-    0x976ce0bd, 0x04c006ba, 0xc1a94fb6, 0x409f60c4, 0x5e5c9ec2, 0x196a2463,
-    0x68fb6faf, 0x3e6c53b5, 0x1339b2eb, 0x3b52ec6f, 0x6dfc511f, 0x9b30952c,
-    0xcc814544, 0xaf5ebd09, 0xbee3d004, 0xde334afd, 0x660f2807, 0x192e4bb3,
-    0xc0cba857, 0x45c8740f, 0xd20b5f39, 0xb9d3fbdb, 0x5579c0bd, 0x1a60320a,
-    0xd6a100c6, 0x402c7279, 0x679f25fe, 0xfb1fa3cc, 0x8ea5e9f8, 0xdb3222f8,
-    0x3c7516df, 0xfd616b15, 0x2f501ec8, 0xad0552ab, 0x323db5fa, 0xfd238760,
-    0x53317b48, 0x3e00df82, 0x9e5c57bb, 0xca6f8ca0, 0x1a87562e, 0xdf1769db,
-    0xd542a8f6, 0x287effc3, 0xac6732c6, 0x8c4f5573, 0x695b27b0, 0xbbca58c8,
-    0xe1ffa35d, 0xb8f011a0, 0x10fa3d98, 0xfd2183b8, 0x4afcb56c, 0x2dd1d35b,
-    0x9a53e479, 0xb6f84565, 0xd28e49bc, 0x4bfb9790, 0xe1ddf2da, 0xa4cb7e33,
-    0x62fb1341, 0xcee4c6e8, 0xef20cada, 0x36774c01, 0xd07e9efe, 0x2bf11fb4,
-    0x95dbda4d, 0xae909198, 0xeaad8e71, 0x6b93d5a0, 0xd08ed1d0, 0xafc725e0,
-    0x8e3c5b2f, 0x8e7594b7, 0x8ff6e2fb, 0xf2122b64, 0x8888b812, 0x900df01c,
-    0x4fad5ea0, 0x688fc31c, 0xd1cff191, 0xb3a8c1ad, 0x2f2f2218, 0xbe0e1777,
-    0xea752dfe, 0x8b021fa1, 0xe5a0cc0f, 0xb56f74e8, 0x18acf3d6, 0xce89e299,
-    0xb4a84fe0, 0xfd13e0b7, 0x7cc43b81, 0xd2ada8d9, 0x165fa266, 0x80957705,
-    0x93cc7314, 0x211a1477, 0xe6ad2065, 0x77b5fa86, 0xc75442f5, 0xfb9d35cf,
-    0xebcdaf0c, 0x7b3e89a0, 0xd6411bd3, 0xae1e7e49, 0x00250e2d, 0x2071b35e,
-    0x226800bb, 0x57b8e0af, 0x2464369b, 0xf009b91e, 0x5563911d, 0x59dfa6aa,
-    0x78c14389, 0xd95a537f, 0x207d5ba2, 0x02e5b9c5, 0x83260376, 0x6295cfa9,
-    0x11c81968, 0x4e734a41, 0xb3472dca, 0x7b14a94a, 0x1b510052, 0x9a532915,
-    0xd60f573f, 0xbc9bc6e4, 0x2b60a476, 0x81e67400, 0x08ba6fb5, 0x571be91f,
-    0xf296ec6b, 0x2a0dd915, 0xb6636521, 0xe7b9f9b6, 0xff34052e, 0xc5855664,
-    0x53b02d5d, 0xa99f8fa1, 0x08ba4799, 0x6e85076a,
-  ),
-  (
-    0x4b7a70e9, 0xb5b32944, 0xdb75092e, 0xc4192623, 0xad6ea6b0, 0x49a7df7d,
-    0x9cee60b8, 0x8fedb266, 0xecaa8c71, 0x699a17ff, 0x5664526c, 0xc2b19ee1,
-    0x193602a5, 0x75094c29, 0xa0591340, 0xe4183a3e, 0x3f54989a, 0x5b429d65,
-    0x6b8fe4d6, 0x99f73fd6, 0xa1d29c07, 0xefe830f5, 0x4d2d38e6, 0xf0255dc1,
-    0x4cdd2086, 0x8470eb26, 0x6382e9c6, 0x021ecc5e, 0x09686b3f, 0x3ebaefc9,
-    0x3c971814, 0x6b6a70a1, 0x687f3584, 0x52a0e286, 0xb79c5305, 0xaa500737,
-    0x3e07841c, 0x7fdeae5c, 0x8e7d44ec, 0x5716f2b8, 0xb03ada37, 0xf0500c0d,
-    0xf01c1f04, 0x0200b3ff, 0xae0cf51a, 0x3cb574b2, 0x25837a58, 0xdc0921bd,
-    0xd19113f9, 0x7ca92ff6, 0x94324773, 0x22f54701, 0x3ae5e581, 0x37c2dadc,
-    0xc8b57634, 0x9af3dda7, 0xa9446146, 0x0fd0030e, 0xecc8c73e, 0xa4751e41,
-    0xe238cd99, 0x3bea0e2f, 0x3280bba1, 0x183eb331, 0x4e548b38, 0x4f6db908,
-    0x6f420d03, 0xf60a04bf, 0x2cb81290, 0x24977c79, 0x5679b072, 0xbcaf89af,
-    0xde9a771f, 0xd9930810, 0xb38bae12, 0xdccf3f2e, 0x5512721f, 0x2e6b7124,
-    0x501adde6, 0x9f84cd87, 0x7a584718, 0x7408da17, 0xbc9f9abc, 0xe94b7d8c,
-    0xec7aec3a, 0xdb851dfa, 0x63094366, 0xc464c3d2, 0xef1c1847, 0x3215d908,
-    0xdd433b37, 0x24c2ba16, 0x12a14d43, 0x2a65c451, 0x50940002, 0x133ae4dd,
-    0x71dff89e, 0x10314e55, 0x81ac77d6, 0x5f11199b, 0x043556f1, 0xd7a3c76b,
-    0x3c11183b, 0x5924a509, 0xf28fe6ed, 0x97f1fbfa, 0x9ebabf2c, 0x1e153c6e,
-    0x86e34570, 0xeae96fb1, 0x860e5e0a, 0x5a3e2ab3, 0x771fe71c, 0x4e3d06fa,
-    0x2965dcb9, 0x99e71d0f, 0x803e89d6, 0x5266c825, 0x2e4cc978, 0x9c10b36a,
-    0xc6150eba, 0x94e2ea78, 0xa5fc3c53, 0x1e0a2df4, 0xf2f74ea7, 0x361d2b3d,
-    0x1939260f, 0x19c27960, 0x5223a708, 0xf71312b6, 0xebadfe6e, 0xeac31f66,
-    0xe3bc4595, 0xa67bc883, 0xb17f37d1, 0x018cff28, 0xc332ddef, 0xbe6c5aa5,
-    0x65582185, 0x68ab9802, 0xeecea50f, 0xdb2f953b, 0x2aef7dad, 0x5b6e2f84,
-    0x1521b628, 0x29076170, 0xecdd4775, 0x619f1510, 0x13cca830, 0xeb61bd96,
-    0x0334fe1e, 0xaa0363cf, 0xb5735c90, 0x4c70a239, 0xd59e9e0b, 0xcbaade14,
-    0xeecc86bc, 0x60622ca7, 0x9cab5cab, 0xb2f3846e, 0x648b1eaf, 0x19bdf0ca,
-    0xa02369b9, 0x655abb50, 0x40685a32, 0x3c2ab4b3, 0x319ee9d5, 0xc021b8f7,
-    0x9b540b19, 0x875fa099, 0x95f7997e, 0x623d7da8, 0xf837889a, 0x97e32d77,
-    0x11ed935f, 0x16681281, 0x0e358829, 0xc7e61fd6, 0x96dedfa1, 0x7858ba99,
-    0x57f584a5, 0x1b227263, 0x9b83c3ff, 0x1ac24696, 0xcdb30aeb, 0x532e3054,
-    0x8fd948e4, 0x6dbc3128, 0x58ebf2ef, 0x34c6ffea, 0xfe28ed61, 0xee7c3c73,
-    0x5d4a14d9, 0xe864b7e3, 0x42105d14, 0x203e13e0, 0x45eee2b6, 0xa3aaabea,
-    0xdb6c4f15, 0xfacb4fd0, 0xc742f442, 0xef6abbb5, 0x654f3b1d, 0x41cd2105,
-    0xd81e799e, 0x86854dc7, 0xe44b476a, 0x3d816250, 0xcf62a1f2, 0x5b8d2646,
-    0xfc8883a0, 0xc1c7b6a3, 0x7f1524c3, 0x69cb7492, 0x47848a0b, 0x5692b285,
-    0x095bbf00, 0xad19489d, 0x1462b174, 0x23820e00, 0x58428d2a, 0x0c55f5ea,
-    0x1dadf43e, 0x233f7061, 0x3372f092, 0x8d937e41, 0xd65fecf1, 0x6c223bdb,
-    0x7cde3759, 0xcbee7460, 0x4085f2a7, 0xce77326e, 0xa6078084, 0x19f8509e,
-    0xe8efd855, 0x61d99735, 0xa969a7aa, 0xc50c06c2, 0x5a04abfc, 0x800bcadc,
-    0x9e447a2e, 0xc3453484, 0xfdd56705, 0x0e1e9ec9, 0xdb73dbd3, 0x105588cd,
-    0x675fda79, 0xe3674340, 0xc5c43465, 0x713e38d8, 0x3d28f89e, 0xf16dff20,
-    0x153e21e7, 0x8fb03d4a, 0xe6e39f2b, 0xdb83adf7,
-  ),
-  (
-    0xe93d5a68, 0x948140f7, 0xf64c261c, 0x94692934, 0x411520f7, 0x7602d4f7,
-    0xbcf46b2e, 0xd4a20068, 0xd4082471, 0x3320f46a, 0x43b7d4b7, 0x500061af,
-    0x1e39f62e, 0x97244546, 0x14214f74, 0xbf8b8840, 0x4d95fc1d, 0x96b591af,
-    0x70f4ddd3, 0x66a02f45, 0xbfbc09ec, 0x03bd9785, 0x7fac6dd0, 0x31cb8504,
-    0x96eb27b3, 0x55fd3941, 0xda2547e6, 0xabca0a9a, 0x28507825, 0x530429f4,
-    0x0a2c86da, 0xe9b66dfb, 0x68dc1462, 0xd7486900, 0x680ec0a4, 0x27a18dee,
-    0x4f3ffea2, 0xe887ad8c, 0xb58ce006, 0x7af4d6b6, 0xaace1e7c, 0xd3375fec,
-    0xce78a399, 0x406b2a42, 0x20fe9e35, 0xd9f385b9, 0xee39d7ab, 0x3b124e8b,
-    0x1dc9faf7, 0x4b6d1856, 0x26a36631, 0xeae397b2, 0x3a6efa74, 0xdd5b4332,
-    0x6841e7f7, 0xca7820fb, 0xfb0af54e, 0xd8feb397, 0x454056ac, 0xba489527,
-    0x55533a3a, 0x20838d87, 0xfe6ba9b7, 0xd096954b, 0x55a867bc, 0xa1159a58,
-    0xcca92963, 0x99e1db33, 0xa62a4a56, 0x3f3125f9, 0x5ef47e1c, 0x9029317c,
-    0xfdf8e802, 0x04272f70, 0x80bb155c, 0x05282ce3, 0x95c11548, 0xe4c66d22,
-    0x48c1133f, 0xc70f86dc, 0x07f9c9ee, 0x41041f0f, 0x404779a4, 0x5d886e17,
-    0x325f51eb, 0xd59bc0d1, 0xf2bcc18f, 0x41113564, 0x257b7834, 0x602a9c60,
-    0xdff8e8a3, 0x1f636c1b, 0x0e12b4c2, 0x02e1329e, 0xaf664fd1, 0xcad18115,
-    0x6b2395e0, 0x333e92e1, 0x3b240b62, 0xeebeb922, 0x85b2a20e, 0xe6ba0d99,
-    0xde720c8c, 0x2da2f728, 0xd0127845, 0x95b794fd, 0x647d0862, 0xe7ccf5f0,
-    0x5449a36f, 0x877d48fa, 0xc39dfd27, 0xf33e8d1e, 0x0a476341, 0x992eff74,
-    0x3a6f6eab, 0xf4f8fd37, 0xa812dc60, 0xa1ebddf8, 0x991be14c, 0xdb6e6b0d,
-    0xc67b5510, 0x6d672c37, 0x2765d43b, 0xdcd0e804, 0xf1290dc7, 0xcc00ffa3,
-    0xb5390f92, 0x690fed0b, 0x667b9ffb, 0xcedb7d9c, 0xa091cf0b, 0xd9155ea3,
-    0xbb132f88, 0x515bad24, 0x7b9479bf, 0x763bd6eb, 0x37392eb3, 0xcc115979,
-    0x8026e297, 0xf42e312d, 0x6842ada7, 0xc66a2b3b, 0x12754ccc, 0x782ef11c,
-    0x6a124237, 0xb79251e7, 0x06a1bbe6, 0x4bfb6350, 0x1a6b1018, 0x11caedfa,
-    0x3d25bdd8, 0xe2e1c3c9, 0x44421659, 0x0a121386, 0xd90cec6e, 0xd5abea2a,
-    0x64af674e, 0xda86a85f, 0xbebfe988, 0x64e4c3fe, 0x9dbc8057, 0xf0f7c086,
-    0x60787bf8, 0x6003604d, 0xd1fd8346, 0xf6381fb0, 0x7745ae04, 0xd736fccc,
-    0x83426b33, 0xf01eab71, 0xb0804187, 0x3c005e5f, 0x77a057be, 0xbde8ae24,
-    0x55464299, 0xbf582e61, 0x4e58f48f, 0xf2ddfda2, 0xf474ef38, 0x8789bdc2,
-    0x5366f9c3, 0xc8b38e74, 0xb475f255, 0x46fcd9b9, 0x7aeb2661, 0x8b1ddf84,
-    0x846a0e79, 0x915f95e2, 0x466e598e, 0x20b45770, 0x8cd55591, 0xc902de4c,
-    0xb90bace1, 0xbb8205d0, 0x11a86248, 0x7574a99e, 0xb77f19b6, 0xe0a9dc09,
-    0x662d09a1, 0xc4324633, 0xe85a1f02, 0x09f0be8c, 0x4a99a025, 0x1d6efe10,
-    0x1ab93d1d, 0x0ba5a4df, 0xa186f20f, 0x2868f169, 0xdcb7da83, 0x573906fe,
-    0xa1e2ce9b, 0x4fcd7f52, 0x50115e01, 0xa70683fa, 0xa002b5c4, 0x0de6d027,
-    0x9af88c27, 0x773f8641, 0xc3604c06, 0x61a806b5, 0xf0177a28, 0xc0f586e0,
-    0x006058aa, 0x30dc7d62, 0x11e69ed7, 0x2338ea63, 0x53c2dd94, 0xc2c21634,
-    0xbbcbee56, 0x90bcb6de, 0xebfc7da1, 0xce591d76, 0x6f05e409, 0x4b7c0188,
-    0x39720a3d, 0x7c927c24, 0x86e3725f, 0x724d9db9, 0x1ac15bb4, 0xd39eb8fc,
-    0xed545578, 0x08fca5b5, 0xd83d7cd3, 0x4dad0fc4, 0x1e50ef5e, 0xb161e6f8,
-    0xa28514d9, 0x6c51133c, 0x6fd5c7e7, 0x56e14ec4, 0x362abfce, 0xddc6c837,
-    0xd79a3234, 0x92638212, 0x670efa8e, 0x406000e0,
-  ),
-  (
-    0x3a39ce37, 0xd3faf5cf, 0xabc27737, 0x5ac52d1b, 0x5cb0679e, 0x4fa33742,
-    0xd3822740, 0x99bc9bbe, 0xd5118e9d, 0xbf0f7315, 0xd62d1c7e, 0xc700c47b,
-    0xb78c1b6b, 0x21a19045, 0xb26eb1be, 0x6a366eb4, 0x5748ab2f, 0xbc946e79,
-    0xc6a376d2, 0x6549c2c8, 0x530ff8ee, 0x468dde7d, 0xd5730a1d, 0x4cd04dc6,
-    0x2939bbdb, 0xa9ba4650, 0xac9526e8, 0xbe5ee304, 0xa1fad5f0, 0x6a2d519a,
-    0x63ef8ce2, 0x9a86ee22, 0xc089c2b8, 0x43242ef6, 0xa51e03aa, 0x9cf2d0a4,
-    0x83c061ba, 0x9be96a4d, 0x8fe51550, 0xba645bd6, 0x2826a2f9, 0xa73a3ae1,
-    0x4ba99586, 0xef5562e9, 0xc72fefd3, 0xf752f7da, 0x3f046f69, 0x77fa0a59,
-    0x80e4a915, 0x87b08601, 0x9b09e6ad, 0x3b3ee593, 0xe990fd5a, 0x9e34d797,
-    0x2cf0b7d9, 0x022b8b51, 0x96d5ac3a, 0x017da67d, 0xd1cf3ed6, 0x7c7d2d28,
-    0x1f9f25cf, 0xadf2b89b, 0x5ad6b472, 0x5a88f54c, 0xe029ac71, 0xe019a5e6,
-    0x47b0acfd, 0xed93fa9b, 0xe8d3c48d, 0x283b57cc, 0xf8d56629, 0x79132e28,
-    0x785f0191, 0xed756055, 0xf7960e44, 0xe3d35e8c, 0x15056dd4, 0x88f46dba,
-    0x03a16125, 0x0564f0bd, 0xc3eb9e15, 0x3c9057a2, 0x97271aec, 0xa93a072a,
-    0x1b3f6d9b, 0x1e6321f5, 0xf59c66fb, 0x26dcf319, 0x7533d928, 0xb155fdf5,
-    0x03563482, 0x8aba3cbb, 0x28517711, 0xc20ad9f8, 0xabcc5167, 0xccad925f,
-    0x4de81751, 0x3830dc8e, 0x379d5862, 0x9320f991, 0xea7a90c2, 0xfb3e7bce,
-    0x5121ce64, 0x774fbe32, 0xa8b6e37e, 0xc3293d46, 0x48de5369, 0x6413e680,
-    0xa2ae0810, 0xdd6db224, 0x69852dfd, 0x09072166, 0xb39a460a, 0x6445c0dd,
-    0x586cdecf, 0x1c20c8ae, 0x5bbef7dd, 0x1b588d40, 0xccd2017f, 0x6bb4e3bb,
-    0xdda26a7e, 0x3a59ff45, 0x3e350a44, 0xbcb4cdd5, 0x72eacea8, 0xfa6484bb,
-    0x8d6612ae, 0xbf3c6f47, 0xd29be463, 0x542f5d9e, 0xaec2771b, 0xf64e6370,
-    0x740e0d8d, 0xe75b1357, 0xf8721671, 0xaf537d5d, 0x4040cb08, 0x4eb4e2cc,
-    0x34d2466a, 0x0115af84, 0xe1b00428, 0x95983a1d, 0x06b89fb4, 0xce6ea048,
-    0x6f3f3b82, 0x3520ab82, 0x011a1d4b, 0x277227f8, 0x611560b1, 0xe7933fdc,
-    0xbb3a792b, 0x344525bd, 0xa08839e1, 0x51ce794b, 0x2f32c9b7, 0xa01fbac9,
-    0xe01cc87e, 0xbcc7d1f6, 0xcf0111c3, 0xa1e8aac7, 0x1a908749, 0xd44fbd9a,
-    0xd0dadecb, 0xd50ada38, 0x0339c32a, 0xc6913667, 0x8df9317c, 0xe0b12b4f,
-    0xf79e59b7, 0x43f5bb3a, 0xf2d519ff, 0x27d9459c, 0xbf97222c, 0x15e6fc2a,
-    0x0f91fc71, 0x9b941525, 0xfae59361, 0xceb69ceb, 0xc2a86459, 0x12baa8d1,
-    0xb6c1075e, 0xe3056a0c, 0x10d25065, 0xcb03a442, 0xe0ec6e0e, 0x1698db3b,
-    0x4c98a0be, 0x3278e964, 0x9f1f9532, 0xe0d392df, 0xd3a0342b, 0x8971f21e,
-    0x1b0a7441, 0x4ba3348c, 0xc5be7120, 0xc37632d8, 0xdf359f8d, 0x9b992f2e,
-    0xe60b6f47, 0x0fe3f11d, 0xe54cda54, 0x1edad891, 0xce6279cf, 0xcd3e7e6f,
-    0x1618b166, 0xfd2c1d05, 0x848fd2c5, 0xf6fb2299, 0xf523f357, 0xa6327623,
-    0x93a83531, 0x56cccd02, 0xacf08162, 0x5a75ebb5, 0x6e163697, 0x88d273cc,
-    0xde966292, 0x81b949d0, 0x4c50901b, 0x71c65614, 0xe6c6c7bd, 0x327a140a,
-    0x45e1d006, 0xc3f27b9a, 0xc9aa53fd, 0x62a80f00, 0xbb25bfe2, 0x35bdd2f6,
-    0x71126905, 0xb2040222, 0xb6cbcf7c, 0xcd769c2b, 0x53113ec0, 0x1640e3d3,
-    0x38abbd60, 0x2547adf0, 0xba38209c, 0xf746ce76, 0x77afa1c5, 0x20756060,
-    0x85cbfe4e, 0x8ae88dd8, 0x7aaaf9b0, 0x4cf9aa7e, 0x1948c25c, 0x02fb8a8c,
-    0x01c36ae4, 0xd6ebe1f9, 0x90d4f869, 0xa65cdea0, 0x3f09252d, 0xc208e69f,
-    0xb74e6132, 0xce77e25b, 0x578fdfe3, 0x3ac372e6,
-  ),
-)
+PI_P_ARRAY = Struct('>18I').unpack(bytes.fromhex(
+  '243f6a8885a308d313198a2e03707344a4093822299f31d0'
+  '082efa98ec4e6c89452821e638d01377be5466cf34e90c6c'
+  'c0ac29b7c97c50dd3f84d5b5b54709179216d5d98979fb1b'
+))
+PI_S_BOXES = tuple(Struct('>256I').iter_unpack(bytes.fromhex(
+  'd1310ba698dfb5ac2ffd72dbd01adfb7b8e1afed6a267e96'
+  'ba7c9045f12c7f9924a19947b3916cf70801f2e2858efc16'
+  '636920d871574e69a458fea3f4933d7e0d95748f728eb658'
+  '718bcd5882154aee7b54a41dc25a59b59c30d5392af26013'
+  'c5d1b023286085f0ca417918b8db38ef8e79dcb0603a180e'
+  '6c9e0e8bb01e8a3ed71577c1bd314b2778af2fda55605c60'
+  'e65525f3aa55ab945748986263e8144055ca396a2aab10b6'
+  'b4cc5c341141e8cea15486af7c72e993b3ee1411636fbc2a'
+  '2ba9c55d741831f6ce5c3e169b87931eafd6ba336c24cf5c'
+  '7a325381289586773b8f48986b4bb9afc4bfe81b66282193'
+  '61d809ccfb21a991487cac605dec8032ef845d5de98575b1'
+  'dc262302eb651b8823893e81d396acc50f6d6ff383f44239'
+  '2e0b4482a484200469c8f04a9e1f9b5e21c66842f6e96c9a'
+  '670c9c61abd388f06a51a0d2d8542f68960fa728ab5133a3'
+  '6eef0b6c137a3be4ba3bf0507efb2a98a1f1651d39af0176'
+  '66ca593e82430e888cee8619456f9fb47d84a5c33b8b5ebe'
+  'e06f75d885c12073401a449f56c16aa64ed3aa62363f7706'
+  '1bfedf72429b023d37d0d724d00a1248db0fead349f1c09b'
+  '075372c980991b7b25d479d8f6e8def7e3fe501ab6794c3b'
+  '976ce0bd04c006bac1a94fb6409f60c45e5c9ec2196a2463'
+  '68fb6faf3e6c53b51339b2eb3b52ec6f6dfc511f9b30952c'
+  'cc814544af5ebd09bee3d004de334afd660f2807192e4bb3'
+  'c0cba85745c8740fd20b5f39b9d3fbdb5579c0bd1a60320a'
+  'd6a100c6402c7279679f25fefb1fa3cc8ea5e9f8db3222f8'
+  '3c7516dffd616b152f501ec8ad0552ab323db5fafd238760'
+  '53317b483e00df829e5c57bbca6f8ca01a87562edf1769db'
+  'd542a8f6287effc3ac6732c68c4f5573695b27b0bbca58c8'
+  'e1ffa35db8f011a010fa3d98fd2183b84afcb56c2dd1d35b'
+  '9a53e479b6f84565d28e49bc4bfb9790e1ddf2daa4cb7e33'
+  '62fb1341cee4c6e8ef20cada36774c01d07e9efe2bf11fb4'
+  '95dbda4dae909198eaad8e716b93d5a0d08ed1d0afc725e0'
+  '8e3c5b2f8e7594b78ff6e2fbf2122b648888b812900df01c'
+  '4fad5ea0688fc31cd1cff191b3a8c1ad2f2f2218be0e1777'
+  'ea752dfe8b021fa1e5a0cc0fb56f74e818acf3d6ce89e299'
+  'b4a84fe0fd13e0b77cc43b81d2ada8d9165fa26680957705'
+  '93cc7314211a1477e6ad206577b5fa86c75442f5fb9d35cf'
+  'ebcdaf0c7b3e89a0d6411bd3ae1e7e4900250e2d2071b35e'
+  '226800bb57b8e0af2464369bf009b91e5563911d59dfa6aa'
+  '78c14389d95a537f207d5ba202e5b9c5832603766295cfa9'
+  '11c819684e734a41b3472dca7b14a94a1b5100529a532915'
+  'd60f573fbc9bc6e42b60a47681e6740008ba6fb5571be91f'
+  'f296ec6b2a0dd915b6636521e7b9f9b6ff34052ec5855664'
+  '53b02d5da99f8fa108ba47996e85076a4b7a70e9b5b32944'
+  'db75092ec4192623ad6ea6b049a7df7d9cee60b88fedb266'
+  'ecaa8c71699a17ff5664526cc2b19ee1193602a575094c29'
+  'a0591340e4183a3e3f54989a5b429d656b8fe4d699f73fd6'
+  'a1d29c07efe830f54d2d38e6f0255dc14cdd20868470eb26'
+  '6382e9c6021ecc5e09686b3f3ebaefc93c9718146b6a70a1'
+  '687f358452a0e286b79c5305aa5007373e07841c7fdeae5c'
+  '8e7d44ec5716f2b8b03ada37f0500c0df01c1f040200b3ff'
+  'ae0cf51a3cb574b225837a58dc0921bdd19113f97ca92ff6'
+  '9432477322f547013ae5e58137c2dadcc8b576349af3dda7'
+  'a94461460fd0030eecc8c73ea4751e41e238cd993bea0e2f'
+  '3280bba1183eb3314e548b384f6db9086f420d03f60a04bf'
+  '2cb8129024977c795679b072bcaf89afde9a771fd9930810'
+  'b38bae12dccf3f2e5512721f2e6b7124501adde69f84cd87'
+  '7a5847187408da17bc9f9abce94b7d8cec7aec3adb851dfa'
+  '63094366c464c3d2ef1c18473215d908dd433b3724c2ba16'
+  '12a14d432a65c45150940002133ae4dd71dff89e10314e55'
+  '81ac77d65f11199b043556f1d7a3c76b3c11183b5924a509'
+  'f28fe6ed97f1fbfa9ebabf2c1e153c6e86e34570eae96fb1'
+  '860e5e0a5a3e2ab3771fe71c4e3d06fa2965dcb999e71d0f'
+  '803e89d65266c8252e4cc9789c10b36ac6150eba94e2ea78'
+  'a5fc3c531e0a2df4f2f74ea7361d2b3d1939260f19c27960'
+  '5223a708f71312b6ebadfe6eeac31f66e3bc4595a67bc883'
+  'b17f37d1018cff28c332ddefbe6c5aa56558218568ab9802'
+  'eecea50fdb2f953b2aef7dad5b6e2f841521b62829076170'
+  'ecdd4775619f151013cca830eb61bd960334fe1eaa0363cf'
+  'b5735c904c70a239d59e9e0bcbaade14eecc86bc60622ca7'
+  '9cab5cabb2f3846e648b1eaf19bdf0caa02369b9655abb50'
+  '40685a323c2ab4b3319ee9d5c021b8f79b540b19875fa099'
+  '95f7997e623d7da8f837889a97e32d7711ed935f16681281'
+  '0e358829c7e61fd696dedfa17858ba9957f584a51b227263'
+  '9b83c3ff1ac24696cdb30aeb532e30548fd948e46dbc3128'
+  '58ebf2ef34c6ffeafe28ed61ee7c3c735d4a14d9e864b7e3'
+  '42105d14203e13e045eee2b6a3aaabeadb6c4f15facb4fd0'
+  'c742f442ef6abbb5654f3b1d41cd2105d81e799e86854dc7'
+  'e44b476a3d816250cf62a1f25b8d2646fc8883a0c1c7b6a3'
+  '7f1524c369cb749247848a0b5692b285095bbf00ad19489d'
+  '1462b17423820e0058428d2a0c55f5ea1dadf43e233f7061'
+  '3372f0928d937e41d65fecf16c223bdb7cde3759cbee7460'
+  '4085f2a7ce77326ea607808419f8509ee8efd85561d99735'
+  'a969a7aac50c06c25a04abfc800bcadc9e447a2ec3453484'
+  'fdd567050e1e9ec9db73dbd3105588cd675fda79e3674340'
+  'c5c43465713e38d83d28f89ef16dff20153e21e78fb03d4a'
+  'e6e39f2bdb83adf7e93d5a68948140f7f64c261c94692934'
+  '411520f77602d4f7bcf46b2ed4a20068d40824713320f46a'
+  '43b7d4b7500061af1e39f62e9724454614214f74bf8b8840'
+  '4d95fc1d96b591af70f4ddd366a02f45bfbc09ec03bd9785'
+  '7fac6dd031cb850496eb27b355fd3941da2547e6abca0a9a'
+  '28507825530429f40a2c86dae9b66dfb68dc1462d7486900'
+  '680ec0a427a18dee4f3ffea2e887ad8cb58ce0067af4d6b6'
+  'aace1e7cd3375fecce78a399406b2a4220fe9e35d9f385b9'
+  'ee39d7ab3b124e8b1dc9faf74b6d185626a36631eae397b2'
+  '3a6efa74dd5b43326841e7f7ca7820fbfb0af54ed8feb397'
+  '454056acba48952755533a3a20838d87fe6ba9b7d096954b'
+  '55a867bca1159a58cca9296399e1db33a62a4a563f3125f9'
+  '5ef47e1c9029317cfdf8e80204272f7080bb155c05282ce3'
+  '95c11548e4c66d2248c1133fc70f86dc07f9c9ee41041f0f'
+  '404779a45d886e17325f51ebd59bc0d1f2bcc18f41113564'
+  '257b7834602a9c60dff8e8a31f636c1b0e12b4c202e1329e'
+  'af664fd1cad181156b2395e0333e92e13b240b62eebeb922'
+  '85b2a20ee6ba0d99de720c8c2da2f728d012784595b794fd'
+  '647d0862e7ccf5f05449a36f877d48fac39dfd27f33e8d1e'
+  '0a476341992eff743a6f6eabf4f8fd37a812dc60a1ebddf8'
+  '991be14cdb6e6b0dc67b55106d672c372765d43bdcd0e804'
+  'f1290dc7cc00ffa3b5390f92690fed0b667b9ffbcedb7d9c'
+  'a091cf0bd9155ea3bb132f88515bad247b9479bf763bd6eb'
+  '37392eb3cc1159798026e297f42e312d6842ada7c66a2b3b'
+  '12754ccc782ef11c6a124237b79251e706a1bbe64bfb6350'
+  '1a6b101811caedfa3d25bdd8e2e1c3c9444216590a121386'
+  'd90cec6ed5abea2a64af674eda86a85fbebfe98864e4c3fe'
+  '9dbc8057f0f7c08660787bf86003604dd1fd8346f6381fb0'
+  '7745ae04d736fccc83426b33f01eab71b08041873c005e5f'
+  '77a057bebde8ae2455464299bf582e614e58f48ff2ddfda2'
+  'f474ef388789bdc25366f9c3c8b38e74b475f25546fcd9b9'
+  '7aeb26618b1ddf84846a0e79915f95e2466e598e20b45770'
+  '8cd55591c902de4cb90bace1bb8205d011a862487574a99e'
+  'b77f19b6e0a9dc09662d09a1c4324633e85a1f0209f0be8c'
+  '4a99a0251d6efe101ab93d1d0ba5a4dfa186f20f2868f169'
+  'dcb7da83573906fea1e2ce9b4fcd7f5250115e01a70683fa'
+  'a002b5c40de6d0279af88c27773f8641c3604c0661a806b5'
+  'f0177a28c0f586e0006058aa30dc7d6211e69ed72338ea63'
+  '53c2dd94c2c21634bbcbee5690bcb6deebfc7da1ce591d76'
+  '6f05e4094b7c018839720a3d7c927c2486e3725f724d9db9'
+  '1ac15bb4d39eb8fced54557808fca5b5d83d7cd34dad0fc4'
+  '1e50ef5eb161e6f8a28514d96c51133c6fd5c7e756e14ec4'
+  '362abfceddc6c837d79a323492638212670efa8e406000e0'
+  '3a39ce37d3faf5cfabc277375ac52d1b5cb0679e4fa33742'
+  'd382274099bc9bbed5118e9dbf0f7315d62d1c7ec700c47b'
+  'b78c1b6b21a19045b26eb1be6a366eb45748ab2fbc946e79'
+  'c6a376d26549c2c8530ff8ee468dde7dd5730a1d4cd04dc6'
+  '2939bbdba9ba4650ac9526e8be5ee304a1fad5f06a2d519a'
+  '63ef8ce29a86ee22c089c2b843242ef6a51e03aa9cf2d0a4'
+  '83c061ba9be96a4d8fe51550ba645bd62826a2f9a73a3ae1'
+  '4ba99586ef5562e9c72fefd3f752f7da3f046f6977fa0a59'
+  '80e4a91587b086019b09e6ad3b3ee593e990fd5a9e34d797'
+  '2cf0b7d9022b8b5196d5ac3a017da67dd1cf3ed67c7d2d28'
+  '1f9f25cfadf2b89b5ad6b4725a88f54ce029ac71e019a5e6'
+  '47b0acfded93fa9be8d3c48d283b57ccf8d5662979132e28'
+  '785f0191ed756055f7960e44e3d35e8c15056dd488f46dba'
+  '03a161250564f0bdc3eb9e153c9057a297271aeca93a072a'
+  '1b3f6d9b1e6321f5f59c66fb26dcf3197533d928b155fdf5'
+  '035634828aba3cbb28517711c20ad9f8abcc5167ccad925f'
+  '4de817513830dc8e379d58629320f991ea7a90c2fb3e7bce'
+  '5121ce64774fbe32a8b6e37ec3293d4648de53696413e680'
+  'a2ae0810dd6db22469852dfd09072166b39a460a6445c0dd'
+  '586cdecf1c20c8ae5bbef7dd1b588d40ccd2017f6bb4e3bb'
+  'dda26a7e3a59ff453e350a44bcb4cdd572eacea8fa6484bb'
+  '8d6612aebf3c6f47d29be463542f5d9eaec2771bf64e6370'
+  '740e0d8de75b1357f8721671af537d5d4040cb084eb4e2cc'
+  '34d2466a0115af84e1b0042895983a1d06b89fb4ce6ea048'
+  '6f3f3b823520ab82011a1d4b277227f8611560b1e7933fdc'
+  'bb3a792b344525bda08839e151ce794b2f32c9b7a01fbac9'
+  'e01cc87ebcc7d1f6cf0111c3a1e8aac71a908749d44fbd9a'
+  'd0dadecbd50ada380339c32ac69136678df9317ce0b12b4f'
+  'f79e59b743f5bb3af2d519ff27d9459cbf97222c15e6fc2a'
+  '0f91fc719b941525fae59361ceb69cebc2a8645912baa8d1'
+  'b6c1075ee3056a0c10d25065cb03a442e0ec6e0e1698db3b'
+  '4c98a0be3278e9649f1f9532e0d392dfd3a0342b8971f21e'
+  '1b0a74414ba3348cc5be7120c37632d8df359f8d9b992f2e'
+  'e60b6f470fe3f11de54cda541edad891ce6279cfcd3e7e6f'
+  '1618b166fd2c1d05848fd2c5f6fb2299f523f357a6327623'
+  '93a8353156cccd02acf081625a75ebb56e16369788d273cc'
+  'de96629281b949d04c50901b71c65614e6c6c7bd327a140a'
+  '45e1d006c3f27b9ac9aa53fd62a80f00bb25bfe235bdd2f6'
+  '71126905b2040222b6cbcf7ccd769c2b53113ec01640e3d3'
+  '38abbd602547adf0ba38209cf746ce7677afa1c520756060'
+  '85cbfe4e8ae88dd87aaaf9b04cf9aa7e1948c25c02fb8a8c'
+  '01c36ae4d6ebe1f990d4f869a65cdea03f09252dc208e69f'
+  'b74e6132ce77e25b578fdfe33ac372e6'
+)))
 
 class Blowfish(object):
 
     def __init__(self, key):
-        u4_2_struct = Struct(">2I")
         u4_1_struct = Struct(">I")
-        u8_1_struct = Struct(">Q")
-        u1_4_struct = Struct("=4B")
-
-        self._u4_2_pack = u4_2_struct.pack
-        self._u4_2_unpack = u4_2_struct.unpack
-        self._u4_2_iter_unpack = u4_2_struct.iter_unpack
-
-        self._u4_1_pack = u4_1_pack = u4_1_struct.pack
-
-        self._u1_4_unpack = u1_4_unpack = u1_4_struct.unpack
-
-        self._u8_1_pack = u8_1_struct.pack
+        self._init_structs()
+        u4_1_pack = self._u4_1_pack
+        u1_4_unpack = self._u1_4_unpack
 
         cyclic_key_iter = iter_cycle(iter(key))
         cyclic_key_u4_iter = (
@@ -253,6 +234,31 @@ class Blowfish(object):
 
         self.S = tuple(tuple(box) for box in S)
 
+    @classmethod
+    def from_state(cls, P, S):
+        # A cipher from an already expanded P-array and S-boxes, such as one found in memory
+        self = cls.__new__(cls)
+        self._init_structs()
+        self.P = tuple(zip(P[0::2], P[1::2]))
+        self.S = tuple(tuple(box) for box in S)
+        return self
+
+    def _init_structs(self):
+        u4_2_struct = Struct(">2I")
+        u4_1_struct = Struct(">I")
+        u8_1_struct = Struct(">Q")
+        u1_4_struct = Struct("=4B")
+
+        self._u4_2_pack = u4_2_struct.pack
+        self._u4_2_unpack = u4_2_struct.unpack
+        self._u4_2_iter_unpack = u4_2_struct.iter_unpack
+
+        self._u4_1_pack = u4_1_struct.pack
+
+        self._u1_4_unpack = u1_4_struct.unpack
+
+        self._u8_1_pack = u8_1_struct.pack
+
     @staticmethod
     def _encrypt(L, R, P, S1, S2, S3, S4, u4_1_pack, u1_4_unpack):
         for p1, p2 in P[:-1]:
@@ -0,0 +1,87 @@
+from collections import Counter
+import math, string, threading
+
+PRINTABLE_CHARS = string.printable.encode('utf-8')[:-5] # Without tabs and line breaks
+MIN_LENGTH = 1
+MAX_LENGTH = 256 # The layouts decode strings up to 1000 bytes; passwords are far shorter
+LOW_ENTROPY = 1.5 # Bits per byte; below this a string is mostly one repeated character
+
+def get_entropy(value: bytes) -> float:
+    length = len(value)
+    return -sum(count / length * math.log2(count / length) for count in Counter(value).values())
+
+class CandidateFilter(object):
+    # A cheap stage between string extraction and the key derivation. Strings that cannot be
+    # passwords are dropped, every distinct string is verified once per sweep, and the rest
+    # are ordered so that the likeliest ones reach the key derivation first.
+
+    def __init__(self, min_length=MIN_LENGTH, max_length=MAX_LENGTH, charset=PRINTABLE_CHARS):
+        self.min_length = min_length
+        self.max_length = max_length
+        # None accepts any byte
+        self.charset = charset
+        self.seen = set()
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def start_sweep(self):
+        self.seen = set()
+
+    def get_rejection(self, value: bytes):
+        # Returns why a string is not worth verifying, or None
+        if not value:
+            return 'empty'
+
+        if len(value) < self.min_length:
+            return 'too_short'
+
+        if len(value) > self.max_length:
+            return 'too_long'
+
+        if self.charset is not None and value.translate(None, self.charset):
+            return 'charset'
+
+        if value in self.seen:
+            return 'duplicate'
+
+        return None
+
+    def get_rank(self, offset, abi, value, known_offsets, abis):
+        # Lower ranks first: offsets that held passwords before, the string ABIs this build
+        # uses, strings that are not one repeated character, then the distance from the anchor
+        return (
+            known_offsets.get(offset, len(known_offsets)),
+            abis.get(abi, len(abis)),
+            len(value) > 2 and get_entropy(value) < LOW_ENTROPY,
+            abs(offset)
+        )
+
+    def select(self, candidates, known_offsets=(), abis=()):
+        # Returns the (offset, abi, value) candidates worth verifying, likeliest first
+        known_offsets = {offset: rank for rank, offset in enumerate(known_offsets)}
+        abis = {abi: rank for rank, abi in enumerate(abis)}
+        selected = []
+        rejections = Counter()
+
+        for offset, abi, value in candidates:
+            rejection = self.get_rejection(value)
+
+            if rejection:
+                rejections[rejection] += 1
+                continue
+
+            self.seen.add(value)
+            selected.append((self.get_rank(offset, abi, value, known_offsets, abis), offset, abi, value))
+
+        selected.sort(key=lambda candidate: candidate[0])
+
+        with self.lock:
+            self.stats.update(rejections)
+            self.stats['candidates'] += len(candidates)
+            self.stats['selected'] += len(selected)
+
+        return [candidate[1:] for candidate in selected]
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,390 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from .CandidateFilter import CandidateFilter, MIN_LENGTH, MAX_LENGTH
+from .Multifile import Multifile, MultifileException
+from .ProcessDiscovery import find_multifiles
+from .RejectionCache import RejectionCache
+from .Repacker import MultifileRepacker
+from .ScanEngine import ScanEngine
+from .StructDatagram import StructDatagramException
+import asyncio, json, os, threading, traceback
+
+DEFAULT_WORKERS = 2
+MAX_FINISHED_JOBS = 100
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class RPCError(Exception):
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+class MultifileCache(object):
+    # Keeps parsed multifile headers warm between jobs
+
+    def __init__(self, rejection_cache):
+        self.rejection_cache = rejection_cache
+        self.multifiles = {}
+        self.lock = threading.Lock()
+
+    def load(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+
+        with self.lock:
+            cached = self.multifiles.get(path)
+
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        mf = Multifile(self.rejection_cache)
+
+        with open(path, 'rb') as f:
+            mf.load(f)
+
+        with self.lock:
+            self.multifiles[path] = (stamp, mf)
+
+        return mf
+
+    def __len__(self):
+        return len(self.multifiles)
+
+class ScanJob(object):
+
+    def __init__(self, job_id, pid, multifiles):
+        self.id = job_id
+        self.pid = pid
+        self.multifiles = multifiles
+        self.state = 'queued'
+        self.results = []
+        self.keys = []
+        self.warnings = []
+        self.error = None
+        self.candidate_filter = None
+        self.stop_event = threading.Event()
+
+    def add_result(self, target, password):
+        result = {
+            'multifile': target,
+            'password': password.decode('utf-8', 'backslashreplace'),
+            'password_hex': password.hex()
+        }
+        self.results.append(result)
+        return result
+
+    def add_key(self, target, key):
+        result = dict(multifile=target, **key)
+        self.keys.append(result)
+        return result
+
+    def is_done(self):
+        return self.state in ('finished', 'cancelled', 'failed')
+
+    def to_dict(self):
+        return {
+            'job': self.id,
+            'pid': self.pid,
+            'multifiles': self.multifiles,
+            'state': self.state,
+            'results': self.results,
+            'keys': self.keys,
+            'warnings': self.warnings,
+            'error': self.error,
+            'candidates': self.candidate_filter.get_stats() if self.candidate_filter else {}
+        }
+
+class Connection(object):
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    async def send(self, message):
+        if self.writer.is_closing():
+            return
+
+        data = (json.dumps(message) + '\n').encode('utf-8')
+
+        async with self.lock:
+            self.writer.write(data)
+
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+
+    async def notify(self, method, params):
+        await self.send({'jsonrpc': '2.0', 'method': method, 'params': params})
+
+class ScanDaemon(object):
+
+    def __init__(self, socket_path, workers=DEFAULT_WORKERS):
+        self.socket_path = socket_path
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.rejection_cache = RejectionCache()
+        self.multifile_cache = MultifileCache(self.rejection_cache)
+        self.jobs = OrderedDict()
+        self.next_job_id = 1
+        self.pid_locks = {}
+        self.pid_locks_lock = threading.Lock()
+        self.methods = {
+            'scan': self.scan,
+            'status': self.status,
+            'cancel': self.cancel,
+            'load': self.load,
+            'extract': self.extract
+        }
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for job in self.jobs.values():
+                job.stop_event.set()
+
+            self.executor.shutdown(wait=True)
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            # Remove the socket left behind by a previous daemon
+            os.unlink(self.socket_path)
+
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def handle_client(self, reader, writer):
+        connection = Connection(writer)
+        tasks = set()
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                # Requests are handled concurrently, so a long scan does not block status queries
+                task = asyncio.create_task(self.handle_request(connection, line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def handle_request(self, connection, line):
+        request_id = None
+
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RPCError(PARSE_ERROR, 'Parse error')
+
+            if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+                raise RPCError(INVALID_REQUEST, 'Invalid request')
+
+            request_id = request.get('id')
+            method = self.methods.get(request['method'])
+
+            if not method:
+                raise RPCError(METHOD_NOT_FOUND, f'Method not found: {request["method"]}')
+
+            params = request.get('params') or {}
+
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, 'Params must be an object')
+
+            result = await method(connection, params)
+        except RPCError as e:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': e.code, 'message': str(e)}}
+        except Exception as e:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': INTERNAL_ERROR, 'message': str(e), 'data': traceback.format_exc()}}
+        else:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+        await connection.send(response)
+
+    def get_multifiles_param(self, params):
+        multifiles = params.get('multifiles')
+
+        if not isinstance(multifiles, list) or not multifiles or not all(isinstance(f, str) for f in multifiles):
+            raise RPCError(INVALID_PARAMS, 'multifiles must be a list of paths')
+
+        return multifiles
+
+    def get_job_param(self, params):
+        job = self.jobs.get(params.get('job'))
+
+        if not job:
+            raise RPCError(INVALID_PARAMS, f'Unknown job: {params.get("job")}')
+
+        return job
+
+    def create_job(self, pid, multifiles):
+        job = ScanJob(self.next_job_id, pid, multifiles)
+        self.next_job_id += 1
+        self.jobs[job.id] = job
+
+        # Forget the oldest finished jobs
+        finished = [old_job.id for old_job in self.jobs.values() if old_job.is_done()]
+
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+        return job
+
+    def get_pid_lock(self, pid):
+        # Only one scan may attach to a process at a time
+        with self.pid_locks_lock:
+            return self.pid_locks.setdefault(pid, threading.Lock())
+
+    def run_job(self, job, engine):
+        with self.get_pid_lock(job.pid):
+            if job.stop_event.is_set():
+                job.state = 'cancelled'
+                return
+
+            job.state = 'running'
+
+            try:
+                engine.search_memory()
+            except Exception:
+                job.state = 'failed'
+                job.error = traceback.format_exc()
+                return
+
+        job.state = 'cancelled' if job.stop_event.is_set() else 'finished'
+
+    async def scan(self, connection, params):
+        pid = params.get('pid')
+
+        if not isinstance(pid, int):
+            raise RPCError(INVALID_PARAMS, 'pid must be an integer')
+
+        loop = asyncio.get_running_loop()
+
+        if params.get('multifiles') is None:
+            # Scan everything the target has open. Listing it can be slow, so it runs off the
+            # loop, and on the default executor so it does not queue behind running scans.
+            multifiles = await loop.run_in_executor(None, find_multifiles, pid)
+
+            if not multifiles:
+                raise RPCError(INVALID_PARAMS, f'Process {pid} does not have any multifiles open')
+        else:
+            multifiles = self.get_multifiles_param(params)
+
+        first_hit = params.get('first_hit', False)
+
+        if not isinstance(first_hit, bool):
+            raise RPCError(INVALID_PARAMS, 'first_hit must be a boolean')
+
+        key_search = params.get('key_search', False)
+
+        if not isinstance(key_search, bool):
+            raise RPCError(INVALID_PARAMS, 'key_search must be a boolean')
+
+        lengths = [params.get('min_length', MIN_LENGTH), params.get('max_length', MAX_LENGTH)]
+
+        if not all(isinstance(length, int) and length > 0 for length in lengths):
+            raise RPCError(INVALID_PARAMS, 'min_length and max_length must be positive integers')
+
+        job = self.create_job(pid, multifiles)
+        job.candidate_filter = CandidateFilter(*lengths)
+
+        def on_progress(target, password):
+            result = job.add_result(target, password)
+            asyncio.run_coroutine_threadsafe(connection.notify('scan.progress', dict(job=job.id, **result)), loop)
+
+        def on_key(target, key):
+            result = job.add_key(target, key)
+            asyncio.run_coroutine_threadsafe(connection.notify('scan.key', dict(job=job.id, **result)), loop)
+
+        def on_warning(message):
+            job.warnings.append(message)
+            asyncio.run_coroutine_threadsafe(connection.notify('scan.warning', {'job': job.id, 'message': message}), loop)
+
+        engine = ScanEngine(pid, multifiles, job.stop_event, self.rejection_cache, self.multifile_cache.load, first_hit, job.candidate_filter, key_search)
+        engine.on_progress = on_progress
+        engine.on_key = on_key
+        engine.on_warning = on_warning
+        future = loop.run_in_executor(self.executor, self.run_job, job, engine)
+
+        if params.get('wait', True):
+            await future
+
+        return job.to_dict()
+
+    async def status(self, connection, params):
+        if params.get('job') is not None:
+            return self.get_job_param(params).to_dict()
+
+        return {
+            'jobs': [job.to_dict() for job in self.jobs.values()],
+            'multifiles': len(self.multifile_cache),
+            'rejection_cache': self.rejection_cache.get_stats()
+        }
+
+    async def cancel(self, connection, params):
+        job = self.get_job_param(params)
+        job.stop_event.set()
+        return job.to_dict()
+
+    async def load(self, connection, params):
+        loop = asyncio.get_running_loop()
+        results = {}
+
+        for path in self.get_multifiles_param(params):
+            try:
+                # Scans can hold every worker for minutes, so loads run on the default executor
+                mf = await loop.run_in_executor(None, self.multifile_cache.load, path)
+            except (OSError, MultifileException, StructDatagramException) as e:
+                results[path] = {'error': str(e)}
+            else:
+                results[path] = {'nid': mf.nid, 'iteration_count': mf.iteration_count, 'key_length': mf.key_length}
+
+        return results
+
+    async def extract(self, connection, params):
+        source = params.get('multifile')
+        output = params.get('output')
+
+        if not isinstance(source, str) or not isinstance(output, str):
+            raise RPCError(INVALID_PARAMS, 'multifile and output must be paths')
+
+        if isinstance(params.get('password_hex'), str):
+            try:
+                password = bytes.fromhex(params['password_hex'])
+            except ValueError:
+                raise RPCError(INVALID_PARAMS, 'password_hex must be hexadecimal')
+        elif isinstance(params.get('password'), str):
+            password = params['password'].encode('utf-8')
+        else:
+            raise RPCError(INVALID_PARAMS, 'password or password_hex is required')
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            subfiles, size = await loop.run_in_executor(None, MultifileRepacker(source, password).repack, output)
+        except (OSError, MultifileException, StructDatagramException) as e:
+            raise RPCError(INVALID_PARAMS, str(e))
+
+        return {'output': output, 'subfiles': subfiles, 'size': size}
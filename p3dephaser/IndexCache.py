@@ -0,0 +1,106 @@
+from .StructDatagram import StructDatagram, StructDatagramIterator, StructDatagramException
+import hashlib, io, os, struct, threading
+
+INDEX_DIRECTORY = os.path.join(os.path.expanduser('~'), '.p3dephaser', 'index')
+HEADER_HASH_SIZE = 4096 # The multifile header and the start of its index
+CHECKSUM_SIZE = 16
+MAGIC = b'p3dx'
+VERSION = 2 # Version 1 entries did not apply the scale factor
+
+# The cache new multifiles use; None unless it was asked for
+index_cache = None
+
+def enable_index_cache(directory=INDEX_DIRECTORY):
+    global index_cache
+    index_cache = IndexCache(directory)
+    return index_cache
+
+def disable_index_cache():
+    global index_cache
+    index_cache = None
+
+def get_checksum(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=CHECKSUM_SIZE).digest()
+
+class IndexCache(object):
+    # Keeps the parsed index of each multifile in a sidecar directory, so reopening one takes
+    # a single small read instead of walking its subfile chain. An entry is only used while the
+    # size, mtime and first page of the multifile still match. Entries are replaced atomically
+    # and checksummed, so concurrent readers see either a whole entry or none at all.
+
+    def __init__(self, directory=INDEX_DIRECTORY):
+        self.directory = directory
+
+    def get_key(self, f: io.BufferedReader):
+        # Returns (path, key) of an open multifile, or None if it is not a regular file
+        path = getattr(f, 'name', None)
+
+        if not isinstance(path, str):
+            return None
+
+        try:
+            stat = os.fstat(f.fileno())
+        except (OSError, io.UnsupportedOperation):
+            return None
+
+        f.seek(0)
+        header_hash = get_checksum(f.read(HEADER_HASH_SIZE))
+        return os.path.abspath(path), struct.pack('<Qq', stat.st_size, stat.st_mtime_ns) + header_hash
+
+    def get_path(self, path: str) -> str:
+        name = hashlib.blake2b(path.encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f'{name}.idx')
+
+    def load(self, key):
+        # Returns the cached index of this key, or None if there is no current entry
+        path, stamp = key
+
+        try:
+            with open(self.get_path(path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        body = data[:-CHECKSUM_SIZE]
+
+        if len(data) < CHECKSUM_SIZE or get_checksum(body) != data[-CHECKSUM_SIZE:]:
+            return None
+
+        try:
+            di = StructDatagramIterator(body)
+
+            if di.extract_bytes(len(MAGIC)) != MAGIC or di.get_uint16() != VERSION:
+                return None
+
+            if di.get_blob() != path.encode('utf-8', 'surrogateescape') or di.get_blob() != stamp:
+                return None
+
+            return di.extract_bytes(di.get_uint32())
+        except StructDatagramException:
+            return None
+
+    def save(self, key, index: bytes):
+        path, stamp = key
+        dg = StructDatagram()
+        dg.append_data(MAGIC)
+        dg.add_uint16(VERSION)
+        dg.add_blob(path.encode('utf-8', 'surrogateescape'))
+        dg.add_blob(stamp)
+        dg.add_blob32(index)
+        data = dg.get_message()
+
+        cache_path = self.get_path(path)
+        temp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            with open(temp_path, 'wb') as f:
+                f.write(data + get_checksum(data))
+
+            os.replace(temp_path, cache_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
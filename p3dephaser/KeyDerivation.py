@@ -0,0 +1,151 @@
+from . import Tracing
+import hashlib, hmac, os, threading
+
+SHA1_SIZE = 20
+SHA1_BLOCK_SIZE = 64
+SHA1_INITIAL_STATE = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0)
+SHA1_ROUND_CONSTANTS = (0x5A827999, 0x6ED9EBA1, 0x8F1BBCDC, 0xCA62C1D6)
+
+# OpenSSL's PBKDF2 runs in C and releases the GIL, so batches are spread over threads
+OPENSSL_PBKDF2 = getattr(getattr(hashlib, 'pbkdf2_hmac', None), '__module__', None) == '_hashlib'
+MIN_LANES = 64 # Below this many candidates, the NumPy lanes are slower than one by one
+
+executor = None
+executor_lock = threading.Lock()
+
+# NumPy takes longer to import than most scans take to run, so it is only imported for a large batch
+numpy = None
+numpy_available = None
+
+def get_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+        return executor
+
+def import_numpy():
+    global numpy, numpy_available
+
+    if numpy_available is None:
+        try:
+            import numpy
+            numpy_available = True
+        except ImportError:
+            numpy_available = False
+
+    return numpy_available
+
+def PKCS5_PBKDF2_HMAC_SHA1(password: bytes, salt: bytes, iterations: int, dklen: int) -> bytes:
+    num_blocks = -(-dklen // 20)
+    dk = b''
+
+    for i in range(1, num_blocks + 1):
+        u_block = hmac.new(password, salt + i.to_bytes(4, 'big'), hashlib.sha1).digest()
+
+        u_prev = u_block
+
+        for _ in range(iterations - 1):
+            u_block = hmac.new(password, u_block, hashlib.sha1).digest()
+            u_prev = bytes(a ^ b for a, b in zip(u_prev, u_block))
+
+        dk += u_prev
+
+    return dk[:dklen]
+
+def pbkdf2_hmac_sha1(password: bytes, salt: bytes, iterations: int, dklen: int) -> bytes:
+    with Tracing.span('kdf', iterations=iterations):
+        if OPENSSL_PBKDF2:
+            return hashlib.pbkdf2_hmac('sha1', password, salt, iterations, dklen)
+
+        return PKCS5_PBKDF2_HMAC_SHA1(password, salt, iterations, dklen)
+
+def rotate_left(x, n):
+    return (x << numpy.uint32(n)) | (x >> numpy.uint32(32 - n))
+
+def sha1_compress(state, words):
+    # One SHA-1 compression over every lane: state holds five rows and words sixteen rows of uint32
+    w = list(words)
+    a, b, c, d, e = state
+    k0, k1, k2, k3 = (numpy.uint32(k) for k in SHA1_ROUND_CONSTANTS)
+
+    for t in range(80):
+        if t >= 16:
+            w.append(rotate_left(w[t - 3] ^ w[t - 8] ^ w[t - 14] ^ w[t - 16], 1))
+
+        if t < 20:
+            f = ((c ^ d) & b) ^ d
+            k = k0
+        elif t < 40:
+            f = b ^ c ^ d
+            k = k1
+        elif t < 60:
+            f = (b & c) | ((b | c) & d)
+            k = k2
+        else:
+            f = b ^ c ^ d
+            k = k3
+
+        a, b, c, d, e = rotate_left(a, 5) + f + e + k + w[t], a, rotate_left(b, 30), c, d
+
+    return numpy.stack((state[0] + a, state[1] + b, state[2] + c, state[3] + d, state[4] + e))
+
+def to_words(data):
+    # Big endian uint32 rows, one column per lane
+    return data.view('>u4').astype(numpy.uint32).T
+
+def pbkdf2_hmac_sha1_lanes(passwords, salt: bytes, iterations: int, dklen: int):
+    # PBKDF2-HMAC-SHA1 with one NumPy lane per password; every iteration compresses all lanes at once
+    import_numpy()
+    lanes = len(passwords)
+    keys = numpy.zeros((lanes, SHA1_BLOCK_SIZE), dtype=numpy.uint8)
+
+    for i, password in enumerate(passwords):
+        if len(password) > SHA1_BLOCK_SIZE:
+            password = hashlib.sha1(password).digest()
+
+        keys[i, :len(password)] = numpy.frombuffer(password, dtype=numpy.uint8)
+
+    initial_state = numpy.array(SHA1_INITIAL_STATE, dtype=numpy.uint32)[:, None].repeat(lanes, axis=1)
+    inner_state = sha1_compress(initial_state, to_words(keys ^ 0x36))
+    outer_state = sha1_compress(initial_state, to_words(keys ^ 0x5C))
+
+    # Every later message is one digest after the key block, padded to a single block
+    words = numpy.zeros((16, lanes), dtype=numpy.uint32)
+    words[5] = 0x80000000
+    words[15] = (SHA1_BLOCK_SIZE + SHA1_SIZE) * 8
+    blocks = []
+
+    for block in range(1, -(-dklen // SHA1_SIZE) + 1):
+        first = b''.join(hmac.new(password, salt + block.to_bytes(4, 'big'), hashlib.sha1).digest() for password in passwords)
+        u = to_words(numpy.frombuffer(first, dtype=numpy.uint8).reshape(lanes, SHA1_SIZE))
+        result = u.copy()
+
+        for _ in range(iterations - 1):
+            words[:5] = u
+            words[:5] = sha1_compress(inner_state, words)
+            u = sha1_compress(outer_state, words)
+            result ^= u
+
+        blocks.append(result.T)
+
+    derived = numpy.concatenate(blocks, axis=1).astype('>u4').tobytes()
+    size = len(blocks) * SHA1_SIZE
+    return [derived[i * size:i * size + dklen] for i in range(lanes)]
+
+def derive_keys(passwords, salt: bytes, iterations: int, dklen: int):
+    # Derives the keys of many candidate passwords at once, using the fastest backend available
+    passwords = list(passwords)
+
+    if len(passwords) > 1 and OPENSSL_PBKDF2:
+        with Tracing.span('derive_keys', backend='threads', candidates=len(passwords)):
+            return list(get_executor().map(lambda password: pbkdf2_hmac_sha1(password, salt, iterations, dklen), passwords))
+
+    if len(passwords) >= MIN_LANES and import_numpy():
+        with Tracing.span('derive_keys', backend='numpy', candidates=len(passwords)):
+            return pbkdf2_hmac_sha1_lanes(passwords, salt, iterations, dklen)
+
+    return [pbkdf2_hmac_sha1(password, salt, iterations, dklen) for password in passwords]
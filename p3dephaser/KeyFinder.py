@@ -0,0 +1,274 @@
+from .Multifile import Multifile, NID_aes_256_cbc, NID_bf_cbc, MAGIC_HEADER, MAGIC_HEADER_SIZE, UnimplementedEncryptionException, read_encryption_header, load_cipher
+from .KeyDerivation import import_numpy
+from . import KeyDerivation
+from .AES import AES
+from .Blowfish import Blowfish, PI_S_BOXES
+import hashlib, io, os, struct
+
+# An AES-256 key schedule: 15 round keys of four words
+AES_KEY_SIZE = 32
+AES_SCHEDULE_WORDS = 60
+AES_SCHEDULE_SIZE = AES_SCHEDULE_WORDS * 4
+
+# A Blowfish key state: the P-array followed by four S-boxes (OpenSSL's BF_KEY)
+BLOWFISH_P_WORDS = 18
+BLOWFISH_STATE_WORDS = BLOWFISH_P_WORDS + 4 * 256
+BLOWFISH_STATE_SIZE = BLOWFISH_STATE_WORDS * 4
+BLOWFISH_STATE = struct.Struct(f'>{BLOWFISH_STATE_WORDS}I')
+BLOWFISH_ALIGNMENT = 2 # In words; key states live in heap-allocated cipher contexts
+
+# Words of the encrypt schedule that are linear in earlier ones: w[i] = w[i - 8] ^ w[i - 1]
+ENCRYPT_RELATIONS = tuple(i for i in range(8, AES_SCHEDULE_WORDS) if i % 4)
+# The decrypt schedule reverses the rounds and applies InvMixColumns to the inner ones,
+# which keeps the relations between words 4r + c, 4r + c - 1 and 4(r + 2) + c for inner rounds
+DECRYPT_RELATIONS = tuple(4 * r + c for r in range(1, 12) for c in range(1, 4))
+PREFILTER_RELATIONS = 3 # Relations tested on every offset; the rest only on the offsets that pass
+
+BLOWFISH_BATCH_SIZE = 65536 # Key states tested together; bounds the memory of the gathers
+
+# Where found keys are exported; a Blowfish key state is too large to show in a result row
+KEY_DIRECTORY = os.path.join(os.path.expanduser('~'), '.p3dephaser', 'keys')
+FINGERPRINT_SIZE = 8
+
+NID_to_kind = {
+    # Result kind, file extension
+    NID_aes_256_cbc: ('aes_256_key', 'aeskey'),
+    NID_bf_cbc: ('blowfish_state', 'bfstate')
+}
+
+def xtime(value):
+    return ((value << 1) ^ 0x1B) & 0xFF if value & 0x80 else value << 1
+
+def mix_columns(block: bytes) -> bytes:
+    mixed = bytearray()
+
+    for i in range(0, len(block), 4):
+        a0, a1, a2, a3 = block[i:i + 4]
+        b0, b1, b2, b3 = xtime(a0), xtime(a1), xtime(a2), xtime(a3)
+        mixed += bytes((b0 ^ b1 ^ a1 ^ a2 ^ a3, a0 ^ b1 ^ b2 ^ a2 ^ a3, a0 ^ a1 ^ b2 ^ b3 ^ a3, b0 ^ a0 ^ a1 ^ a2 ^ b3))
+
+    return bytes(mixed)
+
+def swap_words(data: bytes) -> bytes:
+    # OpenSSL's portable AES code keeps round keys as native integers; AES-NI keeps them as bytes
+    return b''.join(data[i:i + 4][::-1] for i in range(0, len(data), 4))
+
+def recover_aes_key(window: bytes):
+    # Returns the AES-256 key whose encrypt or decrypt schedule is window, or None
+    for schedule in (window, swap_words(window)):
+        expanded = AES.expand_key(schedule[:AES_KEY_SIZE])
+
+        if expanded == schedule:
+            return schedule[:AES_KEY_SIZE]
+
+        # The decrypt schedule starts with the last round key and ends with the first
+        key = schedule[-16:] + mix_columns(schedule[-32:-16])
+        expanded = AES.expand_key(key)
+        rounds = [schedule[i:i + 16] for i in range(0, AES_SCHEDULE_SIZE, 16)][::-1]
+
+        if rounds[0] == expanded[:16] and rounds[-1] == expanded[-16:] and all(mix_columns(rounds[r]) == expanded[r * 16:r * 16 + 16] for r in range(1, 14)):
+            return key
+
+    return None
+
+def match_relations(relation, relations, count, mask):
+    # Returns the offsets below count where relation is zero at every offset + relations[i]
+    numpy = KeyDerivation.numpy
+
+    for position in relations[:PREFILTER_RELATIONS]:
+        mask &= relation[position:position + count] == 0
+
+    offsets = numpy.flatnonzero(mask)
+
+    if len(offsets):
+        positions = numpy.array(relations[PREFILTER_RELATIONS:])
+        offsets = offsets[(relation[offsets[:, None] + positions] == 0).all(axis=1)]
+
+    return offsets
+
+def find_aes_schedules(words):
+    # Returns the word offsets that may start an AES-256 schedule in either form
+    numpy = KeyDerivation.numpy
+    count = len(words) - AES_SCHEDULE_WORDS + 1
+
+    if count <= 0:
+        return []
+
+    # Zeroed memory satisfies every relation, but real schedules have no zero words there
+    nonzero = (words[8:8 + count] != 0) & (words[AES_SCHEDULE_WORDS - 1:] != 0)
+
+    # forward[k] is zero when w[k + 8] = w[k] ^ w[k + 7]
+    forward = words[8:] ^ words[7:-1] ^ words[:-8]
+    encrypt = match_relations(forward, [i - 8 for i in ENCRYPT_RELATIONS], count, nonzero.copy())
+
+    # backward[k] is zero when w[k + 1] = w[k] ^ w[k + 9]
+    backward = words[1:-8] ^ words[:-9] ^ words[9:]
+    decrypt = match_relations(backward, [i - 1 for i in DECRYPT_RELATIONS], count, nonzero)
+
+    return numpy.union1d(encrypt, decrypt).tolist()
+
+def blowfish_encrypt(words, starts, left, right):
+    # Encrypts one block per key state, with the key state starting at words[starts]
+    numpy = KeyDerivation.numpy
+    s1 = starts + BLOWFISH_P_WORDS
+    s2 = s1 + 256
+    s3 = s2 + 256
+    s4 = s3 + 256
+    # The key setup computes the last S-box pair last, so until then it held the digits of pi
+    last_pair = numpy.array(PI_S_BOXES[3][254:], dtype=numpy.uint32)
+
+    def f(x):
+        d = x & 0xFF
+        s4_value = numpy.where(d >= 254, last_pair[d & 1], words[s4 + d])
+        return ((words[s1 + (x >> 24)] + words[s2 + ((x >> 16) & 0xFF)]) ^ words[s3 + ((x >> 8) & 0xFF)]) + s4_value
+
+    for i in range(0, 16, 2):
+        left = left ^ words[starts + i]
+        right = right ^ f(left) ^ words[starts + i + 1]
+        left = left ^ f(right)
+
+    return right ^ words[starts + 17], left ^ words[starts + 16]
+
+def find_blowfish_states(words):
+    # Returns the word offsets of complete Blowfish key states. The key setup ends by
+    # encrypting S4[252:254] into S4[254:256], which is checked at every candidate offset.
+    numpy = KeyDerivation.numpy
+    count = len(words) - BLOWFISH_STATE_WORDS + 1
+
+    if count <= 0:
+        return []
+
+    # A key state is 1042 pseudorandom words, so it holds no zero word
+    zeros = numpy.concatenate(([0], numpy.cumsum(words == 0)))
+    starts = numpy.arange(0, count, BLOWFISH_ALIGNMENT)
+    starts = starts[zeros[starts + BLOWFISH_STATE_WORDS] == zeros[starts]]
+    found = []
+
+    for i in range(0, len(starts), BLOWFISH_BATCH_SIZE):
+        batch = starts[i:i + BLOWFISH_BATCH_SIZE]
+        s4 = batch + BLOWFISH_P_WORDS + 768
+        left, right = blowfish_encrypt(words, batch, words[s4 + 252], words[s4 + 253])
+        found.extend(batch[(left == words[s4 + 254]) & (right == words[s4 + 255])].tolist())
+
+    return found
+
+class CipherKey(object):
+    # A key found in memory: the raw AES-256 key, or the Blowfish key state, which the
+    # key cannot be recovered from
+
+    def __init__(self, nid, key, address):
+        self.nid = nid
+        self.key = key
+        self.address = address
+        self.path = None
+
+    def get_cipher(self):
+        if self.nid == NID_bf_cbc:
+            state = BLOWFISH_STATE.unpack(self.key)
+            S = [state[i:i + 256] for i in range(BLOWFISH_P_WORDS, BLOWFISH_STATE_WORDS, 256)]
+            return Blowfish.from_state(state[:BLOWFISH_P_WORDS], S)
+
+        return load_cipher(self.nid)(self.key)
+
+    def get_kind(self):
+        return NID_to_kind[self.nid][0]
+
+    def get_fingerprint(self):
+        return hashlib.blake2b(self.key, digest_size=FINGERPRINT_SIZE).hexdigest()
+
+    def export(self, directory=KEY_DIRECTORY):
+        # Writes the raw key to a file named after its fingerprint and returns the path
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.get_fingerprint()}.{NID_to_kind[self.nid][1]}')
+
+        with open(path, 'wb') as f:
+            f.write(self.key)
+
+        self.path = path
+        return path
+
+    def to_dict(self):
+        # How the key is reported; unlike a password, a Blowfish key state is only referred to
+        result = {'kind': self.get_kind(), 'fingerprint': self.get_fingerprint(), 'address': self.address}
+
+        if self.nid == NID_aes_256_cbc:
+            result['key_hex'] = self.key.hex()
+
+        if self.path is not None:
+            result['path'] = self.path
+
+        return result
+
+class KeyFinder(object):
+    # Finds expanded cipher keys in memory, in the style of aeskeyfind. A client that wipes
+    # its password after mounting still keeps the key schedule of an open subfile's cipher.
+    # Every chunk is tested in one vectorized pass, so NumPy is required.
+
+    # Bytes a chunk has to share with the next, so no key state is split between two chunks
+    overlap = BLOWFISH_STATE_SIZE - 4
+
+    def __init__(self):
+        if not import_numpy():
+            raise ImportError('NumPy is required to search for keys')
+
+    def search(self, address, data, size=None):
+        # Returns the CipherKeys starting in the first size bytes of data, which starts at address
+        numpy = KeyDerivation.numpy
+        size = len(data) if size is None else size
+        words = numpy.frombuffer(data, dtype='<u4', count=len(data) // 4)
+        keys = []
+
+        for offset in find_aes_schedules(words):
+            if offset * 4 >= size:
+                continue
+
+            key = recover_aes_key(bytes(data[offset * 4:offset * 4 + AES_SCHEDULE_SIZE]))
+
+            if key is not None:
+                keys.append(CipherKey(NID_aes_256_cbc, key, address + offset * 4))
+
+        for offset in find_blowfish_states(words):
+            if offset * 4 < size:
+                state = BLOWFISH_STATE.pack(*words[offset:offset + BLOWFISH_STATE_WORDS].tolist())
+                keys.append(CipherKey(NID_bf_cbc, state, address + offset * 4))
+
+        return keys
+
+def read_key_checks(path):
+    # Returns (subfile name, nid, key length, IV, first block) of every encrypted subfile.
+    # Panda3D salts the key with the IV of each subfile, so a key opens one subfile.
+    mf = Multifile()
+    checks = []
+
+    with io.open(path, 'rb') as f:
+        mf.load_header(f)
+
+        for subfile in mf.load_subfiles(f):
+            if not subfile.is_encrypted() or subfile.is_signature():
+                continue
+
+            try:
+                nid, key_length, _, iv, data = read_encryption_header(f, subfile.address)
+            except UnimplementedEncryptionException:
+                continue
+
+            checks.append((subfile.name, nid, key_length, iv, data))
+
+    return checks
+
+def find_subfiles(key: CipherKey, checks):
+    # Returns the names of the subfiles the key opens
+    cipher = None
+    names = []
+
+    for name, nid, key_length, iv, data in checks:
+        if nid != key.nid or (nid == NID_aes_256_cbc and key_length != AES_KEY_SIZE):
+            continue
+
+        if cipher is None:
+            cipher = key.get_cipher()
+
+        if next(cipher.decrypt_cbc(data, iv))[:MAGIC_HEADER_SIZE] == MAGIC_HEADER:
+            names.append(name)
+
+    return names
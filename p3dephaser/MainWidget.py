@@ -1,10 +1,17 @@
-from PySide6.QtCore import QThreadPool
-from PySide6.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QLabel, QPushButton, QListWidget, QMessageBox, QLineEdit, QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog
-from PySide6.QtGui import QIcon, QColor
+from PySide6.QtCore import Qt, QThreadPool
+from PySide6.QtWidgets import QWidget, QHBoxLayout, QVBoxLayout, QLabel, QPushButton, QListWidget, QListWidgetItem, QMessageBox, QLineEdit, QTableView, QHeaderView, QFileDialog, QCheckBox
+from PySide6.QtGui import QIcon, QColor, QFont
+from .ProcessDiscovery import ProcessDiscovery
+from .ProcessWorker import ProcessWorker, MultifileWorker
+from .ResultTableModel import ResultTableModel
 from .ScanWorker import ScanWorker
-import psutil, threading, os
+import threading, os
 
 TITLE = 'Panda3D Dephaser'
+KEY_KINDS = {
+    'aes_256_key': 'AES-256 key',
+    'blowfish_state': 'Blowfish key state'
+}
 
 class MainWidget(QWidget):
 
@@ -29,6 +36,11 @@ class MainWidget(QWidget):
         self.refresh_button.clicked.connect(self.refresh_processes)
         self.refresh_button.setFixedSize(100, 23)
 
+        self.process_filter_box = QLineEdit(self)
+        self.process_filter_box.setPlaceholderText('Type to filter processes...')
+        self.process_filter_box.setClearButtonEnabled(True)
+        self.process_filter_box.textChanged.connect(self.filter_processes)
+
         self.multifile_widget = QWidget()
         self.multifile_layout = QHBoxLayout(self.multifile_widget)
         self.multifile_layout.setContentsMargins(0, 0, 0, 0)
@@ -37,10 +49,20 @@ class MainWidget(QWidget):
         self.multifile_box.setEnabled(False)
         self.browse_button = QPushButton('Browse')
         self.browse_button.clicked.connect(self.browse)
+        self.detect_button = QPushButton('Detect')
+        self.detect_button.setToolTip('Use the multifiles the chosen process has open')
+        self.detect_button.clicked.connect(self.detect_multifiles)
 
         self.multifile_layout.addWidget(self.multifile_label)
         self.multifile_layout.addWidget(self.multifile_box)
         self.multifile_layout.addWidget(self.browse_button)
+        self.multifile_layout.addWidget(self.detect_button)
+
+        self.first_hit_box = QCheckBox('Stop at the first password of every multifile')
+        self.first_hit_box.setToolTip('Move on to the next multifile as soon as a password opens it, and try that password on the next multifiles first.\nLeave this off for multifiles with several passwords.')
+
+        self.key_search_box = QCheckBox('Search for cipher keys when no password is found')
+        self.key_search_box.setToolTip('For games that wipe the password after mounting: look for the expanded keys of open subfiles instead.\nEvery key found opens a single subfile. Requires NumPy.')
 
         self.scan_button = QPushButton('Scan')
         self.scan_button.clicked.connect(self.begin_scan)
@@ -52,27 +74,31 @@ class MainWidget(QWidget):
         self.process_header_layout.addWidget(self.github_label)
         self.process_header_layout.addWidget(self.refresh_button)
 
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(3)
+        self.result_model = ResultTableModel(self)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
+        self.result_table.setWordWrap(False)
+        self.result_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
         self.result_table.horizontalHeader().setStretchLastSection(True)
         self.result_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
 
-        for i, header in enumerate(('Process', 'Multifile', 'Password')):
-            self.result_table.setHorizontalHeaderItem(i, QTableWidgetItem(header))
-
-        self.result_table_rows = []
-
         self.base_layout = QVBoxLayout(self)
         self.base_layout.setContentsMargins(15, 15, 15, 15)
         self.base_layout.addWidget(self.process_header_widget)
+        self.base_layout.addWidget(self.process_filter_box)
         self.base_layout.addWidget(self.process_list_box)
         self.base_layout.addWidget(self.multifile_widget)
+        self.base_layout.addWidget(self.first_hit_box)
+        self.base_layout.addWidget(self.key_search_box)
         self.base_layout.addWidget(self.scan_button)
         self.base_layout.addWidget(self.result_table)
 
+        self.thread_pool = QThreadPool()
+        self.process_discovery = ProcessDiscovery()
+        self.process_worker = None
+        self.multifile_worker = None
         self.refresh_processes()
 
-        self.thread_pool = QThreadPool()
         self.worker = None
         self.process_name = None
         self.multifiles = None
@@ -85,23 +111,57 @@ class MainWidget(QWidget):
         palette.setColor(self.backgroundRole(), color)
         self.setPalette(palette)
 
-    def get_processes(self):
-        processes = []
+    def refresh_processes(self):
+        if self.process_worker:
+            return
 
-        for proc in psutil.process_iter():
-            processes.append(proc.as_dict(attrs=['pid', 'name']))
+        # Processes are discovered in the background, Panda3D clients first
+        self.refresh_button.setEnabled(False)
+        self.process_worker = ProcessWorker(self.process_discovery)
+        self.process_worker.signals.finished.connect(self.processes_refreshed)
+        self.thread_pool.start(self.process_worker)
 
-        processes.sort(key=lambda process: (process['name'].lower(), process['pid']))
-        return processes
+    def processes_refreshed(self, processes):
+        self.process_worker = None
+        self.refresh_button.setEnabled(True)
 
-    def refresh_processes(self):
+        selected = self.get_selected_process()
+        self.process_list_box.setUpdatesEnabled(False)
         self.process_list_box.clear()
-        processes = self.get_processes()
+
+        bold_font = QFont(self.process_list_box.font())
+        bold_font.setBold(True)
 
         for process in processes:
-            name = process['name']
-            pid = process['pid']
-            self.process_list_box.addItem(f'{name} (PID {pid})')
+            item = QListWidgetItem(f'{process.name} (PID {process.pid})')
+            item.setData(Qt.ItemDataRole.UserRole, (process.name, process.pid))
+
+            if process.is_panda:
+                item.setFont(bold_font)
+                item.setToolTip('Panda3D process')
+
+            self.process_list_box.addItem(item)
+
+            if selected and selected[1] == process.pid:
+                item.setSelected(True)
+
+        self.filter_processes(self.process_filter_box.text())
+        self.process_list_box.setUpdatesEnabled(True)
+
+    def filter_processes(self, text):
+        text = text.lower()
+
+        for i in range(self.process_list_box.count()):
+            item = self.process_list_box.item(i)
+            item.setHidden(text not in item.text().lower())
+
+    def get_selected_process(self):
+        items = self.process_list_box.selectedItems()
+
+        if not items:
+            return None
+
+        return items[0].data(Qt.ItemDataRole.UserRole)
 
     def browse(self):
         files, _ = QFileDialog.getOpenFileNames(self, 'Open multifiles', '', "Multifiles (*.mf *.ef);;All Files (*)", options=QFileDialog.ReadOnly)
@@ -109,6 +169,35 @@ class MainWidget(QWidget):
         if not files:
             return
 
+        self.set_multifiles(files)
+
+    def detect_multifiles(self):
+        process = self.get_selected_process()
+
+        if not process:
+            QMessageBox.warning(self, TITLE, 'Please choose a process from the list!')
+            return
+
+        if self.multifile_worker:
+            return
+
+        # The target's open files are listed in the background
+        self.detect_button.setEnabled(False)
+        self.multifile_worker = MultifileWorker(*process)
+        self.multifile_worker.signals.finished.connect(self.multifiles_detected)
+        self.thread_pool.start(self.multifile_worker)
+
+    def multifiles_detected(self, name, files):
+        self.multifile_worker = None
+        self.detect_button.setEnabled(True)
+
+        if not files:
+            QMessageBox.warning(self, TITLE, f'{name} does not have any multifiles open.')
+            return
+
+        self.set_multifiles(files)
+
+    def set_multifiles(self, files):
         self.multifiles = files
         self.multifile_names = [os.path.basename(f) for f in files]
         self.multifile_box.setText(' '.join(self.multifile_names))
@@ -119,15 +208,13 @@ class MainWidget(QWidget):
             self.scan_button.setEnabled(False)
             return
 
-        items = self.process_list_box.selectedItems()
+        process = self.get_selected_process()
 
-        if not items:
+        if not process:
             QMessageBox.warning(self, TITLE, 'Please choose a process from the list!')
             return
 
-        process = items[0].text()[:-1].split(' ')
-        self.process_name = ' '.join(process[:-2])
-        pid = int(process[-1])
+        self.process_name, pid = process
 
         if not self.multifile_names:
             QMessageBox.warning(self, TITLE, 'Please choose some multifiles to target!')
@@ -140,26 +227,34 @@ class MainWidget(QWidget):
             return
 
         self.count = 0
+        self.key_count = 0
 
         self.setWindowTitle(f'{TITLE} - Scanning...')
         self.scan_button.setText('Stop')
 
-        self.worker = ScanWorker(self, pid, self.multifiles)
+        self.worker = ScanWorker(self, pid, self.multifiles, self.first_hit_box.isChecked(), self.key_search_box.isChecked())
         self.worker.signals.finished.connect(self.scan_over)
         self.worker.signals.warning.connect(self.report_warning)
         self.worker.signals.error.connect(self.error_occurred)
         self.worker.signals.progress.connect(self.report_progress)
+        self.worker.signals.key.connect(self.report_key)
 
         self.thread_pool.start(self.worker)
 
     def scan_over(self):
+        self.result_model.flush()
         self.worker = None
         self.stop_event.clear()
 
         self.scan_button.setText('Scan')
         self.scan_button.setEnabled(True)
         self.setWindowTitle(TITLE)
-        QMessageBox.information(self, TITLE, f'Scan complete!\n\n{self.count} password{"s have" if self.count != 1 else " has"} been found.')
+        message = f'{self.count} password{"s have" if self.count != 1 else " has"} been found.'
+
+        if self.key_count:
+            message += f'\n{self.key_count} subfile{"s" if self.key_count != 1 else ""} can be opened with a cipher key found in memory.'
+
+        QMessageBox.information(self, TITLE, f'Scan complete!\n\n{message}')
 
     def report_warning(self, warning):
         QMessageBox.warning(self, TITLE, warning)
@@ -174,17 +269,19 @@ class MainWidget(QWidget):
         except:
             password = str(password)
 
-        values = (self.process_name, multifile, password)
-
-        if values in self.result_table_rows:
-            return
+        values = (self.process_name, multifile, 'Password', password)
 
-        self.result_table_rows.append(values)
+        if self.result_model.add_row(values):
+            self.count += 1
 
-        self.count += 1
-        index = self.result_table.rowCount()
+    def report_key(self, target, key):
+        # Keys only open one subfile, and a Blowfish key state is only shown by its fingerprint
+        if 'key_hex' in key:
+            value = key['key_hex']
+        else:
+            value = f'{key["fingerprint"]} (saved to {key["path"]})' if 'path' in key else f'{key["fingerprint"]} (not saved)'
 
-        self.result_table.insertRow(index)
+        values = (self.process_name, target, KEY_KINDS.get(key['kind'], key['kind']), value)
 
-        for i, value in enumerate(values):
-            self.result_table.setItem(index, i, QTableWidgetItem(value))
+        if self.result_model.add_row(values):
+            self.key_count += 1
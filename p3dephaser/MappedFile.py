@@ -0,0 +1,113 @@
+import io, mmap, os
+
+WINDOW_SIZE = 64 * 1024 * 1024 # Bytes mapped at a time, so 32-bit builds can read archives past 4 GB
+
+class MappedFile(io.RawIOBase):
+    # A read-only file view through a sliding mmap window. Reads inside the window are plain
+    # memory copies; a read outside of it maps a new window around the requested range.
+
+    def __init__(self, f, window_size=WINDOW_SIZE):
+        io.RawIOBase.__init__(self)
+        self.fd = f.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self.window_size = max(mmap.ALLOCATIONGRANULARITY, window_size - window_size % mmap.ALLOCATIONGRANULARITY)
+        self.window = None
+        self.window_start = 0
+        self.window_end = 0
+        self.position = 0
+
+    def fileno(self):
+        return self.fd
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET and offset >= 0:
+            self.position = offset
+            return offset
+
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position: {position}')
+
+        self.position = position
+        return position
+
+    def map_window(self, offset, size):
+        if self.window is not None:
+            self.window.close()
+
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        length = min(max(self.window_size, offset + size - start), self.size - start)
+        self.window = mmap.mmap(self.fd, length, access=mmap.ACCESS_READ, offset=start)
+        self.window_start = start
+        self.window_end = start + length
+
+    def pread(self, offset, size):
+        size = max(0, min(size, self.size - offset))
+
+        if not size:
+            return b''
+
+        if offset < self.window_start or offset + size > self.window_end:
+            self.map_window(offset, size)
+
+        start = offset - self.window_start
+        return self.window[start:start + size]
+
+    def read(self, size=-1):
+        position = self.position
+
+        if size and size > 0 and self.window_start <= position and position + size <= self.window_end:
+            # Inside the current window; this is the common case and stays free of method calls
+            self.position = position + size
+            start = position - self.window_start
+            return self.window[start:start + size]
+
+        if size is None or size < 0:
+            size = self.size - position
+
+        data = self.pread(position, size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.window is not None:
+            self.window.close()
+            self.window = None
+            self.window_start = self.window_end = 0
+
+        io.RawIOBase.close(self)
+
+def open_mapped(f, window_size=WINDOW_SIZE):
+    # Returns a MappedFile over f, or None if f can not be mapped (pipes, in-memory files, empty files)
+    try:
+        mapped = MappedFile(f, window_size)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+    if not mapped.size:
+        return None
+
+    return mapped
@@ -0,0 +1,200 @@
+import bisect, ctypes, ctypes.util, errno, sys
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+IOV_MAX = 1024 # The kernel refuses more iovecs per call
+COALESCE_GAP = 4096 # Ranges closer than this are read together
+COALESCE_MAX_SIZE = 1024 * 1024
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+def get_process_vm_readv():
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        process_vm_readv = libc.process_vm_readv
+    except (OSError, AttributeError):
+        return None
+
+    process_vm_readv.argtypes = [
+        ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_ulong,
+        ctypes.POINTER(iovec), ctypes.c_ulong, ctypes.c_ulong
+    ]
+    process_vm_readv.restype = ctypes.c_ssize_t
+    return process_vm_readv
+
+class MemoryRegions(object):
+
+    def __init__(self, regions):
+        regions = sorted(regions)
+        self.starts = [start for start, _ in regions]
+        self.stops = [stop for _, stop in regions]
+
+    def find(self, address, size=1):
+        # Returns the index of the region containing the whole range, or -1
+        index = bisect.bisect_right(self.starts, address) - 1
+
+        if index < 0 or address + size > self.stops[index]:
+            return -1
+
+        return index
+
+    def contains(self, address, size=1):
+        return self.find(address, size) != -1
+
+    def __iter__(self):
+        return zip(self.starts, self.stops)
+
+    def __len__(self):
+        return len(self.starts)
+
+class MemoryReader(object):
+    # Reads many small ranges into one reused buffer.
+    # The returned memoryviews are only valid until the next read.
+
+    def __init__(self, process, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.process = process
+        self.allocate(buffer_size)
+
+    def allocate(self, size):
+        # Views handed out earlier may still pin the old buffer, so never resize it in place
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def ensure_capacity(self, size):
+        if size > len(self.buffer):
+            self.allocate(max(size, len(self.buffer) * 2))
+
+    def read(self, address, size):
+        return self.read_many([(address, size)])[0]
+
+    def read_many(self, requests):
+        self.ensure_capacity(sum(size for _, size in requests))
+        results = []
+        offset = 0
+
+        for address, size in requests:
+            target = (ctypes.c_ubyte * size).from_buffer(self.buffer, offset)
+
+            try:
+                self.process.read_memory(address, target)
+            except OSError:
+                results.append(None)
+            else:
+                results.append(self.view[offset:offset + size])
+
+            offset += size
+
+        return results
+
+    def read_coalesced(self, requests, regions=None, max_gap=COALESCE_GAP, max_size=COALESCE_MAX_SIZE):
+        # Sort the ranges by address and merge neighbours into a few large reads.
+        # Merged reads never cross region boundaries, so one bad range cannot spoil the rest.
+        order = sorted(range(len(requests)), key=lambda i: requests[i][0])
+        spans = []
+
+        for i in order:
+            address, size = requests[i]
+            region = regions.find(address, size) if regions else -1
+
+            if spans:
+                span = spans[-1]
+                stop = max(span[1], address + size)
+
+                if region == span[2] and address <= span[1] + max_gap and stop - span[0] <= max_size:
+                    span[1] = stop
+                    span[3].append(i)
+                    continue
+
+            spans.append([address, address + size, region, [i]])
+
+        views = self.read_many([(start, stop - start) for start, stop, _, _ in spans])
+        results = [None] * len(requests)
+
+        for (start, _, _, indices), view in zip(spans, views):
+            if view is None:
+                continue
+
+            for i in indices:
+                address, size = requests[i]
+                results[i] = view[address - start:address - start + size]
+
+        return results
+
+class LinuxMemoryReader(MemoryReader):
+    # Batches reads into scatter-gather process_vm_readv calls
+
+    def __init__(self, process, pid, process_vm_readv, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.pid = pid
+        self.process_vm_readv = process_vm_readv
+        self.local_iov = (iovec * IOV_MAX)()
+        self.remote_iov = (iovec * IOV_MAX)()
+        MemoryReader.__init__(self, process, buffer_size)
+
+    def allocate(self, size):
+        MemoryReader.allocate(self, size)
+        # Keeping the ctypes view alive pins the buffer in place
+        self.buffer_pin = (ctypes.c_char * size).from_buffer(self.buffer)
+        self.buffer_address = ctypes.addressof(self.buffer_pin)
+
+    def read_many(self, requests):
+        self.ensure_capacity(sum(size for _, size in requests))
+        results = [None] * len(requests)
+        offsets = []
+        offset = 0
+
+        for _, size in requests:
+            offsets.append(offset)
+            offset += size
+
+        start = 0
+
+        while start < len(requests):
+            count = min(len(requests) - start, IOV_MAX)
+
+            for i in range(count):
+                address, size = requests[start + i]
+                self.local_iov[i].iov_base = self.buffer_address + offsets[start + i]
+                self.local_iov[i].iov_len = size
+                self.remote_iov[i].iov_base = address
+                self.remote_iov[i].iov_len = size
+
+            read = self.process_vm_readv(self.pid, self.local_iov, count, self.remote_iov, count, 0)
+
+            if read < 0:
+                error = ctypes.get_errno()
+
+                if error != errno.EFAULT:
+                    raise OSError(error, f'process_vm_readv failed for PID {self.pid}')
+
+                # The very first range is unreadable
+                start += 1
+                continue
+
+            # Ranges are filled in order; the first incomplete one failed
+            done = 0
+
+            for i in range(start, start + count):
+                size = requests[i][1]
+
+                if read < size:
+                    break
+
+                read -= size
+                results[i] = self.view[offsets[i]:offsets[i] + size]
+                done += 1
+
+            # Skip past the range that faulted
+            start += done if done == count else done + 1
+
+        return results
+
+def open_reader(process, pid, buffer_size=DEFAULT_BUFFER_SIZE):
+    process_vm_readv = get_process_vm_readv()
+
+    if process_vm_readv:
+        return LinuxMemoryReader(process, pid, process_vm_readv, buffer_size)
+
+    return MemoryReader(process, buffer_size)
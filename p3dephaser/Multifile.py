@@ -1,25 +1,45 @@
-from .StructDatagram import StructDatagramIterator
-from .Blowfish import Blowfish
-from .AES import AES
-import io, hashlib, hmac
+from .StructDatagram import StructDatagram, StructDatagramIterator, StructDatagramException
+from .RejectionCache import RejectionCache
+from . import IndexCache
+from .KeyDerivation import PKCS5_PBKDF2_HMAC_SHA1, pbkdf2_hmac_sha1, derive_keys
+from .MappedFile import open_mapped
+import io, hashlib, struct
 
 # Multifile flags
+SF_deleted = 0x0001
+SF_index_invalid = 0x0002
+SF_data_invalid = 0x0004
 SF_compressed = 0x0008
 SF_encrypted = 0x0010
 SF_signature = 0x0020
+SF_text = 0x0040
 
 # Panda3D specific encryption header
 MAGIC_HEADER = b'crypty'
 MAGIC_HEADER_SIZE = len(MAGIC_HEADER)
 ITERATION_FACTOR = 100
+ENCRYPTION_HEADER_SIZE = 6 # NID, key length and iteration count; the IV follows
+
+# Address, length, flags, original length, timestamp and name length of a subfile in the index cache
+SUBFILE_INDEX = struct.Struct('<QQHQIH')
 
 # OpenSSL encryption algorithms
 NID_bf_cbc = 91
 NID_aes_256_cbc = 427
 
+# Ciphers are imported the first time a subfile needs them. The imports stay
+# literal, so that frozen builds still find and bundle both modules.
+def import_blowfish():
+    from .Blowfish import Blowfish
+    return Blowfish
+
+def import_aes():
+    from .AES import AES
+    return AES
+
 NID_to_cipher = {
-    NID_bf_cbc: Blowfish,
-    NID_aes_256_cbc: AES
+    NID_bf_cbc: import_blowfish,
+    NID_aes_256_cbc: import_aes
 }
 NID_to_sizes = {
     # IV size, block size
@@ -27,26 +47,46 @@ NID_to_sizes = {
     NID_aes_256_cbc: (16, 16)
 }
 
-def PKCS5_PBKDF2_HMAC_SHA1(password: bytes, salt: bytes, iterations: int, dklen: int) -> bytes:
-    num_blocks = -(-dklen // 20)
-    dk = b''
+def load_cipher(nid: int):
+    import_cipher = NID_to_cipher.get(nid)
 
-    for i in range(1, num_blocks + 1):
-        u_block = hmac.new(password, salt + i.to_bytes(4, 'big'), hashlib.sha1).digest()
+    if not import_cipher:
+        raise UnimplementedEncryptionException(f'Unimplemented encryption algorithm: {nid}')
 
-        u_prev = u_block
+    return import_cipher()
 
-        for _ in range(iterations - 1):
-            u_block = hmac.new(password, u_block, hashlib.sha1).digest()
-            u_prev = bytes(a ^ b for a, b in zip(u_prev, u_block))
+def check_key(nid: int, key: bytes, iv: bytes, data: bytes) -> bool:
+    block = next(load_cipher(nid)(key).decrypt_cbc(data, iv))
+    return block[:MAGIC_HEADER_SIZE] == MAGIC_HEADER
 
-        dk += u_prev
+def verify_password(nid: int, key_length: int, iteration_count: int, iv: bytes, data: bytes, password: bytes) -> bool:
+    return check_key(nid, pbkdf2_hmac_sha1(password, iv, iteration_count, key_length), iv, data)
 
-    return dk[:dklen]
+def verify_passwords(nid: int, key_length: int, iteration_count: int, iv: bytes, data: bytes, passwords) -> list:
+    # Derives the keys of all candidates in one batch and returns a mask of the correct ones
+    return [check_key(nid, key, iv, data) for key in derive_keys(passwords, iv, iteration_count, key_length)]
 
 class MultifileException(Exception):
     pass
 
+def read_encryption_header(f: io.BufferedReader, address: int):
+    # Returns (nid, key length, iteration count, IV, first ciphertext block) of an encrypted subfile
+    f.seek(address)
+    di = StructDatagramIterator(f.read(ENCRYPTION_HEADER_SIZE + 32))
+    nid = di.get_uint16()
+    key_length = di.get_uint16()
+    iteration_count = (di.get_uint16() * ITERATION_FACTOR) + 1
+
+    if nid not in NID_to_sizes:
+        raise UnimplementedEncryptionException(f'Unimplemented encryption algorithm: {nid}')
+
+    iv_size, block_size = NID_to_sizes[nid]
+    iv = di.extract_bytes(iv_size)
+    return nid, key_length, iteration_count, iv, di.extract_bytes(block_size)
+
+def get_cipher(nid: int, password: bytes, iv: bytes, iteration_count: int, key_length: int):
+    return load_cipher(nid)(pbkdf2_hmac_sha1(password, iv, iteration_count, key_length))
+
 class NotEncryptedException(MultifileException):
     pass
 
@@ -59,17 +99,21 @@ class Subfile(object):
         self.address = -1
         self.length = -1
         self.flags = 0
+        self.original_length = 0
+        self.timestamp = 0
+        self.name = ''
 
-    def load(self, f: io.BufferedReader, address: int) -> int:
+    def load(self, f: io.BufferedReader, address: int, has_timestamp: bool = True, scale_factor: int = 1) -> int:
         f.seek(address)
-        di = StructDatagramIterator(f.read(18))
+        di = StructDatagramIterator(f.read(24))
 
-        next_address = di.get_uint32()
+        # Addresses are stored in units of the scale factor, which is how multifiles grow past 4 GB
+        next_address = di.get_uint32() * scale_factor
         
         if next_address == 0:
             return 0
         
-        self.address = di.get_uint32()
+        self.address = di.get_uint32() * scale_factor
         self.length = di.get_uint32()
         self.flags = di.get_uint16()
 
@@ -78,8 +122,62 @@ class Subfile(object):
         else:
             self.original_length = self.length
 
+        if has_timestamp:
+            self.timestamp = di.get_uint32()
+
+        # Filenames are obfuscated by inverting every byte
+        name_length = di.get_uint16()
+        name = di.get_remaining_bytes()[:name_length]
+
+        if len(name) < name_length:
+            name += f.read(name_length - len(name))
+
+        self.name = bytes(255 - c for c in name).decode('utf-8', 'backslashreplace')
         return next_address
 
+    def write(self, dg, next_address: int, has_timestamp: bool = True, scale_factor: int = 1):
+        if next_address % scale_factor or self.address % scale_factor:
+            raise MultifileException(f'Subfile is not aligned to the scale factor: {self.name}')
+
+        dg.add_uint32(next_address // scale_factor)
+        dg.add_uint32(self.address // scale_factor)
+        dg.add_uint32(self.length)
+        dg.add_uint16(self.flags)
+
+        if (self.flags & (SF_compressed | SF_encrypted)) != 0:
+            dg.add_uint32(self.original_length)
+
+        if has_timestamp:
+            dg.add_uint32(self.timestamp)
+
+        name = self.name.encode('utf-8')
+        dg.add_uint16(len(name))
+        dg.append_data(bytes(255 - c for c in name))
+
+    def write_index(self, dg):
+        # The compact form kept by the index cache
+        name = self.name.encode('utf-8')
+        dg.append_data(SUBFILE_INDEX.pack(self.address, self.length, self.flags, self.original_length, self.timestamp, len(name)))
+        dg.append_data(name)
+
+    def read_index(self, di):
+        self.address, self.length, self.flags, self.original_length, self.timestamp, name_length = SUBFILE_INDEX.unpack(di.extract_view(SUBFILE_INDEX.size))
+        self.name = di.extract_bytes(name_length).decode('utf-8')
+
+    def get_index_size(self, has_timestamp: bool = True):
+        size = 16 + len(self.name.encode('utf-8'))
+
+        if (self.flags & (SF_compressed | SF_encrypted)) != 0:
+            size += 4
+
+        if has_timestamp:
+            size += 4
+
+        return size
+
+    def is_deleted(self):
+        return self.flags & (SF_deleted | SF_index_invalid | SF_data_invalid) != 0
+
     def is_compressed(self):
         return self.flags & SF_compressed != 0
 
@@ -95,13 +193,22 @@ class Subfile(object):
 class Multifile(object):
     HEADER = b'pmf\0\n\r'
 
-    def __init__(self):
+    def __init__(self, rejection_cache=None, index_cache=None):
         self.major_version = 0
         self.minor_version = 0
         self.scale_factor = 0
         self.timestamp = 0
+        self.index_address = 0
+        self.subfiles = []
+        self.nid = None
+        self.rejection_cache = rejection_cache if rejection_cache is not None else RejectionCache()
+        self.index_cache = index_cache if index_cache is not None else IndexCache.index_cache
 
-    def load(self, f: io.BufferedReader):
+    def has_timestamps(self):
+        return (self.major_version, self.minor_version) >= (1, 1)
+
+    def load_header(self, f: io.BufferedReader):
+        f.seek(0)
         data = f.read(18)
 
         di = StructDatagramIterator(data)
@@ -113,61 +220,190 @@ class Multifile(object):
         self.major_version = di.get_int16()
         self.minor_version = di.get_int16()
         self.scale_factor = di.get_uint32()
-        self.timestamp = di.get_uint32()
 
-        next_address = di.get_current_index()
-        encrypted_subfile = None
+        if self.scale_factor == 0:
+            raise MultifileException('Invalid multifile scale factor.')
 
-        while next_address != 0:
-            subfile = Subfile()
-            next_address = subfile.load(f, next_address)
+        if self.has_timestamps():
+            self.timestamp = di.get_uint32()
+
+        self.index_address = self.normalize_address(di.get_current_index())
+
+    def normalize_address(self, address: int) -> int:
+        # Rounds up to the next address the scale factor can express
+        return -(-address // self.scale_factor) * self.scale_factor
+
+    def iter_subfiles(self, f: io.BufferedReader):
+        # The index is read through an mmap window where possible, which saves a system call per entry
+        mapped = open_mapped(f)
+        next_address = self.index_address
+
+        try:
+            while next_address != 0:
+                subfile = Subfile()
+                next_address = subfile.load(mapped or f, next_address, self.has_timestamps(), self.scale_factor)
+
+                if next_address != 0:
+                    yield subfile
+        finally:
+            if mapped:
+                mapped.close()
+
+    def load_subfiles(self, f: io.BufferedReader):
+        key, cached = self.load_cached_index(f)
+
+        if not cached:
+            self.subfiles = list(self.iter_subfiles(f))
+            self.save_cached_index(key)
+
+        return self.subfiles
 
+    def load(self, f: io.BufferedReader):
+        self.load_header(f)
+        key, cached = self.load_cached_index(f)
+
+        if cached and self.nid is not None:
+            self.fingerprint = self.get_fingerprint()
+            return
+
+        if key is not None and not cached:
+            # The whole chain is walked once, so the next load is a single read
+            self.subfiles = list(self.iter_subfiles(f))
+
+        encrypted_subfile = None
+
+        for subfile in (self.subfiles if key is not None else self.iter_subfiles(f)):
             if subfile.is_encrypted() and not subfile.is_signature():
                 encrypted_subfile = subfile
                 break
 
+        if encrypted_subfile:
+            self.nid, self.key_length, self.iteration_count, self.iv, self.data = read_encryption_header(f, encrypted_subfile.address)
+
+        if encrypted_subfile or not cached:
+            self.save_cached_index(key)
+
         if not encrypted_subfile:
             raise NotEncryptedException('Multifile is not encrypted!')
 
-        f.seek(encrypted_subfile.address)
-        data = f.read(38)
+        self.fingerprint = self.get_fingerprint()
 
-        di = StructDatagramIterator(data)
-        self.nid = di.get_uint16()
-        self.key_length = di.get_uint16()
-        self.iteration_count = (di.get_uint16() * ITERATION_FACTOR) + 1
+    def write_index(self, dg):
+        # The parsed header, subfile table and password check data, for the index cache
+        dg.add_int16(self.major_version)
+        dg.add_int16(self.minor_version)
+        dg.add_uint32(self.scale_factor)
+        dg.add_uint32(self.timestamp)
+        dg.add_uint32(self.index_address)
+        dg.add_bool(self.nid is not None)
 
-        if self.nid not in NID_to_sizes:
-            raise UnimplementedEncryptionException(f'Unimplemented encryption algorithm: {self.nid}')
-        
-        iv_size, block_size = NID_to_sizes[self.nid]
-        self.iv = di.extract_bytes(iv_size)
-        self.data = di.extract_bytes(block_size)
+        if self.nid is not None:
+            dg.add_uint16(self.nid)
+            dg.add_uint16(self.key_length)
+            dg.add_uint32(self.iteration_count)
+            dg.add_blob(self.iv)
+            dg.add_blob(self.data)
 
-        self.invalid_passwords = []
+        dg.add_uint32(len(self.subfiles))
+
+        for subfile in self.subfiles:
+            subfile.write_index(dg)
+
+    def read_index(self, di):
+        self.major_version = di.get_int16()
+        self.minor_version = di.get_int16()
+        self.scale_factor = di.get_uint32()
+        self.timestamp = di.get_uint32()
+        self.index_address = di.get_uint32()
+
+        if di.get_bool():
+            self.nid = di.get_uint16()
+            self.key_length = di.get_uint16()
+            self.iteration_count = di.get_uint32()
+            self.iv = di.get_blob()
+            self.data = di.get_blob()
+
+        subfiles = []
+
+        for _ in range(di.get_uint32()):
+            subfile = Subfile()
+            subfile.read_index(di)
+            subfiles.append(subfile)
+
+        self.subfiles = subfiles
+
+    def load_cached_index(self, f: io.BufferedReader):
+        # Returns (cache key, whether the index was restored from the cache)
+        if self.index_cache is None:
+            return None, False
+
+        key = self.index_cache.get_key(f)
+        index = self.index_cache.load(key) if key is not None else None
+
+        if index is None:
+            return key, False
+
+        try:
+            self.read_index(StructDatagramIterator(index))
+        except (StructDatagramException, UnicodeDecodeError):
+            self.nid = None
+            return key, False
+
+        return key, True
+
+    def save_cached_index(self, key):
+        if key is None:
+            return
+
+        dg = StructDatagram()
+        self.write_index(dg)
+        self.index_cache.save(key, dg.get_message())
+
+    def get_header(self):
+        # Everything needed to verify a password, in a form that can be sent to other processes
+        return (self.nid, self.key_length, self.iteration_count, self.iv, self.data)
+
+    def get_fingerprint(self):
+        # Identifies the encryption parameters, so rejections can be shared between multifiles
+        parameters = struct.pack('<HHI', self.nid, self.key_length, self.iteration_count)
+        return hashlib.blake2b(parameters + self.iv + self.data, digest_size=32).digest()
 
     def is_password(self, password: bytes):
         if not password:
             return False
 
-        if password in self.invalid_passwords:
+        if self.rejection_cache.is_rejected(password, self.fingerprint):
             return False
 
-        key = PKCS5_PBKDF2_HMAC_SHA1(password, self.iv, self.iteration_count, self.key_length)
-
-        cipher = NID_to_cipher.get(self.nid)
-        
-        if not cipher:
-            raise UnimplementedEncryptionException(f'Unimplemented encryption algorithm: {self.nid}')
-
-        block = next(cipher(key).decrypt_cbc(self.data, self.iv))
-        result = block[:MAGIC_HEADER_SIZE] == MAGIC_HEADER
+        result = verify_password(*self.get_header(), password)
 
         if not result:
-            self.invalid_passwords.append(password)
+            self.rejection_cache.reject(password, self.fingerprint)
 
         return result
 
+    def is_password_batch(self, passwords) -> list:
+        # Returns a mask of the correct passwords; every distinct candidate is only verified once
+        mask = [False] * len(passwords)
+        pending = {}
+
+        for i, password in enumerate(passwords):
+            if password and not self.rejection_cache.is_rejected(password, self.fingerprint):
+                pending.setdefault(password, []).append(i)
+
+        if not pending:
+            return mask
+
+        for (password, indices), result in zip(pending.items(), verify_passwords(*self.get_header(), pending.keys())):
+            if not result:
+                self.rejection_cache.reject(password, self.fingerprint)
+                continue
+
+            for i in indices:
+                mask[i] = True
+
+        return mask
+
     def __str__(self):
         return f'Panda3D Multifile version {self.major_version}.{self.minor_version} with scale factor {self.scale_factor} and timestamp {self.timestamp}'.format(
             self.major_version, self.minor_version,
@@ -0,0 +1,141 @@
+import hashlib, json, os, threading
+
+PROFILE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.p3dephaser', 'profiles')
+BUILD_ID_HEADER_SIZE = 4096 # ELF build-id notes and PE timestamps live in the first page
+POINTER_ALIGNMENT = 8
+
+def get_build_id(path: str) -> str:
+    # Fingerprint the executable by its size and headers, so every build gets its own profile
+    with open(path, 'rb') as f:
+        header = f.read(BUILD_ID_HEADER_SIZE)
+        size = os.fstat(f.fileno()).st_size
+
+    digest = hashlib.sha1(size.to_bytes(8, 'little'))
+    digest.update(header)
+    return digest.hexdigest()
+
+class OffsetProfile(object):
+
+    def __init__(self, build_id=None):
+        self.build_id = build_id
+        self.offsets = {}
+        self.object_offsets = {}
+        self.abis = {}
+        self.dirty = False
+
+    @classmethod
+    def for_executable(cls, path):
+        try:
+            build_id = get_build_id(path)
+        except (OSError, TypeError):
+            # Without a build-id, the profile only lasts for this run
+            return cls()
+
+        profile = cls(build_id)
+        profile.load()
+        return profile
+
+    def get_path(self):
+        return os.path.join(PROFILE_DIRECTORY, f'{self.build_id}.json')
+
+    def load(self):
+        if not self.build_id:
+            return
+
+        try:
+            with open(self.get_path(), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.offsets = {int(offset): hits for offset, hits in data.get('offsets', {}).items()}
+        self.object_offsets = {int(offset): hits for offset, hits in data.get('object_offsets', {}).items()}
+        self.abis = dict(data.get('abis', {}))
+
+    def save(self):
+        if not self.build_id or not self.dirty:
+            return
+
+        data = {
+            'offsets': {str(offset): hits for offset, hits in self.offsets.items()},
+            'object_offsets': {str(offset): hits for offset, hits in self.object_offsets.items()},
+            'abis': self.abis
+        }
+        path = self.get_path()
+        # Daemon jobs are threads of one process, so each needs its own temporary file
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        try:
+            os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+
+            with open(temp_path, 'w') as f:
+                json.dump(data, f)
+
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+            return
+
+        self.dirty = False
+
+    def record_abis(self, abis):
+        # Every layout that decoded the password counts, not only the first one tried
+        for abi in abis:
+            self.abis[abi] = self.abis.get(abi, 0) + 1
+
+    def record_hit(self, offset: int, abis):
+        self.offsets[offset] = self.offsets.get(offset, 0) + 1
+        self.record_abis(abis)
+        self.dirty = True
+
+    def record_object_hit(self, offset: int, abis):
+        # Offsets of the password from the start of a Multifile object found through its vtable
+        self.object_offsets[offset] = self.object_offsets.get(offset, 0) + 1
+        self.record_abis(abis)
+        self.dirty = True
+
+    def get_known_object_offsets(self):
+        return sorted(self.object_offsets, key=lambda offset: (-self.object_offsets[offset], offset))
+
+    def get_known_offsets(self):
+        return sorted(self.offsets, key=lambda offset: (-self.offsets[offset], abs(offset)))
+
+    def get_known_abis(self):
+        return sorted(self.abis, key=lambda abi: -self.abis[abi])
+
+    def iter_offsets(self, low: int, high: int):
+        # Known offsets first, then pointer-aligned offsets widening around them,
+        # and finally whatever remains of the full sweep
+        seen = set()
+        anchors = [offset for offset in self.get_known_offsets() if low <= offset < high]
+
+        for offset in anchors:
+            seen.add(offset)
+            yield offset
+
+        if not anchors:
+            anchors = [0]
+
+        for distance in range(0, high - low, POINTER_ALIGNMENT):
+            for anchor in anchors:
+                for offset in (anchor - distance, anchor + distance):
+                    if low <= offset < high and offset not in seen:
+                        seen.add(offset)
+                        yield offset
+
+        for offset in range(low, high):
+            if offset not in seen:
+                yield offset
+
+    def iter_object_offsets(self, size: int, alignment: int):
+        # Object fields are pointer-aligned, so only aligned offsets are swept after the known ones
+        known = [offset for offset in self.get_known_object_offsets() if 0 <= offset < size]
+        yield from known
+
+        for offset in range(0, size, alignment):
+            if offset not in known:
+                yield offset
@@ -0,0 +1,202 @@
+import os, threading
+
+PROC_DIRECTORY = '/proc'
+PANDA_LIBRARIES = ('libpanda', 'libp3')
+MULTIFILE_EXTENSIONS = ('.mf', '.ef')
+COMM_LENGTH = 15 # The kernel truncates process names to this length
+# Executables in these directories are never Panda3D clients, so their libraries are not listed.
+# /usr/bin is not one of them, since games are often run by its Python.
+SYSTEM_DIRECTORIES = ('/system/', '/library/apple/', '/usr/libexec/', '/usr/sbin/', '/sbin/')
+
+class ProcessInfo(object):
+
+    def __init__(self, pid, name, is_panda):
+        self.pid = pid
+        self.name = name
+        self.is_panda = is_panda
+
+    def get_sort_key(self):
+        return (not self.is_panda, self.name.lower(), self.pid)
+
+def is_panda_library(path):
+    return os.path.basename(path).lower().startswith(PANDA_LIBRARIES)
+
+def is_multifile(path):
+    return path.lower().endswith(MULTIFILE_EXTENSIONS)
+
+def get_system_directories():
+    windows = os.environ.get('SystemRoot')
+
+    if windows:
+        return SYSTEM_DIRECTORIES + (windows.replace('\\', '/').rstrip('/').lower() + '/',)
+
+    return SYSTEM_DIRECTORIES
+
+def may_be_panda_executable(path):
+    # The cheap check before a process's libraries are listed, which is slow on Windows. An
+    # executable that cannot be read belongs to another user or the system, whose libraries
+    # cannot be listed either.
+    if not path:
+        return False
+
+    return not path.replace('\\', '/').lower().startswith(get_system_directories())
+
+def read_stat(pid):
+    # Returns (name, start time, virtual size) from /proc/<pid>/stat
+    with open(f'{PROC_DIRECTORY}/{pid}/stat', 'rb') as f:
+        stat = f.read()
+
+    # The name may contain spaces and parentheses, so split around the last one
+    name_start = stat.index(b'(')
+    name_end = stat.rindex(b')')
+    name = stat[name_start + 1:name_end].decode('utf-8', 'replace')
+    fields = stat[name_end + 2:].split()
+    return name, int(fields[19]), int(fields[20])
+
+def read_full_name(pid, name):
+    if len(name) < COMM_LENGTH:
+        return name
+
+    try:
+        with open(f'{PROC_DIRECTORY}/{pid}/cmdline', 'rb') as f:
+            executable = f.read().split(b'\0', 1)[0].decode('utf-8', 'replace')
+    except OSError:
+        return name
+
+    executable = os.path.basename(executable)
+    return executable if executable.startswith(name) else name
+
+def list_mapped_files(pid):
+    try:
+        with open(f'{PROC_DIRECTORY}/{pid}/maps', 'r', errors='replace') as f:
+            for line in f:
+                fields = line.split(None, 5)
+
+                if len(fields) == 6:
+                    yield fields[5].rstrip('\n')
+    except OSError:
+        return
+
+def list_open_files(pid):
+    fd_directory = f'{PROC_DIRECTORY}/{pid}/fd'
+
+    try:
+        fds = os.listdir(fd_directory)
+    except OSError:
+        return
+
+    for fd in fds:
+        try:
+            yield os.readlink(os.path.join(fd_directory, fd))
+        except OSError:
+            continue
+
+def is_panda_process(pid):
+    if any(is_panda_library(path) for path in list_mapped_files(pid)):
+        return True
+
+    return any(is_multifile(path) for path in list_open_files(pid))
+
+def resolve_process_path(pid, path):
+    # Files opened inside a container or chroot are only reachable through the process root
+    if os.path.exists(path):
+        return path
+
+    rooted_path = f'{PROC_DIRECTORY}/{pid}/root{path}'
+    return rooted_path if os.path.exists(rooted_path) else None
+
+def find_multifiles(pid):
+    # Lists the multifiles a process has open or mapped
+    if os.path.isdir(PROC_DIRECTORY):
+        paths = list(list_open_files(pid)) + list(list_mapped_files(pid))
+        paths = [resolve_process_path(pid, path) for path in paths if is_multifile(path)]
+    else:
+        import psutil
+
+        try:
+            process = psutil.Process(pid)
+            paths = [f.path for f in process.open_files()] + [m.path for m in process.memory_maps()]
+        except (psutil.Error, OSError):
+            paths = []
+
+        paths = [path for path in paths if is_multifile(path) and os.path.exists(path)]
+
+    return sorted(set(path for path in paths if path))
+
+class ProcessDiscovery(object):
+    # Lists processes with Panda3D clients first. Processes are only inspected again
+    # when they are new or their address space has changed size.
+
+    def __init__(self):
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def list_processes(self):
+        with self.lock:
+            if os.path.isdir(PROC_DIRECTORY):
+                processes = self.list_proc_processes()
+            else:
+                processes = self.list_psutil_processes()
+
+        processes.sort(key=ProcessInfo.get_sort_key)
+        return processes
+
+    def list_proc_processes(self):
+        cache = {}
+        processes = []
+
+        for entry in os.scandir(PROC_DIRECTORY):
+            if not entry.name.isdigit():
+                continue
+
+            pid = int(entry.name)
+
+            try:
+                name, start_time, size = read_stat(pid)
+            except (OSError, ValueError, IndexError):
+                # The process has exited in the meantime
+                continue
+
+            stamp = (start_time, size)
+            cached = self.cache.get(pid)
+
+            if cached and cached[0] == stamp:
+                info = cached[1]
+            else:
+                info = ProcessInfo(pid, read_full_name(pid, name), is_panda_process(pid))
+
+            cache[pid] = (stamp, info)
+            processes.append(info)
+
+        self.cache = cache
+        return processes
+
+    def list_psutil_processes(self):
+        import psutil
+
+        cache = {}
+        processes = []
+
+        for proc in psutil.process_iter(['pid', 'name', 'create_time', 'exe']):
+            pid = proc.info['pid']
+            stamp = proc.info['create_time']
+            cached = self.cache.get(pid)
+
+            if cached and cached[0] == stamp:
+                info = cached[1]
+            else:
+                is_panda = False
+
+                if may_be_panda_executable(proc.info['exe']):
+                    try:
+                        is_panda = any(is_panda_library(mapping.path) for mapping in proc.memory_maps())
+                    except (psutil.Error, OSError):
+                        pass
+
+                info = ProcessInfo(pid, proc.info['name'] or '', is_panda)
+
+            cache[pid] = (stamp, info)
+            processes.append(info)
+
+        self.cache = cache
+        return processes
@@ -0,0 +1,43 @@
+from PySide6.QtCore import QObject, QRunnable, Signal
+from .ProcessDiscovery import find_multifiles
+import traceback
+
+class ProcessWorkerSignals(QObject):
+    finished = Signal(list)
+
+class ProcessWorker(QRunnable):
+
+    def __init__(self, discovery):
+        QRunnable.__init__(self)
+        self.discovery = discovery
+        self.signals = ProcessWorkerSignals()
+
+    def run(self):
+        try:
+            processes = self.discovery.list_processes()
+        except:
+            traceback.print_exc()
+            processes = []
+
+        self.signals.finished.emit(processes)
+
+class MultifileWorkerSignals(QObject):
+    finished = Signal(str, list)
+
+class MultifileWorker(QRunnable):
+    # Walks the open files and mappings of a process, which can be slow for large or containerized targets
+
+    def __init__(self, name, pid):
+        QRunnable.__init__(self)
+        self.name = name
+        self.pid = pid
+        self.signals = MultifileWorkerSignals()
+
+    def run(self):
+        try:
+            files = find_multifiles(self.pid)
+        except:
+            traceback.print_exc()
+            files = []
+
+        self.signals.finished.emit(self.name, files)
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+import hashlib, threading
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+KEY_SIZE = 16
+ENTRY_SIZE = 160 # Approximate cost of one OrderedDict entry with a 16 byte key
+
+def make_key(password: bytes, fingerprint: bytes) -> bytes:
+    # Fixed-size keys keep the memory cost of each entry constant
+    return hashlib.blake2b(password, digest_size=KEY_SIZE, key=fingerprint[:64]).digest()
+
+class RejectionCache(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max(1, max_bytes // ENTRY_SIZE)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def is_rejected(self, password: bytes, fingerprint: bytes) -> bool:
+        key = make_key(password, fingerprint)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True
+
+            self.misses += 1
+            return False
+
+    def reject(self, password: bytes, fingerprint: bytes):
+        key = make_key(password, fingerprint)
+
+        with self.lock:
+            self.entries[key] = None
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries
+            }
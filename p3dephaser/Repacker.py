@@ -0,0 +1,229 @@
+from .Multifile import Multifile, Subfile, MultifileException, read_encryption_header, get_cipher
+from .Multifile import NID_to_sizes, ENCRYPTION_HEADER_SIZE, MAGIC_HEADER, MAGIC_HEADER_SIZE, SF_encrypted
+from .StructDatagram import StructDatagram
+from . import Tracing
+import io, os
+
+CHUNK_SIZE = 65536 # Bytes decrypted or copied at a time; a multiple of every cipher block size
+MAX_WORD = 0xFFFFFFFF # Addresses are stored as 32-bit multiples of the scale factor, lengths as 32-bit byte counts
+HEADER_SIZE = 18
+
+# The version written by the repacker, understood by every Panda3D release since 1.1
+MAJOR_VERSION = 1
+MINOR_VERSION = 1
+
+def ignore(*args):
+    pass
+
+def copy_range(source_fd, destination_fd, offset, length):
+    # Appends length bytes from offset in the source to the destination, in the kernel where possible
+    if length and hasattr(os, 'copy_file_range'):
+        try:
+            while length:
+                copied = os.copy_file_range(source_fd, destination_fd, min(length, CHUNK_SIZE * 16), offset)
+
+                if not copied:
+                    raise MultifileException('Multifile is truncated.')
+
+                offset += copied
+                length -= copied
+        except OSError:
+            # Not supported between these files, continue with sendfile
+            pass
+
+    if length and hasattr(os, 'sendfile'):
+        try:
+            while length:
+                copied = os.sendfile(destination_fd, source_fd, offset, min(length, CHUNK_SIZE * 16))
+
+                if not copied:
+                    raise MultifileException('Multifile is truncated.')
+
+                offset += copied
+                length -= copied
+        except OSError:
+            pass
+
+    while length:
+        data = os.pread(source_fd, min(length, CHUNK_SIZE), offset)
+
+        if not data:
+            raise MultifileException('Multifile is truncated.')
+
+        os.write(destination_fd, data)
+        offset += len(data)
+        length -= len(data)
+
+class EncryptedSubfile(object):
+    # The encryption parameters of one subfile; every subfile has its own IV, and so its own key
+
+    def __init__(self, f, subfile, password):
+        self.nid, self.key_length, self.iteration_count, self.iv, first_block = read_encryption_header(f, subfile.address)
+        iv_size, self.block_size = NID_to_sizes[self.nid]
+        self.address = subfile.address + ENCRYPTION_HEADER_SIZE + iv_size
+        self.ciphertext_length = subfile.length - ENCRYPTION_HEADER_SIZE - iv_size
+
+        if self.ciphertext_length < self.block_size or self.ciphertext_length % self.block_size:
+            raise MultifileException(f'Invalid encrypted subfile: {subfile.name}')
+
+        self.cipher = get_cipher(self.nid, password, self.iv, self.iteration_count, self.key_length)
+
+        # Fail before anything is written if the password is wrong
+        if next(self.cipher.decrypt_cbc(first_block, self.iv))[:MAGIC_HEADER_SIZE] != MAGIC_HEADER:
+            raise MultifileException(f'Incorrect password for subfile: {subfile.name}')
+
+        self.plaintext_length = self.ciphertext_length - self.get_padding(f, subfile) - MAGIC_HEADER_SIZE
+
+    def get_padding(self, f, subfile):
+        # Only the last block has to be decrypted to learn the PKCS#7 padding
+        if self.ciphertext_length == self.block_size:
+            last_iv = self.iv
+            f.seek(self.address)
+        else:
+            f.seek(self.address + self.ciphertext_length - self.block_size * 2)
+            last_iv = f.read(self.block_size)
+
+        block = b''.join(self.cipher.decrypt_cbc(f.read(self.block_size), last_iv))
+        padding = block[-1]
+
+        if not 0 < padding <= self.block_size or block[-padding:] != bytes([padding]) * padding:
+            raise MultifileException(f'Incorrect password for subfile: {subfile.name}')
+
+        if self.ciphertext_length - padding < MAGIC_HEADER_SIZE:
+            raise MultifileException(f'Invalid encrypted subfile: {subfile.name}')
+
+        return padding
+
+    def decrypt(self, f, destination_fd):
+        # Streams the plaintext without the magic header and padding into the destination
+        iv = self.iv
+        remaining = self.ciphertext_length
+        skip = MAGIC_HEADER_SIZE
+        left = self.plaintext_length
+        f.seek(self.address)
+
+        while remaining:
+            chunk = f.read(min(remaining, CHUNK_SIZE))
+
+            if len(chunk) < min(remaining, CHUNK_SIZE):
+                raise MultifileException('Multifile is truncated.')
+
+            remaining -= len(chunk)
+            plaintext = b''.join(self.cipher.decrypt_cbc(chunk, iv))
+            iv = chunk[-self.block_size:]
+
+            plaintext = plaintext[skip:left + skip]
+            skip = 0
+            left -= len(plaintext)
+            os.write(destination_fd, plaintext)
+
+class MultifileRepacker(object):
+    # Writes a decrypted copy of a multifile that stock Panda3D can mount.
+    # The output is written sequentially and only one chunk of data is held at a time.
+
+    def __init__(self, source, password):
+        self.source = source
+        self.password = password
+        self.on_subfile = ignore
+
+    def repack(self, destination):
+        mf = Multifile()
+
+        with io.open(self.source, 'rb') as f:
+            mf.load_header(f)
+            subfiles = [subfile for subfile in mf.load_subfiles(f) if not subfile.is_deleted() and not subfile.is_signature()]
+            encrypted = {}
+
+            for subfile in subfiles:
+                if subfile.is_encrypted():
+                    encrypted[subfile] = EncryptedSubfile(f, subfile, self.password)
+
+            # Data is read back in source order, so the source is read sequentially too
+            data_order = sorted(subfiles, key=lambda subfile: subfile.address)
+            repacked = {subfile: self.get_repacked_subfile(subfile, encrypted.get(subfile)) for subfile in subfiles}
+            repacked_index = [repacked[subfile] for subfile in subfiles]
+            repacked_data = [repacked[subfile] for subfile in data_order]
+            scale_factor, index_addresses, end_address = self.get_layout(repacked_index, repacked_data)
+
+            dg = StructDatagram()
+            dg.append_data(Multifile.HEADER)
+            dg.add_int16(MAJOR_VERSION)
+            dg.add_int16(MINOR_VERSION)
+            dg.add_uint32(scale_factor)
+            dg.add_uint32(mf.timestamp)
+
+            # Every index entry after the first is referenced by address, so it starts on a scale boundary
+            for subfile, address, next_address in zip(repacked_index, index_addresses, index_addresses[1:]):
+                dg.pad_bytes(address - dg.get_length())
+                subfile.write(dg, next_address, True, scale_factor)
+
+            dg.pad_bytes(index_addresses[-1] - dg.get_length())
+            dg.add_uint32(0)
+
+            with io.open(destination, 'wb', buffering=0) as out:
+                out.write(dg.get_message())
+                address = dg.get_length()
+
+                for i, (subfile, repacked_subfile) in enumerate(zip(data_order, repacked_data)):
+                    out.write(bytes(repacked_subfile.address - address))
+                    address = repacked_subfile.address + repacked_subfile.length
+
+                    with Tracing.span('repack_subfile', subfile=subfile.name, length=subfile.length):
+                        if subfile in encrypted:
+                            encrypted[subfile].decrypt(f, out.fileno())
+                        else:
+                            copy_range(f.fileno(), out.fileno(), subfile.address, subfile.length)
+
+                    self.on_subfile(subfile.name, i + 1, len(data_order))
+
+        return len(subfiles), end_address
+
+    def get_layout(self, repacked_index, repacked_data):
+        # Returns (scale factor, index entry addresses ending with the terminator, end address).
+        # The repacked subfiles get their data addresses. The scale factor starts at 1 and only
+        # grows when the archive passes 4 GB, the way Panda3D stores large multifiles.
+        for subfile in repacked_data:
+            if subfile.length > MAX_WORD:
+                raise MultifileException(f'Subfile is larger than 4 GB: {subfile.name}')
+
+        scale_factor = 1
+
+        while True:
+            align = lambda address: -(-address // scale_factor) * scale_factor
+            index_addresses = []
+            address = HEADER_SIZE
+
+            for subfile in repacked_index:
+                address = align(address)
+                index_addresses.append(address)
+                address += subfile.get_index_size()
+
+            address = align(address)
+            index_addresses.append(address)
+            address += 4
+
+            for subfile in repacked_data:
+                subfile.address = address = align(address)
+                address += subfile.length
+
+            last_address = max(index_addresses[-1], repacked_data[-1].address if repacked_data else 0)
+
+            if last_address // scale_factor <= MAX_WORD:
+                return scale_factor, index_addresses, address
+
+            # Padding grows with the scale factor, so try again until every address fits
+            scale_factor = max(scale_factor + 1, -(-last_address // MAX_WORD))
+
+    def get_repacked_subfile(self, subfile, encrypted):
+        repacked = Subfile()
+        repacked.length = subfile.length
+        repacked.flags = subfile.flags
+        repacked.original_length = subfile.original_length
+        repacked.timestamp = subfile.timestamp
+        repacked.name = subfile.name
+
+        if encrypted:
+            repacked.length = encrypted.plaintext_length
+            repacked.flags &= ~SF_encrypted
+
+        return repacked
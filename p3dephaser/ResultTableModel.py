@@ -0,0 +1,68 @@
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+
+FLUSH_INTERVAL = 100 # Milliseconds to coalesce incoming results for
+
+class ResultTableModel(QAbstractTableModel):
+    HEADERS = ('Process', 'Multifile', 'Kind', 'Value')
+
+    def __init__(self, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.rows = []
+        self.row_index = set()
+        self.pending_rows = []
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return None
+
+        return self.rows[index.row()][index.column()]
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+
+        return None
+
+    def add_row(self, values):
+        # Returns False for duplicates; new rows are inserted in batches by the flush timer
+        if values in self.row_index:
+            return False
+
+        self.row_index.add(values)
+        self.pending_rows.append(values)
+
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+        return True
+
+    def flush(self):
+        self.flush_timer.stop()
+
+        if not self.pending_rows:
+            return
+
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(self.pending_rows) - 1)
+        self.rows.extend(self.pending_rows)
+        self.pending_rows = []
+        self.endInsertRows()
+
+    def clear(self):
+        self.flush_timer.stop()
+        self.beginResetModel()
+        self.rows = []
+        self.row_index = set()
+        self.pending_rows = []
+        self.endResetModel()
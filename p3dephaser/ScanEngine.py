@@ -0,0 +1,587 @@
+from .Multifile import Multifile, MultifileException, NotEncryptedException, UnimplementedEncryptionException
+from .StructDatagram import StructDatagramException
+from .OffsetProfile import OffsetProfile
+from .RejectionCache import RejectionCache
+from .MemoryReader import MemoryRegions, open_reader
+from .StringLayout import STRING_LAYOUTS, detect_string_layouts, describes_string
+from .VtableLocator import VtableLocator
+from .CandidateFilter import CandidateFilter
+from . import Tracing
+from concurrent.futures import ThreadPoolExecutor
+import queue, re, string, threading
+import io, os
+
+MULTIFILE_STRUCT_SIZE = 1800 # The maximum size of the multifile struct
+SWEEP_BATCH_SIZE = 32 # How many candidates are verified together
+SWEEP_WINDOW_SIZE = 256 # How many offsets are read, filtered and ranked together
+LOADER_THREADS = 8
+SEARCH_CHUNK_SIZE = 16 * 1024 * 1024 # Bytes of a region searched at a time; bounds memory use and the time to stop
+MATCH_QUEUE_SIZE = 256 # Matches the background search may get ahead of the verification by
+QUEUE_POLL_INTERVAL = 0.1
+
+PRINTABLE_CHARS = string.printable.encode('utf-8')[:-5]
+
+def ignore(*args):
+    pass
+
+def get_abis(strings, offset, password):
+    # Returns every layout that decoded the password at this offset. The candidate filter
+    # drops duplicates, so the candidate itself only carries the first layout tried.
+    return sorted(set(abi for string_offset, abi, value in strings if string_offset == offset and value == password))
+
+class ScanEngine(object):
+    # The scan itself, free of any GUI, so that both the Qt worker and the daemon can drive it
+
+    def __init__(self, pid, multifiles, stop_event=None, rejection_cache=None, multifile_loader=None, first_hit=False, candidate_filter=None, key_search=False):
+        self.pid = pid
+        self.multifiles = multifiles
+        self.multifile_names = [os.path.basename(f) for f in self.multifiles]
+        self.stop_event = stop_event or threading.Event()
+        self.multifile_loader = multifile_loader or self.load_multifile
+        self.on_progress = ignore
+        self.on_warning = ignore
+        # Called with (target, key dict) for every cipher key the key search finds
+        self.on_key = ignore
+        # In first hit mode, a multifile is done as soon as one password opens it
+        self.first_hit = first_hit
+        # Multifiles no password was found for are searched for expanded cipher keys
+        self.key_search = key_search
+        self.confirmed_passwords = []
+        self.profile = None
+        self.rejection_cache = rejection_cache if rejection_cache is not None else RejectionCache()
+        self.candidate_filter = candidate_filter if candidate_filter is not None else CandidateFilter()
+        # Strings and objects are read through reader; whole regions are searched through
+        # search_reader, and through stream_reader from the background search. Each keeps
+        # its buffer for the whole scan.
+        self.reader = None
+        self.search_reader = None
+        self.stream_reader = None
+        self.regions = None
+        self.chunk_size = SEARCH_CHUNK_SIZE
+        self.set_layouts(STRING_LAYOUTS)
+        self.layouts_confirmed = False
+
+    def load_multifile(self, path):
+        mf = Multifile(self.rejection_cache)
+
+        with io.open(path, 'rb', buffering=4096) as f:
+            mf.load(f)
+
+        return mf
+
+    def try_load_multifile(self, path):
+        try:
+            return self.multifile_loader(path), None
+        except (OSError, MultifileException, StructDatagramException) as e:
+            # Discovered lists can hold stale paths and files that only look like multifiles
+            return None, e
+
+    def load_multifiles(self):
+        # Headers are read in parallel, warnings are reported in order
+        with ThreadPoolExecutor(max_workers=min(LOADER_THREADS, len(self.multifiles) or 1)) as executor:
+            loaded = list(executor.map(self.try_load_multifile, self.multifiles))
+
+        multifiles = []
+
+        for multifile_name, (mf, error) in zip(self.multifile_names, loaded):
+            if isinstance(error, NotEncryptedException):
+                self.on_warning(f'{multifile_name} is not an encrypted multifile.')
+            elif isinstance(error, UnimplementedEncryptionException):
+                self.on_warning(f'{multifile_name} contains an encryption algorithm that has not been implemented.')
+            elif isinstance(error, (StructDatagramException, MultifileException)):
+                self.on_warning(f'{multifile_name} is a malformed multifile and was skipped.')
+            elif isinstance(error, OSError):
+                self.on_warning(f'{multifile_name} could not be read and was skipped: {error.strerror or error}')
+            else:
+                multifiles.append((multifile_name, mf))
+
+        return multifiles
+
+    def get_executable(self):
+        import psutil
+
+        try:
+            return psutil.Process(self.pid).exe()
+        except (psutil.Error, OSError):
+            return None
+
+    def get_libraries(self):
+        import psutil
+
+        try:
+            return [mapping.path for mapping in psutil.Process(self.pid).memory_maps()]
+        except (psutil.Error, OSError):
+            return []
+
+    def set_layouts(self, layouts):
+        self.layouts = layouts
+        self.string_size = max(layout.size for layout in layouts)
+
+    def detect_layouts(self, path):
+        # Decode only the string ABIs this target can actually use
+        layouts = detect_string_layouts(path, self.get_libraries(), self.profile.get_known_abis())
+        self.set_layouts(layouts or STRING_LAYOUTS)
+
+    def confirm_layouts(self, occurrences, target, value_addr):
+        # The filename string we already found tells us which layout the target uses
+        confirmed_layouts = []
+        confirmed_occurrences = []
+
+        for layout in self.layouts:
+            layout_occurrences = []
+            addresses = occurrences.get(layout.name, [])
+
+            for addr, arr in zip(addresses, self.reader.read_many([(addr, layout.size) for addr in addresses])):
+                if arr is not None and describes_string(layout, arr, addr, target, value_addr):
+                    layout_occurrences.append(addr)
+
+            if layout_occurrences:
+                confirmed_layouts.append(layout)
+                confirmed_occurrences.extend(layout_occurrences)
+
+        if not confirmed_layouts:
+            # Fall back to every plausible layout
+            return sorted(set(addr for addrs in occurrences.values() for addr in addrs))
+
+        self.set_layouts(confirmed_layouts)
+        self.layouts_confirmed = True
+        return sorted(set(confirmed_occurrences))
+
+    def iter_chunks(self, reader, regions, overlap):
+        # Yields (address, size, data) for every chunk of the regions. Chunks are read into
+        # the reader's reused buffer, and each also reads the first overlap bytes of the next.
+        for start, stop in regions:
+            for chunk_start in range(start, stop, self.chunk_size):
+                if self.stop_event.is_set():
+                    return
+
+                chunk_size = min(self.chunk_size, stop - chunk_start)
+
+                with Tracing.span('search_region', start=chunk_start, size=chunk_size):
+                    data = reader.read(chunk_start, min(chunk_size + overlap, stop - chunk_start))
+
+                if data is not None:
+                    yield chunk_start, chunk_size, data
+
+    def iter_matches(self, reader, regions, value):
+        # Yields the address of every occurrence of value. Chunks overlap by len(value) - 1
+        # bytes, so matches that cross a chunk edge are found exactly once.
+        pattern = re.compile(re.escape(value))
+
+        for chunk_start, chunk_size, data in self.iter_chunks(reader, regions, max(len(value) - 1, 0)):
+            # Restart one byte after each match, so overlapping occurrences are found too
+            match = pattern.search(data)
+
+            while match and match.start() < chunk_size:
+                yield chunk_start + match.start()
+                match = pattern.search(data, match.start() + 1)
+
+    def find_string(self, process, value):
+        with Tracing.span('search_memory', size=len(value)):
+            return list(self.iter_matches(self.search_reader, self.regions, value))
+
+    def stream_string(self, process, value):
+        # Searches for value in a background thread and yields the matches as they are found,
+        # so the first match is verified while the rest of the address space is still searched
+        matches = queue.Queue(MATCH_QUEUE_SIZE)
+        finished = threading.Event()
+        errors = []
+        reader = self.stream_reader
+        value = value.encode('utf-8')
+
+        def put(item):
+            while not finished.is_set():
+                try:
+                    matches.put(item, timeout=QUEUE_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+
+            return False
+
+        def search():
+            try:
+                for address in self.iter_matches(reader, self.regions, value):
+                    if not put(address):
+                        return
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put(None)
+
+        thread = threading.Thread(target=search, name='StringSearch', daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                address = matches.get()
+
+                if address is None:
+                    break
+
+                yield address
+        finally:
+            finished.set()
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def read_std_string_batch(self, requests):
+        # Phase one: decode every string header with one batched read
+        headers = self.reader.read_many([(addr, self.string_size) for _, addr in requests])
+        values = []
+        heap_candidates = []
+        heap_requests = []
+
+        for i, ((offset, addr), arr) in enumerate(zip(requests, headers)):
+            if arr is None:
+                continue
+
+            for layout in self.layouts:
+                decoded = layout.decode(arr, addr)
+
+                if not decoded:
+                    continue
+
+                value, heap = decoded
+
+                if value is not None:
+                    # Small string optimization
+                    values.append((i, offset, layout.name, value))
+                elif self.regions.contains(*heap):
+                    heap_candidates.append((i, offset, layout.name))
+                    heap_requests.append(heap)
+
+        # Phase two: read the heap strings in address order, merging nearby ranges
+        if heap_requests:
+            for (i, offset, abi), arr in zip(heap_candidates, self.reader.read_coalesced(heap_requests, self.regions)):
+                if arr is not None:
+                    values.append((i, offset, abi, bytes(arr)))
+
+        values.sort(key=lambda value: value[0])
+        return [value[1:] for value in values]
+
+    def read_std_strings(self, addresses, offsets):
+        if self.stop_event.is_set():
+            return []
+
+        with Tracing.span('read_std_strings', addresses=len(addresses), offsets=len(offsets)):
+            return self.read_std_string_batch([(offset, address + offset) for offset in offsets for address in addresses])
+
+    def find_passwords(self, process, addr, value, mf):
+        # Step one: Peek 128 bytes behind the string and 128 bytes ahead in memory
+        length = len(value)
+        buffer_size = 256 + length
+        arr = self.reader.read(addr - 128, buffer_size)
+
+        if arr is None:
+            return
+
+        arr = bytes(arr)
+
+        # Step two: Interpolate string until non-ASCII character found
+        try:
+            index = arr.index(value.encode('utf-8'))
+        except:
+            return
+
+        start_addr = None
+
+        for i in range(index, 0, -1):
+            if arr[i] not in PRINTABLE_CHARS:
+                start_addr = i + 1
+                break
+
+        # Invalid string
+        if start_addr is None:
+            return
+
+        value_addr = addr - 128 + start_addr
+        end_addr = value_addr + length
+
+        for i in range(index + length, buffer_size):
+            if arr[i] not in PRINTABLE_CHARS:
+                end_addr = i
+                break
+
+        # Our full filename begins at value_addr
+        target = arr[start_addr:end_addr]
+
+        # Locate the std::string structures holding our filename under each layout
+        occurrences = {}
+        pointer_occurrences = {}
+
+        for layout in self.layouts:
+            if value_addr >> (layout.pointer_size * 8):
+                # The filename lies above what a 32-bit layout can point to
+                continue
+
+            if len(target) <= layout.inline_capacity:
+                # Small string optimization
+                occurrences[layout.name] = [value_addr - layout.inline_offset]
+                continue
+
+            # Search for string in the heap
+            pointer = layout.pack_pointer(value_addr)
+
+            if pointer not in pointer_occurrences:
+                pointer_occurrences[pointer] = self.find_string(process, pointer)
+
+            occurrences[layout.name] = [addr - layout.pointer_offset for addr in pointer_occurrences[pointer]]
+
+        if self.layouts_confirmed:
+            filename_occurrences = sorted(set(addr for addrs in occurrences.values() for addr in addrs))
+        else:
+            filename_occurrences = self.confirm_layouts(occurrences, target, value_addr)
+
+        if not filename_occurrences:
+            # There are no occurrences
+            return
+
+        yield target
+
+        # Offsets that worked before in this build are tried first
+        offsets = list(self.profile.iter_offsets(-MULTIFILE_STRUCT_SIZE, MULTIFILE_STRUCT_SIZE))
+        known_offsets = self.profile.get_known_offsets()
+        self.candidate_filter.start_sweep()
+
+        for i in range(0, len(offsets), SWEEP_WINDOW_SIZE):
+            if self.stop_event.is_set():
+                break
+
+            with Tracing.span('sweep_window', first_offset=offsets[i]):
+                strings = self.read_std_strings(filename_occurrences, offsets[i:i + SWEEP_WINDOW_SIZE])
+                candidates = self.candidate_filter.select(strings, known_offsets, self.profile.get_known_abis())
+
+            for offset, _, password in self.verify_candidates(mf, candidates):
+                self.profile.record_hit(offset, get_abis(strings, offset, password))
+                yield password
+
+    def verify_candidates(self, mf, candidates):
+        # Yields the (offset, abi, password) candidates that open the multifile
+        for i in range(0, len(candidates), SWEEP_BATCH_SIZE):
+            if self.stop_event.is_set():
+                return
+
+            batch = candidates[i:i + SWEEP_BATCH_SIZE]
+
+            with Tracing.span('sweep_batch', candidates=len(batch)):
+                # The whole batch is verified at once, so the key derivations can run in parallel
+                mask = mf.is_password_batch([password for _, _, password in batch])
+
+            for candidate, result in zip(batch, mask):
+                if result:
+                    yield candidate
+
+    def search_memory(self):
+        path = self.get_executable()
+        self.profile = OffsetProfile.for_executable(path)
+        self.detect_layouts(path)
+
+        try:
+            with Tracing.profile(), Tracing.span('scan', pid=self.pid):
+                self.search_process()
+        finally:
+            self.profile.save()
+            Tracing.flush()
+
+    def search_process(self):
+        from mem_edit import Process
+
+        with Process.open_process(self.pid) as process:
+            self.open_readers(process)
+            multifiles = self.load_multifiles()
+            self.regions = MemoryRegions(process.list_mapped_regions())
+            found = self.search_objects(process, multifiles)
+
+            for multifile_name, mf in multifiles:
+                if self.stop_event.is_set():
+                    return
+
+                if multifile_name in found:
+                    continue
+
+                if self.first_hit and self.try_confirmed_passwords(multifile_name, mf):
+                    found.add(multifile_name)
+                    continue
+
+                # The heap may have grown since the last multifile
+                self.regions = MemoryRegions(process.list_mapped_regions())
+
+                if self.search_multifile(process, multifile_name, mf):
+                    found.add(multifile_name)
+
+            if self.key_search:
+                self.search_keys(process, [multifile_name for multifile_name, _ in multifiles if multifile_name not in found])
+
+    def open_readers(self, process):
+        self.reader = open_reader(process, self.pid)
+        self.search_reader = open_reader(process, self.pid)
+        self.stream_reader = open_reader(process, self.pid)
+
+    def read_bytes(self, address, size):
+        data = self.reader.read(address, size)
+        return bytes(data) if data is not None else None
+
+    def find_objects(self, process):
+        # Every Multifile object starts with a pointer into the Multifile vtable
+        search = lambda value, regions: list(self.iter_matches(self.search_reader, regions, value))
+        locator = VtableLocator(self.pid, self.get_executable(), search, self.read_bytes, process.list_mapped_regions(False))
+        objects = []
+
+        with Tracing.span('locate_vtables'):
+            vtables = locator.find_vtables()
+
+        for vtable, pointer_size in vtables:
+            for address in self.find_string(process, vtable.to_bytes(pointer_size, 'little')):
+                if address % pointer_size == 0:
+                    objects.append((address, pointer_size))
+
+        return objects
+
+    def search_objects(self, process, multifiles):
+        # Reads the strings of the live Multifile objects directly. The object holding a
+        # multifile's name also holds its password, so no filename search or wide sweep is
+        # needed. Returns the names found; the rest fall back to the filename search.
+        found = set()
+
+        if not multifiles:
+            return found
+
+        objects = self.find_objects(process)
+        names = {multifile_name.encode('utf-8'): (multifile_name, mf) for multifile_name, mf in multifiles}
+
+        for address, pointer_size in objects:
+            if self.stop_event.is_set():
+                break
+
+            with Tracing.span('search_object', address=address):
+                offsets = list(self.profile.iter_object_offsets(MULTIFILE_STRUCT_SIZE, pointer_size))
+                strings = self.read_std_strings([address], offsets)
+
+            target = None
+
+            for _, _, value in strings:
+                basename = value.replace(b'\\', b'/').rsplit(b'/', 1)[-1]
+
+                if basename in names and names[basename][0] not in found:
+                    target = value
+                    multifile_name, mf = names[basename]
+                    break
+
+            if target is None:
+                continue
+
+            self.candidate_filter.start_sweep()
+            strings = [(offset, abi, value) for offset, abi, value in strings if value != target]
+            candidates = self.candidate_filter.select(strings, self.profile.get_known_object_offsets(), self.profile.get_known_abis())
+            target = target.decode('utf-8', 'backslashreplace').replace('\\', '/')
+
+            # Known offsets are ranked first, so one small batch is usually enough.
+            # An object only holds one password, so its other strings are not verified.
+            for offset, _, password in self.verify_candidates(mf, candidates):
+                self.profile.record_object_hit(offset, get_abis(strings, offset, password))
+                self.confirm_password(target, password)
+                found.add(multifile_name)
+                break
+
+        return found
+
+    def try_confirmed_passwords(self, multifile_name, mf):
+        # Multifiles of one game usually share their password, so try the known ones before searching
+        if not self.confirmed_passwords:
+            return False
+
+        for password, result in zip(self.confirmed_passwords, mf.is_password_batch(self.confirmed_passwords)):
+            if result:
+                self.on_progress(multifile_name, password)
+                return True
+
+        return False
+
+    def confirm_password(self, target, password):
+        if password not in self.confirmed_passwords:
+            self.confirmed_passwords.append(password)
+
+        self.on_progress(target, password)
+
+    def search_multifile(self, process, multifile_name, mf):
+        # Returns whether a password was found. Closing the match stream stops the search,
+        # and closing a sweep drops its remaining offsets.
+        found = False
+
+        for multifile in self.stream_string(process, multifile_name):
+            if self.stop_event.is_set():
+                return found
+
+            passwords = self.find_passwords(process, multifile, multifile_name, mf)
+
+            try:
+                target = next(passwords)
+            except StopIteration:
+                # No passwords found
+                continue
+
+            target = target.decode('utf-8', 'backslashreplace')
+            target = target.replace('\\', '/')
+
+            for password in passwords:
+                if self.stop_event.is_set():
+                    return found
+
+                self.confirm_password(target, password)
+                found = True
+
+                if self.first_hit:
+                    return True
+
+        return found
+
+    def search_keys(self, process, multifile_names):
+        # The fallback for targets that wipe the password after mounting: the key schedule of
+        # an open subfile's cipher stays in memory. Panda3D salts every subfile's key with its
+        # IV, so each key found is verified against every encrypted subfile.
+        if not multifile_names or self.stop_event.is_set():
+            return
+
+        from .KeyFinder import KeyFinder, NID_bf_cbc, read_key_checks, find_subfiles
+
+        try:
+            finder = KeyFinder()
+        except ImportError:
+            self.on_warning('Searching for cipher keys requires NumPy.')
+            return
+
+        paths = dict(zip(self.multifile_names, self.multifiles))
+        checks = {}
+
+        for multifile_name in multifile_names:
+            try:
+                checks[multifile_name] = read_key_checks(paths[multifile_name])
+            except (OSError, MultifileException, StructDatagramException):
+                self.on_warning(f'{multifile_name} is a malformed multifile.')
+
+        self.regions = MemoryRegions(process.list_mapped_regions())
+        keys = {}
+
+        with Tracing.span('search_keys', multifiles=len(checks)):
+            for chunk_start, chunk_size, data in self.iter_chunks(self.search_reader, self.regions, finder.overlap):
+                for key in finder.search(chunk_start, data, chunk_size):
+                    keys.setdefault(key.key, key)
+
+        for key in keys.values():
+            targets = [f'{multifile_name}/{subfile_name}' for multifile_name, multifile_checks in checks.items() for subfile_name in find_subfiles(key, multifile_checks)]
+
+            if not targets:
+                continue
+
+            if key.nid == NID_bf_cbc:
+                # Key states are kilobytes long, so they are saved instead of shown
+                try:
+                    key.export()
+                except OSError as e:
+                    self.on_warning(f'Could not save the Blowfish key state {key.get_fingerprint()}: {e}')
+
+            for target in targets:
+                self.on_key(target, key.to_dict())
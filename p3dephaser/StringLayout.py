@@ -0,0 +1,198 @@
+from abc import ABC, abstractmethod
+import struct
+
+MAX_STRING_LENGTH = 1000 # Anything longer is suspiciously large for a password
+
+# Executable header magics
+ELF_MAGIC = b'\x7fELF'
+PE_MAGIC = b'MZ'
+MACHO_MAGICS = {
+    b'\xce\xfa\xed\xfe': 4,
+    b'\xcf\xfa\xed\xfe': 8
+}
+PE_MACHINE_POINTER_SIZES = {
+    0x014c: 4, # i386
+    0x01c4: 4, # ARMv7
+    0x8664: 8, # AMD64
+    0xaa64: 8  # ARM64
+}
+
+class StringLayout(ABC):
+
+    runtime = None
+
+    def __init__(self, pointer_size):
+        self.name = self.runtime if pointer_size == 8 else f'{self.runtime}32'
+        self.pointer_size = pointer_size
+        self.pointer_format = '<Q' if pointer_size == 8 else '<I'
+
+    def read_pointer(self, arr, offset):
+        return struct.unpack_from(self.pointer_format, arr, offset)[0]
+
+    def pack_pointer(self, value):
+        return struct.pack(self.pointer_format, value)
+
+    @abstractmethod
+    def decode(self, arr, address):
+        # Returns (inline value, None), (None, (heap pointer, length)) or None if this is no string
+        pass
+
+    def __str__(self):
+        return f'{self.runtime} ({self.pointer_size * 8}-bit)'
+
+class MSVCStringLayout(StringLayout):
+    # union { char buf[16]; char *ptr; }; size_t size; size_t capacity;
+    runtime = 'msvc'
+    inline_offset = 0
+    inline_capacity = 15
+
+    def __init__(self, pointer_size):
+        StringLayout.__init__(self, pointer_size)
+        self.size = 16 + pointer_size * 2
+        self.pointer_offset = 0
+
+    def decode(self, arr, address):
+        length = self.read_pointer(arr, 16)
+
+        if length <= self.inline_capacity:
+            return bytes(arr[0:length]), None
+
+        if length > MAX_STRING_LENGTH:
+            return None
+
+        return None, (self.read_pointer(arr, 0), length)
+
+class LibcxxStringLayout(StringLayout):
+    # Long: size_t capacity | 1; size_t size; char *ptr;
+    # Short: unsigned char size << 1; char buf[];
+    runtime = 'libc++'
+    inline_offset = 1
+
+    def __init__(self, pointer_size):
+        StringLayout.__init__(self, pointer_size)
+        self.size = pointer_size * 3
+        self.pointer_offset = pointer_size * 2
+        self.inline_capacity = self.size - 2
+
+    def decode(self, arr, address):
+        if arr[0] & 1 == 0:
+            # Small string optimization using LSB flag
+            length = arr[0] >> 1
+
+            if length > self.inline_capacity:
+                return None
+
+            return bytes(arr[1:1 + length]), None
+
+        length = self.read_pointer(arr, self.pointer_size)
+
+        if length > MAX_STRING_LENGTH:
+            return None
+
+        return None, (self.read_pointer(arr, self.pointer_offset), length)
+
+class LibstdcxxStringLayout(StringLayout):
+    # char *ptr; size_t size; union { char buf[16]; size_t capacity; };
+    runtime = 'libstdc++'
+    inline_capacity = 15
+    pointer_offset = 0
+
+    def __init__(self, pointer_size):
+        StringLayout.__init__(self, pointer_size)
+        self.size = pointer_size * 2 + 16
+        self.inline_offset = pointer_size * 2
+
+    def decode(self, arr, address):
+        pointer = self.read_pointer(arr, 0)
+        length = self.read_pointer(arr, self.pointer_size)
+
+        if length <= self.inline_capacity:
+            # Short strings always point to their own buffer
+            if pointer != address + self.inline_offset:
+                return None
+
+            return bytes(arr[self.inline_offset:self.inline_offset + length]), None
+
+        if length > MAX_STRING_LENGTH:
+            return None
+
+        return None, (pointer, length)
+
+STRING_LAYOUTS = [
+    MSVCStringLayout(8),
+    LibcxxStringLayout(8),
+    LibstdcxxStringLayout(8),
+    MSVCStringLayout(4),
+    LibcxxStringLayout(4),
+    LibstdcxxStringLayout(4)
+]
+
+def get_executable_info(path):
+    # Returns the pointer size and platform of an executable, or None for each unknown
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(4096)
+    except (OSError, TypeError):
+        return None, None
+
+    if header.startswith(ELF_MAGIC) and len(header) > 4:
+        return {1: 4, 2: 8}.get(header[4]), 'elf'
+
+    if header[:4] in MACHO_MAGICS:
+        return MACHO_MAGICS[header[:4]], 'macho'
+
+    if header.startswith(PE_MAGIC) and len(header) >= 0x40:
+        pe_offset = struct.unpack_from('<I', header, 0x3c)[0]
+
+        if header[pe_offset:pe_offset + 4] == b'PE\0\0':
+            machine = struct.unpack_from('<H', header, pe_offset + 4)[0]
+            return PE_MACHINE_POINTER_SIZES.get(machine), 'pe'
+
+    return None, None
+
+def get_runtime(platform, libraries):
+    libraries = [library.lower() for library in libraries]
+
+    if any('libc++' in library for library in libraries):
+        return 'libc++'
+
+    if any('libstdc++' in library for library in libraries):
+        return 'libstdc++'
+
+    if platform == 'pe':
+        return 'msvc'
+
+    if platform == 'macho':
+        return 'libc++'
+
+    return None
+
+def detect_string_layouts(path, libraries=(), known_abis=()):
+    # Narrow the candidate layouts down using the executable header and its linked C++ runtime
+    pointer_size, platform = get_executable_info(path)
+    runtime = get_runtime(platform, libraries)
+    layouts = STRING_LAYOUTS
+
+    if pointer_size:
+        layouts = [layout for layout in layouts if layout.pointer_size == pointer_size]
+
+    if runtime:
+        layouts = [layout for layout in layouts if layout.runtime == runtime]
+
+    # Layouts that held passwords before are tried first; the filename confirms the right one
+    known = [layout for abi in known_abis for layout in layouts if layout.name == abi]
+    return known + [layout for layout in layouts if layout not in known]
+
+def describes_string(layout, arr, address, value, value_address):
+    decoded = layout.decode(arr, address)
+
+    if not decoded:
+        return False
+
+    inline, heap = decoded
+
+    if inline is not None:
+        return inline == value
+
+    # The heap pointer of the filename must lead back to the string we found
+    return heap == (value_address, len(value))
@@ -1,4 +1,48 @@
-import struct
+import array, struct, sys
+
+INT8 = struct.Struct('<b')
+INT16 = struct.Struct('<h')
+INT32 = struct.Struct('<i')
+INT64 = struct.Struct('<q')
+UINT8 = struct.Struct('<B')
+UINT16 = struct.Struct('<H')
+UINT32 = struct.Struct('<I')
+UINT64 = struct.Struct('<Q')
+FLOAT32 = struct.Struct('<f')
+FLOAT64 = struct.Struct('<d')
+
+BE_INT16 = struct.Struct('>h')
+BE_INT32 = struct.Struct('>i')
+BE_INT64 = struct.Struct('>q')
+BE_UINT16 = struct.Struct('>H')
+BE_UINT32 = struct.Struct('>I')
+BE_UINT64 = struct.Struct('>Q')
+BE_FLOAT32 = struct.Struct('>f')
+BE_FLOAT64 = struct.Struct('>d')
+
+structs = {}
+
+def get_struct(value_format):
+    # Compiles every format string only once
+    compiled = structs.get(value_format)
+
+    if compiled is None:
+        compiled = structs[value_format] = struct.Struct(value_format)
+
+    return compiled
+
+for compiled in (INT8, INT16, INT32, INT64, UINT8, UINT16, UINT32, UINT64, FLOAT32, FLOAT64,
+                 BE_INT16, BE_INT32, BE_INT64, BE_UINT16, BE_UINT32, BE_UINT64, BE_FLOAT32, BE_FLOAT64):
+    structs[compiled.format] = compiled
+
+# The array type codes with the same item size as each struct format character
+array_codes = {}
+
+for character, codes in (('b', 'b'), ('B', 'B'), ('h', 'h'), ('H', 'H'), ('i', 'il'), ('I', 'IL'), ('q', 'ql'), ('Q', 'QL'), ('f', 'f'), ('d', 'd')):
+    for code in codes:
+        if array.array(code).itemsize == struct.calcsize(f'<{character}'):
+            array_codes[character] = code
+            break
 
 class StructDatagramException(Exception):
     pass
@@ -6,17 +50,21 @@ class StructDatagramException(Exception):
 class StructDatagram(object):
 
     def __init__(self, data=None, stdfloat_double=False):
-        self.data = data or b''
+        self.data = bytearray(data or b'')
         self.stdfloat_double = stdfloat_double
 
     def get_message(self):
-        return self.data
+        return bytes(self.data)
+
+    def get_message_view(self):
+        # A view of the message without copying it; release it before adding more data
+        return memoryview(self.data)
 
     def get_length(self):
         return len(self.data)
 
     def clear(self):
-        self.data = b''
+        self.data = bytearray()
 
     def set_stdfloat_double(self, stdfloat_double):
         self.stdfloat_double = stdfloat_double
@@ -25,40 +73,52 @@ class StructDatagram(object):
         return self.stdfloat_double
 
     def pack_value(self, value_format, value):
-        self.data += struct.pack(value_format, value)
+        self.data += get_struct(value_format).pack(value)
+
+    def pack_array(self, value_format, values):
+        # Packs a sequence of values of a single format character in one pass
+        count = len(values)
+
+        if not count:
+            return
+
+        packer = struct.Struct(f'{value_format[0]}{count}{value_format[1:]}')
+        offset = len(self.data)
+        self.data += bytes(packer.size)
+        packer.pack_into(self.data, offset, *values)
 
     def add_bool(self, value):
-        return self.pack_value('<B', bool(value))
+        self.data += UINT8.pack(bool(value))
 
     def add_int8(self, value):
-        return self.pack_value('<b', value)
+        self.data += INT8.pack(value)
 
     def add_int16(self, value):
-        return self.pack_value('<h', value)
+        self.data += INT16.pack(value)
 
     def add_int32(self, value):
-        return self.pack_value('<i', value)
+        self.data += INT32.pack(value)
 
     def add_int64(self, value):
-        return self.pack_value('<q', value)
+        self.data += INT64.pack(value)
 
     def add_uint8(self, value):
-        return self.pack_value('<B', value)
+        self.data += UINT8.pack(value)
 
     def add_uint16(self, value):
-        return self.pack_value('<H', value)
+        self.data += UINT16.pack(value)
 
     def add_uint32(self, value):
-        return self.pack_value('<I', value)
+        self.data += UINT32.pack(value)
 
     def add_uint64(self, value):
-        return self.pack_value('<Q', value)
+        self.data += UINT64.pack(value)
 
     def add_float32(self, value):
-        return self.pack_value('<f', value)
+        self.data += FLOAT32.pack(value)
 
     def add_float64(self, value):
-        return self.pack_value('<d', value)
+        self.data += FLOAT64.pack(value)
 
     def add_stdfloat(self, value):
         if self.stdfloat_double:
@@ -67,28 +127,58 @@ class StructDatagram(object):
         return self.add_float32(value)
 
     def add_be_int16(self, value):
-        return self.pack_value('>h', value)
+        self.data += BE_INT16.pack(value)
 
     def add_be_int32(self, value):
-        return self.pack_value('>i', value)
+        self.data += BE_INT32.pack(value)
 
     def add_be_int64(self, value):
-        return self.pack_value('>q', value)
+        self.data += BE_INT64.pack(value)
 
     def add_be_uint16(self, value):
-        return self.pack_value('>H', value)
+        self.data += BE_UINT16.pack(value)
 
     def add_be_uint32(self, value):
-        return self.pack_value('>I', value)
+        self.data += BE_UINT32.pack(value)
 
     def add_be_uint64(self, value):
-        return self.pack_value('>Q', value)
+        self.data += BE_UINT64.pack(value)
 
     def add_be_float32(self, value):
-        return self.pack_value('>f', value)
+        self.data += BE_FLOAT32.pack(value)
 
     def add_be_float64(self, value):
-        return self.pack_value('>d', value)
+        self.data += BE_FLOAT64.pack(value)
+
+    def add_int8_array(self, values):
+        return self.pack_array('<b', values)
+
+    def add_int16_array(self, values):
+        return self.pack_array('<h', values)
+
+    def add_int32_array(self, values):
+        return self.pack_array('<i', values)
+
+    def add_int64_array(self, values):
+        return self.pack_array('<q', values)
+
+    def add_uint8_array(self, values):
+        return self.pack_array('<B', values)
+
+    def add_uint16_array(self, values):
+        return self.pack_array('<H', values)
+
+    def add_uint32_array(self, values):
+        return self.pack_array('<I', values)
+
+    def add_uint64_array(self, values):
+        return self.pack_array('<Q', values)
+
+    def add_float32_array(self, values):
+        return self.pack_array('<f', values)
+
+    def add_float64_array(self, values):
+        return self.pack_array('<d', values)
 
     def add_string(self, value):
         if len(value) > 65535:
@@ -135,28 +225,30 @@ class StructDatagram(object):
         return self.append_data(value)
 
     def pad_bytes(self, size):
-        self.data += b'\x00' * size
+        self.data += bytes(size)
 
     def append_data(self, data):
-        if not isinstance(data, bytes):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
             data = str(data)
             data = data.encode('utf-8')
 
         self.data += data
 
     def __bytes__(self):
-        return self.data
+        return bytes(self.data)
 
     get_data = get_message
 
     getData = get_data
     getMessage = get_message
+    getMessageView = get_message_view
     getLength = get_length
 
     setStdfloatDouble = set_stdfloat_double
     getStdfloatDouble = get_stdfloat_double
 
     packValue = pack_value
+    packArray = pack_array
 
     addBool = add_bool
 
@@ -182,6 +274,17 @@ class StructDatagram(object):
     addBeFloat32 = add_be_float32
     addBeFloat64 = add_be_float64
 
+    addInt8Array = add_int8_array
+    addInt16Array = add_int16_array
+    addInt32Array = add_int32_array
+    addInt64Array = add_int64_array
+    addUint8Array = add_uint8_array
+    addUint16Array = add_uint16_array
+    addUint32Array = add_uint32_array
+    addUint64Array = add_uint64_array
+    addFloat32Array = add_float32_array
+    addFloat64Array = add_float64_array
+
     addString = add_string
     addString32 = add_string32
     addZstring = add_z_string
@@ -195,28 +298,37 @@ class StructDatagram(object):
     appendData = append_data
 
 class StructDatagramIterator(object):
+    # Reads from any buffer (bytes, bytearray, memoryview, mmap) in place, without copying it
 
     def __init__(self, datagram=None, offset=0):
-        if datagram:
-            if isinstance(datagram, StructDatagram):
-                self.data = datagram.data[offset:]
-                self.stdfloat_double = datagram.stdfloat_double
-            elif isinstance(datagram, bytes):
-                self.data = datagram
-                self.stdfloat_double = False
-            else:
-                raise StructDatagramException('Invalid source datagram given.')
+        if datagram is None:
+            self.data = memoryview(b'')
+            self.stdfloat_double = False
+        elif isinstance(datagram, StructDatagram):
+            self.data = memoryview(datagram.data)[offset:]
+            self.stdfloat_double = datagram.stdfloat_double
         else:
-            self.data = b''
+            try:
+                self.data = memoryview(datagram)
+            except TypeError:
+                raise StructDatagramException('Invalid source datagram given.')
+
+            if self.data.format != 'B' or self.data.ndim != 1:
+                self.data = self.data.cast('B')
+
             self.stdfloat_double = False
 
         self.index = 0
 
+    def release(self):
+        # Releases the source buffer, so that an mmap can be closed or a bytearray resized
+        self.data.release()
+
     def get_remaining_size(self):
         return len(self.data) - self.index
 
     def get_remaining_bytes(self):
-        return self.data[self.index:]
+        return bytes(self.data[self.index:])
 
     def get_datagram(self):
         return StructDatagram(self.data, self.stdfloat_double)
@@ -224,67 +336,96 @@ class StructDatagramIterator(object):
     def get_current_index(self):
         return self.index
 
-    def skip_bytes(self, size):
-        remaining_size = self.get_remaining_size()
+    def check_size(self, size, action='read'):
+        remaining_size = len(self.data) - self.index
 
         if remaining_size < size:
-            raise StructDatagramException(f'Datagram overflow: Attempted to skip {size} bytes, remaining size {remaining_size}, index {self.index}, datagram: {self.data}')
+            raise StructDatagramException(f'Datagram overflow: Attempted to {action} {size} bytes, remaining size {remaining_size}, index {self.index}, length {len(self.data)}')
 
+    def skip_bytes(self, size):
+        self.check_size(size, 'skip')
         self.index += size
 
-    def peek_bytes(self, size):
-        remaining_size = self.get_remaining_size()
+    def peek_view(self, size):
+        self.check_size(size)
+        return self.data[self.index:self.index + size]
 
-        if remaining_size < size:
-            raise StructDatagramException(f'Datagram overflow: Attempted to read {size} bytes, remaining size {remaining_size}, index {self.index}, datagram: {self.data}')
+    def extract_view(self, size):
+        value = self.peek_view(size)
+        self.index += size
+        return value
 
-        return self.data[self.index:self.index + size]
+    def peek_bytes(self, size):
+        return bytes(self.peek_view(size))
 
     def extract_bytes(self, size):
-        value = self.peek_bytes(size)
-        self.index += size
+        return bytes(self.extract_view(size))
+
+    def peek_struct(self, compiled):
+        self.check_size(compiled.size)
+        return compiled.unpack_from(self.data, self.index)[0]
+
+    def extract_struct(self, compiled):
+        self.check_size(compiled.size)
+        value = compiled.unpack_from(self.data, self.index)[0]
+        self.index += compiled.size
         return value
 
     def peek_value(self, value_format):
-        size = struct.calcsize(value_format)
-        return struct.unpack(value_format, self.peek_bytes(size))[0]
+        return self.peek_struct(get_struct(value_format))
 
     def extract_value(self, value_format):
-        size = struct.calcsize(value_format)
-        return struct.unpack(value_format, self.extract_bytes(size))[0]
+        return self.extract_struct(get_struct(value_format))
+
+    def extract_array(self, value_format, count):
+        # Reads count values of a single format character into an array
+        byte_order, character = value_format[0], value_format[1]
+        view = self.extract_view(get_struct(value_format).size * count)
+        code = array_codes.get(character)
+
+        if code is None:
+            return array.array('q' if character.islower() else 'Q', struct.unpack(f'{byte_order}{count}{character}', view))
+
+        values = array.array(code)
+        values.frombytes(view)
+
+        if (byte_order == '<') != (sys.byteorder == 'little'):
+            values.byteswap()
+
+        return values
 
     def get_bool(self):
-        return bool(self.extract_value('<B'))
+        return bool(self.extract_struct(UINT8))
 
     def get_int8(self):
-        return self.extract_value('<b')
+        return self.extract_struct(INT8)
 
     def get_int16(self):
-        return self.extract_value('<h')
+        return self.extract_struct(INT16)
 
     def get_int32(self):
-        return self.extract_value('<i')
+        return self.extract_struct(INT32)
 
     def get_int64(self):
-        return self.extract_value('<q')
+        return self.extract_struct(INT64)
 
     def get_uint8(self):
-        return self.extract_value('<B')
+        return self.extract_struct(UINT8)
 
     def get_uint16(self):
-        return self.extract_value('<H')
+        return self.extract_struct(UINT16)
 
     def get_uint32(self):
-        return self.extract_value('<I')
+        return self.extract_struct(UINT32)
 
     def get_uint64(self):
-        return self.extract_value('<Q')
+        return self.extract_struct(UINT64)
 
     def get_float32(self):
-        return self.extract_value('<f')
+        return self.extract_struct(FLOAT32)
 
     def get_float64(self):
-        return self.extract_value('<d')
+        return self.extract_struct(FLOAT64)
 
     def get_stdfloat(self):
         if self.stdfloat_double:
@@ -293,28 +434,58 @@ class StructDatagramIterator(object):
         return self.get_float32()
 
     def get_be_int16(self):
-        return self.extract_value('>h')
+        return self.extract_struct(BE_INT16)
 
     def get_be_int32(self):
-        return self.extract_value('>i')
+        return self.extract_struct(BE_INT32)
 
     def get_be_int64(self):
-        return self.extract_value('>q')
+        return self.extract_struct(BE_INT64)
 
     def get_be_uint16(self):
-        return self.extract_value('>H')
+        return self.extract_struct(BE_UINT16)
 
     def get_be_uint32(self):
-        return self.extract_value('>I')
+        return self.extract_struct(BE_UINT32)
 
     def get_be_uint64(self):
-        return self.extract_value('>Q')
+        return self.extract_struct(BE_UINT64)
 
     def get_be_float32(self):
-        return self.extract_value('>f')
+        return self.extract_struct(BE_FLOAT32)
 
     def get_be_float64(self):
-        return self.extract_value('>d')
+        return self.extract_struct(BE_FLOAT64)
+
+    def get_int8_array(self, count):
+        return self.extract_array('<b', count)
+
+    def get_int16_array(self, count):
+        return self.extract_array('<h', count)
+
+    def get_int32_array(self, count):
+        return self.extract_array('<i', count)
+
+    def get_int64_array(self, count):
+        return self.extract_array('<q', count)
+
+    def get_uint8_array(self, count):
+        return self.extract_array('<B', count)
+
+    def get_uint16_array(self, count):
+        return self.extract_array('<H', count)
+
+    def get_uint32_array(self, count):
+        return self.extract_array('<I', count)
+
+    def get_uint64_array(self, count):
+        return self.extract_array('<Q', count)
+
+    def get_float32_array(self, count):
+        return self.extract_array('<f', count)
+
+    def get_float64_array(self, count):
+        return self.extract_array('<d', count)
 
     def get_string(self):
         length = self.get_uint16()
@@ -331,7 +502,7 @@ class StructDatagramIterator(object):
             while self.data[self.index + length] != 0:
                 length += 1
         except IndexError:
-            raise StructDatagramException(f'Zero terminated string was not terminated at index {self.index}, datagram: {self.data}')
+            raise StructDatagramException(f'Zero terminated string was not terminated at index {self.index}, length {len(self.data)}')
 
         value = self.get_fixed_string(length)
         self.skip_bytes(1)
@@ -352,37 +523,37 @@ class StructDatagramIterator(object):
         return self.extract_bytes(length)
 
     def peek_bool(self):
-        return bool(self.peek_value('<B'))
+        return bool(self.peek_struct(UINT8))
 
     def peek_int8(self):
-        return self.peek_value('<b')
+        return self.peek_struct(INT8)
 
     def peek_int16(self):
-        return self.peek_value('<h')
+        return self.peek_struct(INT16)
 
     def peek_int32(self):
-        return self.peek_value('<i')
+        return self.peek_struct(INT32)
 
     def peek_int64(self):
-        return self.peek_value('<q')
+        return self.peek_struct(INT64)
 
     def peek_uint8(self):
-        return self.peek_value('<B')
+        return self.peek_struct(UINT8)
 
     def peek_uint16(self):
-        return self.peek_value('<H')
+        return self.peek_struct(UINT16)
 
     def peek_uint32(self):
-        return self.peek_value('<I')
+        return self.peek_struct(UINT32)
 
     def peek_uint64(self):
-        return self.peek_value('<Q')
+        return self.peek_struct(UINT64)
 
     def peek_float32(self):
-        return self.peek_value('<f')
+        return self.peek_struct(FLOAT32)
 
     def peek_float64(self):
-        return self.peek_value('<d')
+        return self.peek_struct(FLOAT64)
 
     def peek_stdfloat(self):
         if self.stdfloat_double:
@@ -391,28 +562,28 @@ class StructDatagramIterator(object):
         return self.peek_float32()
 
     def peek_be_int16(self):
-        return self.peek_value('>h')
+        return self.peek_struct(BE_INT16)
 
     def peek_be_int32(self):
-        return self.peek_value('>i')
+        return self.peek_struct(BE_INT32)
 
     def peek_be_int64(self):
-        return self.peek_value('>q')
+        return self.peek_struct(BE_INT64)
 
     def peek_be_uint16(self):
-        return self.peek_value('>H')
+        return self.peek_struct(BE_UINT16)
 
     def peek_be_uint32(self):
-        return self.peek_value('>I')
+        return self.peek_struct(BE_UINT32)
 
     def peek_be_uint64(self):
-        return self.peek_value('>Q')
+        return self.peek_struct(BE_UINT64)
 
     def peek_be_float32(self):
-        return self.peek_value('>f')
+        return self.peek_struct(BE_FLOAT32)
 
     def peek_be_float64(self):
-        return self.peek_value('>d')
+        return self.peek_struct(BE_FLOAT64)
 
     def peek_string(self):
         length = self.peek_uint16()
@@ -429,7 +600,7 @@ class StructDatagramIterator(object):
             while self.data[self.index + length] != 0:
                 length += 1
         except IndexError:
-            raise StructDatagramException(f'Zero terminated string was not terminated at index {self.index}, datagram: {self.data}')
+            raise StructDatagramException(f'Zero terminated string was not terminated at index {self.index}, length {len(self.data)}')
 
         return self.peek_fixed_string(length)
 
@@ -453,11 +624,16 @@ class StructDatagramIterator(object):
     getCurrentIndex = get_current_index
 
     skipBytes = skip_bytes
+    peekView = peek_view
+    extractView = extract_view
     peekBytes = peek_bytes
     extractBytes = extract_bytes
 
+    peekStruct = peek_struct
+    extractStruct = extract_struct
     peekValue = peek_value
     extractValue = extract_value
+    extractArray = extract_array
 
     getBool = get_bool
 
@@ -483,6 +659,17 @@ class StructDatagramIterator(object):
     getBeFloat32 = get_be_float32
     getBeFloat64 = get_be_float64
 
+    getInt8Array = get_int8_array
+    getInt16Array = get_int16_array
+    getInt32Array = get_int32_array
+    getInt64Array = get_int64_array
+    getUint8Array = get_uint8_array
+    getUint16Array = get_uint16_array
+    getUint32Array = get_uint32_array
+    getUint64Array = get_uint64_array
+    getFloat32Array = get_float32_array
+    getFloat64Array = get_float64_array
+
     getString = get_string
     getString32 = get_string32
     getZstring = get_z_string
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from .Multifile import MAGIC_HEADER_SIZE, MultifileException
+from .Repacker import EncryptedSubfile
+import io
+
+PAGE_SIZE = 4096 # Bytes of ciphertext decrypted at a time; a multiple of every cipher block size
+CACHE_SIZE = 256 * 1024 # Bytes of decrypted pages kept per reader
+
+class SubfileReader(io.RawIOBase):
+    # A seekable view of one subfile's stored data. Encrypted subfiles are decrypted
+    # lazily: in CBC mode every block only needs the ciphertext block before it, so a
+    # read only decrypts the pages it touches. Compressed subfiles read as zlib data.
+
+    def __init__(self, f, subfile, password=None, encrypted=None, cache_size=CACHE_SIZE):
+        io.RawIOBase.__init__(self)
+        self.f = f
+        self.subfile = subfile
+        self.position = 0
+        self.pages = OrderedDict()
+        self.max_pages = max(1, cache_size // PAGE_SIZE)
+
+        if subfile.is_encrypted():
+            self.encrypted = encrypted or EncryptedSubfile(f, subfile, password)
+            self.size = self.encrypted.plaintext_length
+        else:
+            self.encrypted = None
+            self.size = subfile.length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+
+        if position < 0:
+            raise ValueError(f'Negative seek position: {position}')
+
+        self.position = position
+        return position
+
+    def get_page(self, index):
+        page = self.pages.get(index)
+
+        if page is not None:
+            self.pages.move_to_end(index)
+            return page
+
+        encrypted = self.encrypted
+        offset = index * PAGE_SIZE
+        length = min(PAGE_SIZE, encrypted.ciphertext_length - offset)
+
+        if index == 0:
+            iv = encrypted.iv
+            self.f.seek(encrypted.address)
+            ciphertext = self.f.read(length)
+        else:
+            # The previous ciphertext block is the IV of this page
+            self.f.seek(encrypted.address + offset - encrypted.block_size)
+            data = self.f.read(encrypted.block_size + length)
+            iv, ciphertext = data[:encrypted.block_size], data[encrypted.block_size:]
+
+        # A truncated multifile ends in a partial block, which cannot be decrypted
+        ciphertext = ciphertext[:len(ciphertext) - len(ciphertext) % encrypted.block_size]
+        page = b''.join(encrypted.cipher.decrypt_cbc(ciphertext, iv))
+        self.pages[index] = page
+
+        if len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+        return page
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        length = max(0, min(len(view), self.size - self.position))
+
+        if not length:
+            return 0
+
+        if not self.encrypted:
+            self.f.seek(self.subfile.address + self.position)
+            length = self.f.readinto(view[:length])
+            self.position += length
+            return length
+
+        done = 0
+
+        while done < length:
+            # Decrypted data starts with the magic header
+            offset = self.position + MAGIC_HEADER_SIZE
+            page = self.get_page(offset // PAGE_SIZE)
+            start = offset % PAGE_SIZE
+
+            if len(page) <= start:
+                # The page ends early, so the multifile is shorter than its index says
+                if done:
+                    break
+
+                raise MultifileException('Multifile is truncated.')
+
+            chunk = min(length - done, len(page) - start)
+            view[done:done + chunk] = page[start:start + chunk]
+            done += chunk
+            self.position += chunk
+
+        return done
+
+def open_subfile(f, subfile, password=None, buffering=io.DEFAULT_BUFFER_SIZE):
+    return io.BufferedReader(SubfileReader(f, subfile, password), buffering)
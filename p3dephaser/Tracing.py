@@ -0,0 +1,154 @@
+from contextlib import contextmanager, nullcontext
+import json, os, sys, threading, time
+
+MAX_EVENTS = 1000000 # Events kept in memory; later ones are counted but dropped
+NULL_SPAN = nullcontext()
+
+# The active tracer; None unless tracing was asked for, so disabled spans cost one global lookup
+tracer = None
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add_event(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class Tracer(object):
+    # Records spans as Chrome trace events (chrome://tracing, Perfetto) and optionally a cProfile dump
+
+    def __init__(self, path=None, profile_path=None):
+        self.path = path
+        self.profile_path = profile_path
+        self.events = []
+        self.dropped = 0
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.profiler = None
+        self.profiling = False
+
+        if profile_path:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def add_event(self, name, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': (start - self.origin) / 1000,
+            'dur': (end - start) / 1000,
+            'pid': self.pid,
+            'tid': thread.ident,
+            'args': args
+        }
+
+        with self.lock:
+            if len(self.events) >= MAX_EVENTS:
+                self.dropped += 1
+                return
+
+            self.events.append(event)
+            self.thread_names[thread.ident] = thread.name
+
+    def span(self, name, args):
+        return Span(self, name, args)
+
+    @contextmanager
+    def profile(self):
+        # cProfile only follows the thread that enabled it, so only one thread is profiled at a time
+        with self.lock:
+            start = self.profiler is not None and not self.profiling
+            self.profiling = self.profiling or start
+
+        if not start:
+            yield
+            return
+
+        self.profiler.enable()
+
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+            with self.lock:
+                self.profiling = False
+
+    def save(self):
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            dropped = self.dropped
+
+        if self.path:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}} for tid, name in thread_names.items()]
+            trace = {'traceEvents': metadata + events, 'displayTimeUnit': 'ms', 'otherData': {'dropped_events': dropped}}
+            # Daemon jobs flush from their own threads, so each writes its own temporary file
+            temp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(trace, f)
+
+                os.replace(temp_path, self.path)
+            except OSError:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+                raise
+
+        if self.profiler and not self.profiling:
+            self.profiler.dump_stats(self.profile_path)
+
+def start_tracing(path=None, profile_path=None):
+    global tracer
+    tracer = Tracer(path, profile_path)
+    return tracer
+
+def stop_tracing():
+    global tracer
+
+    if tracer is not None:
+        tracer.save()
+        tracer = None
+
+def disable_tracing():
+    # Forked worker processes inherit the tracer, but must not record into or write the parent's trace
+    global tracer
+    tracer = None
+
+def span(name, **args):
+    if tracer is None:
+        return NULL_SPAN
+
+    return tracer.span(name, args)
+
+def profile():
+    if tracer is None:
+        return NULL_SPAN
+
+    return tracer.profile()
+
+def flush():
+    # Writes everything recorded so far, so a daemon that is killed still leaves a trace behind.
+    # A trace that cannot be written must not fail the scan that flushed it.
+    if tracer is not None:
+        try:
+            tracer.save()
+        except OSError as e:
+            print(f'Could not save the trace: {e}', file=sys.stderr)
@@ -0,0 +1,248 @@
+from .ProcessDiscovery import PROC_DIRECTORY, is_panda_library, resolve_process_path
+from .StringLayout import get_executable_info
+import mmap, os, struct
+
+# Itanium C++ ABI (GCC, Clang)
+MULTIFILE_VTABLE_SYMBOL = b'_ZTV9Multifile'
+ITANIUM_TYPE_NAME = b'9Multifile\0'
+
+# MSVC RTTI
+MSVC_TYPE_NAME = b'.?AVMultifile@@\0'
+COL_SIGNATURE_32 = 0
+COL_SIGNATURE_64 = 1
+
+# ELF section and segment types
+SHT_SYMTAB = 2
+SHT_DYNSYM = 11
+PT_LOAD = 1
+
+ELF_LAYOUTS = {
+    # Pointer size: (file header, program header, section header, symbol)
+    4: ('<16xHHIIIIIHHHHHH', '<IIIIIIII', '<IIIIIIIIII', '<IIIBBH'),
+    8: ('<16xHHIQQQIHHHHHH', '<IIQQQQQQ', '<IIQQQQIIQQ', '<IBBHQQ')
+}
+
+class Module(object):
+
+    def __init__(self, path, base):
+        self.path = path
+        self.base = base
+        self.regions = []
+
+def list_modules(pid, readable_regions=()):
+    # Returns the mapped files of a process with their base address and readable regions
+    modules = {}
+
+    if os.path.isdir(PROC_DIRECTORY):
+        try:
+            with open(f'{PROC_DIRECTORY}/{pid}/maps', 'r', errors='replace') as f:
+                lines = f.readlines()
+        except OSError:
+            return []
+
+        for line in lines:
+            fields = line.split(None, 5)
+
+            if len(fields) < 6 or not fields[5].startswith('/'):
+                continue
+
+            start, stop = (int(bound, 16) for bound in fields[0].split('-'))
+            path = fields[5].rstrip('\n')
+            module = modules.get(path)
+
+            if module is None:
+                module = modules[path] = Module(path, start - int(fields[2], 16))
+
+            if 'r' in fields[1]:
+                module.regions.append((start, stop))
+
+        return list(modules.values())
+
+    import psutil
+
+    try:
+        maps = psutil.Process(pid).memory_maps(grouped=False)
+    except (psutil.Error, OSError):
+        return []
+
+    for mapping in maps:
+        start = int(mapping.addr.split('-')[0], 16)
+        module = modules.get(mapping.path)
+
+        if module is None or start < module.base:
+            modules[mapping.path] = Module(mapping.path, start)
+
+    # Without /proc, a module owns the readable regions up to the next module
+    modules = sorted(modules.values(), key=lambda module: module.base)
+
+    for module, next_module in zip(modules, modules[1:] + [None]):
+        end = next_module.base if next_module else float('inf')
+        module.regions = [(start, stop) for start, stop in readable_regions if module.base <= start < end]
+
+    return modules
+
+def find_string_offsets(table, name):
+    # Linkers may share string table tails, so the name can also end a longer string
+    offsets = set()
+    index = table.find(name + b'\0')
+
+    while index != -1:
+        offsets.add(index)
+        index = table.find(name + b'\0', index + 1)
+
+    return offsets
+
+def find_elf_symbol(path, name):
+    # Returns (symbol value, lowest loaded virtual address) from the symbol tables of an ELF file
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        pointer_size = {1: 4, 2: 8}.get(data[4])
+
+        if pointer_size is None or data[5] != 1:
+            # Only little endian targets run Panda3D
+            return None
+
+        header_format, segment_format, section_format, symbol_format = ELF_LAYOUTS[pointer_size]
+        _, _, _, _, program_offset, section_offset, _, _, program_size, program_count, section_size, section_count, _ = struct.unpack_from(header_format, data)
+
+        segments = [struct.unpack_from(segment_format, data, program_offset + i * program_size) for i in range(program_count)]
+
+        if pointer_size == 8:
+            load_addresses = [vaddr for kind, _, _, vaddr, _, _, _, _ in segments if kind == PT_LOAD]
+        else:
+            load_addresses = [vaddr for kind, _, vaddr, _, _, _, _, _ in segments if kind == PT_LOAD]
+
+        sections = [struct.unpack_from(section_format, data, section_offset + i * section_size) for i in range(section_count)]
+        symbol_size = struct.calcsize(symbol_format)
+
+        for _, kind, _, _, offset, size, link, _, _, _ in sections:
+            if kind not in (SHT_DYNSYM, SHT_SYMTAB) or link >= len(sections):
+                continue
+
+            _, _, _, _, table_offset, table_size, _, _, _, _ = sections[link]
+            name_offsets = find_string_offsets(data[table_offset:table_offset + table_size], name)
+
+            if not name_offsets:
+                continue
+
+            for symbol in struct.iter_unpack(symbol_format, data[offset:offset + size - size % symbol_size]):
+                value = symbol[4] if pointer_size == 8 else symbol[1]
+
+                if symbol[0] in name_offsets and value:
+                    return value, min(load_addresses, default=0) & ~0xFFF
+
+    return None
+
+class VtableLocator(object):
+    # Finds the address every live Multifile object stores in its first word: a pointer into
+    # the Multifile vtable. It comes from the ELF symbol table when it is exported, and from
+    # following the RTTI records in the target's memory otherwise.
+
+    def __init__(self, pid, executable, search, read, readable_regions=()):
+        self.pid = pid
+        self.executable = executable
+        self.readable_regions = readable_regions
+        # search(value, regions) returns every address of value; read(address, size) returns bytes or None
+        self.search = search
+        self.read = read
+
+    def get_modules(self):
+        modules = []
+
+        for module in list_modules(self.pid, self.readable_regions):
+            if is_panda_library(module.path) or module.path == self.executable:
+                path = resolve_process_path(self.pid, module.path) if os.path.isdir(PROC_DIRECTORY) else module.path
+
+                if path:
+                    module.path = path
+                    modules.append(module)
+
+        # libpandaexpress defines Multifile; static builds put it in the executable
+        modules.sort(key=lambda module: 'pandaexpress' not in os.path.basename(module.path).lower())
+        return modules
+
+    def find_vtables(self):
+        # Returns [(vtable address, pointer size)]
+        vtables = []
+
+        for module in self.get_modules():
+            pointer_size, platform = get_executable_info(module.path)
+
+            if pointer_size is None:
+                continue
+
+            vtable = None
+
+            if platform == 'elf':
+                vtable = self.find_symbol_vtable(module, pointer_size)
+
+            if vtable is None and module.regions:
+                if platform == 'pe':
+                    vtable = self.find_msvc_vtable(module, pointer_size)
+                else:
+                    vtable = self.find_itanium_vtable(module, pointer_size)
+
+            if vtable is not None:
+                vtables.append((vtable, pointer_size))
+
+        return vtables
+
+    def find_symbol_vtable(self, module, pointer_size):
+        try:
+            symbol = find_elf_symbol(module.path, MULTIFILE_VTABLE_SYMBOL)
+        except (OSError, ValueError, struct.error):
+            return None
+
+        if symbol is None:
+            return None
+
+        value, load_address = symbol
+        # Objects point past the offset-to-top and typeinfo words
+        return module.base - load_address + value + pointer_size * 2
+
+    def read_pointer(self, address, pointer_size):
+        data = self.read(address, pointer_size)
+        return int.from_bytes(data, 'little') if data is not None else None
+
+    def find_itanium_vtable(self, module, pointer_size):
+        # type name <- typeinfo (vtable pointer, name pointer) <- vtable (offset to top, typeinfo, functions)
+        for name in self.search(ITANIUM_TYPE_NAME, module.regions):
+            name_pointer = name.to_bytes(pointer_size, 'little')
+
+            for reference in self.search(name_pointer, module.regions):
+                if reference % pointer_size:
+                    continue
+
+                typeinfo = (reference - pointer_size).to_bytes(pointer_size, 'little')
+
+                for vtable in self.search(typeinfo, module.regions):
+                    if vtable % pointer_size == 0 and self.read_pointer(vtable - pointer_size, pointer_size) == 0:
+                        return vtable + pointer_size
+
+        return None
+
+    def find_msvc_vtable(self, module, pointer_size):
+        # type name <- type descriptor (vftable, spare, name) <- complete object locator <- vftable[-1]
+        for name in self.search(MSVC_TYPE_NAME, module.regions):
+            descriptor = name - pointer_size * 2
+
+            if pointer_size == 8:
+                # 64-bit locators refer to the type descriptor relative to the image base
+                reference = (descriptor - module.base).to_bytes(4, 'little')
+                signature = COL_SIGNATURE_64
+            else:
+                reference = descriptor.to_bytes(4, 'little')
+                signature = COL_SIGNATURE_32
+
+            for address in self.search(reference, module.regions):
+                locator = address - 12
+                header = self.read(locator, 8)
+
+                if locator % 4 or header is None or struct.unpack('<II', header) != (signature, 0):
+                    # Only the primary vftable has an offset of zero
+                    continue
+
+                for vtable in self.search(locator.to_bytes(pointer_size, 'little'), module.regions):
+                    if vtable % pointer_size == 0:
+                        return vtable + pointer_size
+
+        return None
@@ -0,0 +1,208 @@
+from .Multifile import Multifile, verify_password
+from . import Tracing
+from collections import deque
+import io, json, multiprocessing, os, sys, threading, time
+
+CHUNK_SIZE = 16 # Words per task; small, since every candidate costs a full KDF run
+CHECKPOINT_INTERVAL = 10 # Seconds between checkpoints
+REPORT_INTERVAL = 5 # Seconds between rate reports
+
+def mangle_case(word):
+    return (word.lower(), word.upper(), word.capitalize(), word.swapcase())
+
+def mangle_reverse(word):
+    return (word[::-1],)
+
+def mangle_digits(word):
+    return tuple(word + str(digit).encode('ascii') for digit in range(10))
+
+def mangle_years(word):
+    return tuple(word + str(year).encode('ascii') for year in range(1990, 2031))
+
+LEET_TABLE = bytes.maketrans(b'aeiost', b'4310$7')
+
+def mangle_leet(word):
+    return (word.translate(LEET_TABLE),)
+
+MANGLING_RULES = {
+    'case': mangle_case,
+    'reverse': mangle_reverse,
+    'digits': mangle_digits,
+    'years': mangle_years,
+    'leet': mangle_leet
+}
+
+def get_candidates(word, rules):
+    candidates = {word: None}
+
+    for rule in rules:
+        for candidate in MANGLING_RULES[rule](word):
+            candidates.setdefault(candidate, None)
+
+    return candidates.keys()
+
+# Worker process state, set once by the pool initializer
+worker_headers = None
+worker_rules = None
+
+def init_worker(headers, rules):
+    global worker_headers, worker_rules
+    Tracing.disable_tracing()
+    worker_headers = headers
+    worker_rules = rules
+
+def verify_chunk(words):
+    candidates = 0
+    found = []
+
+    for word in words:
+        for candidate in get_candidates(word, worker_rules):
+            candidates += 1
+
+            for i, header in enumerate(worker_headers):
+                if verify_password(*header, candidate):
+                    found.append((i, candidate))
+
+    return candidates, found
+
+def iter_chunks(f, offset):
+    # Yields (chunk, byte offset after the chunk)
+    f.seek(offset)
+    chunk = []
+
+    for line in f:
+        offset += len(line)
+        word = line.rstrip(b'\r\n')
+
+        if word:
+            chunk.append(word)
+
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk, offset
+            chunk = []
+
+    if chunk:
+        yield chunk, offset
+
+class WordlistVerifier(object):
+
+    def __init__(self, wordlist, multifiles, rules=(), checkpoint=None, processes=None):
+        for rule in rules:
+            if rule not in MANGLING_RULES:
+                raise ValueError(f'Unknown mangling rule: {rule}')
+
+        self.wordlist = wordlist
+        self.multifiles = multifiles
+        self.rules = tuple(rules)
+        self.checkpoint = checkpoint
+        self.processes = processes or os.cpu_count() or 1
+        self.headers = []
+        self.on_found = lambda multifile, password: None
+        self.on_rate = lambda words, candidates, rate: None
+        self.on_warning = lambda message: None
+
+        for path in multifiles:
+            mf = Multifile()
+
+            with io.open(path, 'rb') as f:
+                mf.load(f)
+
+            self.headers.append(mf.get_header())
+
+    def get_wordlist_stamp(self):
+        stat = os.stat(self.wordlist)
+        return [os.path.abspath(self.wordlist), stat.st_size, stat.st_mtime_ns]
+
+    def load_checkpoint(self):
+        # Returns (byte offset, words done, candidates done, found passwords)
+        if not self.checkpoint:
+            return 0, 0, 0, []
+
+        try:
+            with open(self.checkpoint, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0, 0, 0, []
+
+        if state.get('wordlist') != self.get_wordlist_stamp() or state.get('rules') != list(self.rules):
+            # The checkpoint belongs to another run
+            return 0, 0, 0, []
+
+        found = [(multifile, bytes.fromhex(password)) for multifile, password in state.get('found', [])]
+        return state['offset'], state['words'], state['candidates'], found
+
+    def save_checkpoint(self, offset, words, candidates, found):
+        if not self.checkpoint:
+            return
+
+        state = {
+            'wordlist': self.get_wordlist_stamp(),
+            'rules': list(self.rules),
+            'offset': offset,
+            'words': words,
+            'candidates': candidates,
+            'found': [(multifile, password.hex()) for multifile, password in found]
+        }
+        temp_path = f'{self.checkpoint}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        # The last checkpoint is saved while an error may be unwinding, so a failed save must not replace it
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+
+            os.replace(temp_path, self.checkpoint)
+        except OSError as e:
+            self.on_warning(f'Could not save the checkpoint: {e}')
+
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def run(self):
+        offset, words, candidates, found = self.load_checkpoint()
+        start_time = last_report = last_checkpoint = time.monotonic()
+        start_candidates = candidates
+
+        with open(self.wordlist, 'rb') as f, multiprocessing.Pool(self.processes, init_worker, (self.headers, self.rules)) as pool:
+            chunks = iter_chunks(f, offset)
+            # Results arrive in order, so every completed chunk advances the checkpoint
+            offsets = deque()
+
+            def tasks():
+                for chunk, chunk_offset in chunks:
+                    offsets.append((len(chunk), chunk_offset))
+                    yield chunk
+
+            try:
+                for chunk_candidates, chunk_found in pool.imap(verify_chunk, tasks()):
+                    chunk_words, offset = offsets.popleft()
+                    words += chunk_words
+                    candidates += chunk_candidates
+
+                    for i, password in chunk_found:
+                        found.append((self.multifiles[i], password))
+                        self.on_found(self.multifiles[i], password)
+
+                    now = time.monotonic()
+
+                    if now - last_report >= REPORT_INTERVAL:
+                        self.on_rate(words, candidates, (candidates - start_candidates) / (now - start_time))
+                        last_report = now
+
+                    if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                        self.save_checkpoint(offset, words, candidates, found)
+                        last_checkpoint = now
+            finally:
+                self.save_checkpoint(offset, words, candidates, found)
+
+        elapsed = time.monotonic() - start_time
+        self.on_rate(words, candidates, (candidates - start_candidates) / elapsed if elapsed else 0)
+        return found
+
+def main(args):
+    verifier = WordlistVerifier(args.wordlist, args.multifiles, args.rules, args.checkpoint, args.processes)
+    verifier.on_found = lambda multifile, password: print(f'{os.path.basename(multifile)}: {password.decode("utf-8", "backslashreplace")}', flush=True)
+    verifier.on_rate = lambda words, candidates, rate: print(f'{words} words, {candidates} candidates, {rate:.1f} candidates/s', file=sys.stderr, flush=True)
+    verifier.on_warning = lambda message: print(message, file=sys.stderr, flush=True)
+    verifier.run()
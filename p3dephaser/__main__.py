@@ -1,5 +1,62 @@
-from .Dephaser import Dephaser
+import argparse
 
-if __name__ == '__main__':
+def main():
+    parser = argparse.ArgumentParser(prog='p3dephaser', description='Decrypt Panda3D encrypted multifiles on the fly.')
+    parser.add_argument('--daemon', metavar='SOCKET', help='run a headless scan daemon with a JSON-RPC API on this Unix socket')
+    parser.add_argument('--workers', type=int, default=2, help='how many scans the daemon runs at once')
+    parser.add_argument('--wordlist', metavar='FILE', help='verify the passwords in this wordlist offline instead of scanning a process')
+    parser.add_argument('--rules', type=lambda value: [rule for rule in value.split(',') if rule], default=[], help='comma separated mangling rules for the wordlist: case, reverse, digits, years, leet')
+    parser.add_argument('--checkpoint', metavar='FILE', help='resume the wordlist from this checkpoint file and keep it updated')
+    parser.add_argument('--processes', type=int, help='how many processes verify the wordlist (default: all cores)')
+    parser.add_argument('--repack', metavar='OUTPUT', help='write a decrypted copy of the multifile that stock Panda3D can mount')
+    parser.add_argument('--password', help='the password of the multifile to repack')
+    parser.add_argument('--trace', metavar='FILE', help='record a Chrome trace-event JSON file of every scan, for bug reports')
+    parser.add_argument('--profile', metavar='FILE', help='write a cProfile dump of the scan')
+    parser.add_argument('--index-cache', metavar='DIR', nargs='?', const='', help='keep the parsed index of every multifile opened in DIR (default: ~/.p3dephaser/index), so reopening it takes one read')
+    parser.add_argument('multifiles', nargs='*', help='encrypted multifiles to verify the wordlist against or repack')
+    args, _ = parser.parse_known_args()
+
+    if args.index_cache is not None:
+        from . import IndexCache
+        IndexCache.enable_index_cache(args.index_cache or IndexCache.INDEX_DIRECTORY)
+
+    if args.trace or args.profile:
+        from . import Tracing
+        Tracing.start_tracing(args.trace, args.profile)
+
+        try:
+            run(parser, args)
+        finally:
+            Tracing.stop_tracing()
+    else:
+        run(parser, args)
+
+def run(parser, args):
+    if args.wordlist:
+        if not args.multifiles:
+            parser.error('--wordlist needs at least one multifile')
+
+        from .WordlistVerifier import main as verify_wordlist
+        verify_wordlist(args)
+        return
+
+    if args.repack:
+        if len(args.multifiles) != 1 or args.password is None:
+            parser.error('--repack needs --password and exactly one multifile')
+
+        from .Repacker import MultifileRepacker
+        subfiles, size = MultifileRepacker(args.multifiles[0], args.password.encode('utf-8')).repack(args.repack)
+        print(f'Wrote {subfiles} subfiles ({size} bytes) to {args.repack}')
+        return
+
+    if args.daemon:
+        from .Daemon import ScanDaemon
+        ScanDaemon(args.daemon, args.workers).run()
+        return
+
+    from .Dephaser import Dephaser
     base = Dephaser()
     base.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+from p3dephaser.Multifile import Multifile, Subfile, SF_compressed, SF_encrypted, NID_aes_256_cbc, NID_bf_cbc, NID_to_sizes, MAGIC_HEADER, ITERATION_FACTOR
+from p3dephaser.StructDatagram import StructDatagram
+import hashlib, os, struct, zlib
+import pytest
+
+# Builds Panda3D multifiles the way Multifile::flush writes them, so tests need no Panda3D
+CIPHER_MODULES = {
+    NID_bf_cbc: 'Crypto.Cipher.Blowfish',
+    NID_aes_256_cbc: 'Crypto.Cipher.AES'
+}
+KEY_LENGTHS = {
+    # Panda3D's defaults
+    NID_bf_cbc: 16,
+    NID_aes_256_cbc: 32
+}
+
+def encrypt(data, password, nid=NID_aes_256_cbc, iteration_count=0):
+    # Only decryption is implemented here, so the fixtures are encrypted with PyCryptodome
+    cipher = pytest.importorskip(CIPHER_MODULES[nid])
+    iv_size, block_size = NID_to_sizes[nid]
+    key_length = KEY_LENGTHS[nid]
+    iv = os.urandom(iv_size)
+    key = hashlib.pbkdf2_hmac('sha1', password, iv, iteration_count * ITERATION_FACTOR + 1, key_length)
+    plaintext = MAGIC_HEADER + data
+    padding = block_size - len(plaintext) % block_size
+    plaintext += bytes([padding]) * padding
+    return struct.pack('<HHH', nid, key_length, iteration_count) + iv + cipher.new(key, cipher.MODE_CBC, iv).encrypt(plaintext)
+
+def build_multifile(path, files, password=None, nid=NID_aes_256_cbc):
+    # files holds (name, data, compressed); every subfile is encrypted if there is a password
+    subfiles = []
+    blobs = []
+
+    for name, data, compressed in files:
+        subfile = Subfile()
+        subfile.name = name
+        subfile.original_length = len(data)
+        subfile.timestamp = 1234
+
+        if compressed:
+            data = zlib.compress(data)
+            subfile.flags |= SF_compressed
+
+        if password is not None:
+            data = encrypt(data, password, nid)
+            subfile.flags |= SF_encrypted
+
+        subfile.length = len(data)
+        subfiles.append(subfile)
+        blobs.append(data)
+
+    index_address = 18
+    address = index_address + sum(subfile.get_index_size() for subfile in subfiles) + 4
+
+    for subfile, data in zip(subfiles, blobs):
+        subfile.address = address
+        address += len(data)
+
+    dg = StructDatagram()
+    dg.append_data(Multifile.HEADER)
+    dg.add_int16(1)
+    dg.add_int16(1)
+    dg.add_uint32(1)
+    dg.add_uint32(1234)
+
+    for subfile in subfiles:
+        subfile.write(dg, dg.get_length() + subfile.get_index_size())
+
+    dg.add_uint32(0)
+
+    with open(path, 'wb') as f:
+        f.write(dg.get_message())
+
+        for data in blobs:
+            f.write(data)
+
+    return path
@@ -0,0 +1,127 @@
+from p3dephaser import Daemon
+from p3dephaser.Daemon import ScanDaemon, PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INVALID_PARAMS
+from p3dephaser.Multifile import Multifile
+from .multifiles import build_multifile
+import asyncio, json, os, socket, threading
+import pytest
+
+FILES = [('phase_3/etc/settings.prc', b'want-dev #f\n' * 100, False)]
+
+@pytest.fixture
+def daemon(tmp_path):
+    daemon = ScanDaemon(os.path.join(tmp_path, 'p3dephaser.sock'))
+    yield daemon
+    daemon.executor.shutdown(wait=True)
+
+def run_session(daemon, requests):
+    # Sends the requests to the daemon over a socket pair and returns every message it sent back
+    async def session():
+        server_socket, client_socket = socket.socketpair()
+        server = asyncio.create_task(daemon.handle_client(*await asyncio.open_connection(sock=server_socket)))
+        reader, writer = await asyncio.open_connection(sock=client_socket)
+
+        for request in requests:
+            writer.write(request if isinstance(request, bytes) else (json.dumps(request) + '\n').encode('utf-8'))
+
+        await writer.drain()
+        writer.write_eof()
+        messages = [json.loads(line) async for line in reader]
+        await server
+        writer.close()
+        return messages
+
+    return asyncio.run(session())
+
+def get_responses(messages):
+    return {message['id']: message for message in messages if 'id' in message}
+
+def request(request_id, method, **params):
+    return {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+
+def test_protocol_errors(daemon):
+    messages = run_session(daemon, [
+        b'{not json\n',
+        {'jsonrpc': '2.0', 'id': 1, 'method': 5},
+        request(2, 'unknown'),
+        {'jsonrpc': '2.0', 'id': 3, 'method': 'status', 'params': [1]},
+        request(4, 'scan', pid='1234'),
+        request(5, 'status', job=99)
+    ])
+    responses = get_responses(messages)
+
+    # Neither request could be read far enough to find its id
+    assert sorted(message['error']['code'] for message in messages if message['id'] is None) == [PARSE_ERROR, INVALID_REQUEST]
+    assert responses[2]['error']['code'] == METHOD_NOT_FOUND
+    assert all(responses[request_id]['error']['code'] == INVALID_PARAMS for request_id in (3, 4, 5))
+
+def test_load_and_extract(daemon, tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=b'secret')
+    missing = os.path.join(tmp_path, 'missing.mf')
+    output = os.path.join(tmp_path, 'phase_3_plain.mf')
+    responses = get_responses(run_session(daemon, [
+        request(1, 'load', multifiles=[path, missing]),
+        request(2, 'extract', multifile=path, password_hex=b'secret'.hex(), output=output),
+        request(3, 'extract', multifile=path, password='wrong', output=os.path.join(tmp_path, 'wrong.mf'))
+    ]))
+
+    loaded = responses[1]['result']
+    assert loaded[path]['key_length'] == 32 and 'error' in loaded[missing]
+    assert responses[2]['result'] == {'output': output, 'subfiles': 1, 'size': os.path.getsize(output)}
+    assert responses[3]['error']['code'] == INVALID_PARAMS
+
+    mf = Multifile()
+
+    with open(output, 'rb') as f:
+        mf.load_header(f)
+        subfile, = mf.load_subfiles(f)
+        f.seek(subfile.address)
+        assert f.read(subfile.length) == FILES[0][1]
+
+def test_scan_notifications(daemon, monkeypatch):
+    # The engine is replaced, so only the job bookkeeping and notifications are tested here
+    def search_memory(engine):
+        engine.on_warning('phase_4.mf is not an encrypted multifile.')
+        engine.on_progress('/game/phase_3.mf', b'se\xffcret')
+        engine.on_key('phase_5.mf/maps/a.jpg', {'kind': 'aes_256_key', 'fingerprint': '00' * 8, 'address': 4096, 'key_hex': '11' * 32})
+
+    monkeypatch.setattr(Daemon.ScanEngine, 'search_memory', search_memory)
+    messages = run_session(daemon, [request(1, 'scan', pid=1234, multifiles=['phase_3.mf', 'phase_4.mf', 'phase_5.mf'])])
+    notifications = {message['method']: message['params'] for message in messages if 'method' in message}
+    job = get_responses(messages)[1]['result']
+
+    assert job['state'] == 'finished'
+    assert notifications['scan.progress'] == dict(job=job['job'], **job['results'][0])
+    assert notifications['scan.progress']['password_hex'] == b'se\xffcret'.hex()
+    assert notifications['scan.key'] == dict(job=job['job'], **job['keys'][0])
+    assert notifications['scan.key']['multifile'] == 'phase_5.mf/maps/a.jpg'
+    assert notifications['scan.warning']['message'] == job['warnings'][0]
+
+def test_load_does_not_wait_for_scans(tmp_path, monkeypatch):
+    daemon = ScanDaemon(os.path.join(tmp_path, 'p3dephaser.sock'), workers=1)
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=b'secret')
+    release = threading.Event()
+    released = []
+
+    # The scan holds the only worker until the load has been answered
+    monkeypatch.setattr(Daemon.ScanEngine, 'search_memory', lambda engine: released.append(release.wait(5)))
+
+    async def load(connection, params):
+        try:
+            return await ScanDaemon.load(daemon, connection, params)
+        finally:
+            release.set()
+
+    daemon.methods['load'] = load
+
+    try:
+        responses = get_responses(run_session(daemon, [
+            request(1, 'scan', pid=1234, multifiles=[path]),
+            request(2, 'load', multifiles=[path])
+        ]))
+    finally:
+        release.set()
+        daemon.executor.shutdown(wait=True)
+
+    assert released == [True]
+    assert responses[1]['result']['state'] == 'finished'
+    assert 'error' not in responses[2]['result'][path]
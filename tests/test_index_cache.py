@@ -0,0 +1,75 @@
+from p3dephaser.IndexCache import IndexCache
+from p3dephaser.Multifile import Multifile
+from .multifiles import build_multifile
+import os
+
+FILES = [(f'phase_4/maps/texture_{i}.jpg', bytes([i]) * (i * 7), i % 3 == 0) for i in range(50)]
+
+def get_index(subfiles):
+    return [(subfile.address, subfile.length, subfile.flags, subfile.original_length, subfile.timestamp, subfile.name) for subfile in subfiles]
+
+def load(path, cache):
+    mf = Multifile(index_cache=cache)
+
+    with open(path, 'rb') as f:
+        mf.load(f)
+
+    return mf
+
+def load_subfiles(path, cache):
+    mf = Multifile(index_cache=cache)
+
+    with open(path, 'rb') as f:
+        mf.load_header(f)
+        return mf.load_subfiles(f)
+
+def test_cached_index_round_trip(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_4.mf'), FILES, password=b'secret')
+    cache = IndexCache(os.path.join(tmp_path, 'index'))
+    uncached = load(path, None)
+
+    load(path, cache)
+
+    with open(path, 'rb') as f:
+        assert cache.load(cache.get_key(f)) is not None
+
+    cached = load(path, cache)
+    assert cached.get_header() == uncached.get_header()
+    assert cached.fingerprint == uncached.fingerprint
+    assert get_index(cached.subfiles) == get_index(load_subfiles(path, None))
+    assert cached.is_password(b'secret') and not cached.is_password(b'wrong')
+
+def test_cached_subfiles_round_trip(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_4.mf'), FILES)
+    cache = IndexCache(os.path.join(tmp_path, 'index'))
+
+    assert get_index(load_subfiles(path, cache)) == get_index(load_subfiles(path, None))
+    assert get_index(load_subfiles(path, cache)) == get_index(load_subfiles(path, None))
+
+def test_changed_multifile_is_reread(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_4.mf'), FILES, password=b'secret')
+    cache = IndexCache(os.path.join(tmp_path, 'index'))
+    load(path, cache)
+
+    # The same layout with a new password and IVs
+    build_multifile(path, FILES, password=b'hunter2')
+    mf = load(path, cache)
+    assert mf.is_password(b'hunter2') and not mf.is_password(b'secret')
+
+def test_corrupt_entry_is_ignored(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_4.mf'), FILES, password=b'secret')
+    cache = IndexCache(os.path.join(tmp_path, 'index'))
+    load(path, cache)
+
+    entry = cache.get_path(os.path.abspath(path))
+
+    with open(entry, 'r+b') as f:
+        data = bytearray(f.read())
+        data[len(data) // 2] ^= 1
+        f.seek(0)
+        f.write(data)
+
+    with open(path, 'rb') as f:
+        assert cache.load(cache.get_key(f)) is None
+
+    assert load(path, cache).get_header() == load(path, None).get_header()
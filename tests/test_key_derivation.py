@@ -0,0 +1,32 @@
+import hashlib
+import pytest
+from p3dephaser import KeyDerivation
+
+# The NumPy lanes only run where OpenSSL's PBKDF2 is missing, so they are checked directly here
+numpy = pytest.importorskip('numpy')
+
+SALT = bytes(range(16))
+
+def make_passwords(count):
+    # Short, empty, block-sized and longer-than-a-block passwords, which HMAC hashes first
+    sizes = [0, 1, 7, 63, 64, 65, 200]
+    return [bytes((i * 31 + j) & 0xFF for j in range(sizes[i % len(sizes)])) for i in range(count)]
+
+@pytest.mark.parametrize('dklen', [8, 16, 20, 32, 56])
+@pytest.mark.parametrize('count', [1, 3, 64])
+@pytest.mark.parametrize('iterations', [1, 2, 101])
+def test_lanes_match_hashlib(dklen, count, iterations):
+    passwords = make_passwords(count)
+    expected = [hashlib.pbkdf2_hmac('sha1', password, SALT, iterations, dklen) for password in passwords]
+    assert KeyDerivation.pbkdf2_hmac_sha1_lanes(passwords, SALT, iterations, dklen) == expected
+
+def test_pure_python_matches_hashlib():
+    for dklen in (16, 32, 56):
+        assert KeyDerivation.PKCS5_PBKDF2_HMAC_SHA1(b'secret', SALT, 11, dklen) == hashlib.pbkdf2_hmac('sha1', b'secret', SALT, 11, dklen)
+
+def test_derive_keys_numpy_backend(monkeypatch):
+    # Force the lane backend, the way it runs on builds without OpenSSL's PBKDF2
+    monkeypatch.setattr(KeyDerivation, 'OPENSSL_PBKDF2', False)
+    passwords = make_passwords(KeyDerivation.MIN_LANES)
+    expected = [hashlib.pbkdf2_hmac('sha1', password, SALT, 5, 32) for password in passwords]
+    assert KeyDerivation.derive_keys(passwords, SALT, 5, 32) == expected
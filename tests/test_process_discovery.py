@@ -0,0 +1,57 @@
+from p3dephaser import ProcessDiscovery
+from p3dephaser.ProcessDiscovery import find_multifiles, is_multifile
+import mmap, os
+import pytest
+
+def test_is_multifile():
+    assert is_multifile('/game/phase_3.mf') and is_multifile('C:\\Game\\PHASE_3.EF')
+    assert not is_multifile('/game/phase_3.mf.bak')
+
+@pytest.mark.skipif(not os.path.isdir(ProcessDiscovery.PROC_DIRECTORY), reason='needs /proc')
+def test_finds_open_and_mapped_multifiles(tmp_path):
+    opened = os.path.join(tmp_path, 'phase_3.mf')
+    mapped = os.path.join(tmp_path, 'phase_4.mf')
+    other = os.path.join(tmp_path, 'settings.prc')
+
+    for path in (opened, mapped, other):
+        with open(path, 'wb') as f:
+            f.write(bytes(4096))
+
+    # The mapped multifile stays mapped after its descriptor is closed
+    with open(mapped, 'rb') as f:
+        view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        with open(opened, 'rb'), open(other, 'rb'):
+            found = find_multifiles(os.getpid())
+    finally:
+        view.close()
+
+    assert opened in found and mapped in found
+    assert other not in found
+
+class FakeProcess(object):
+
+    def __init__(self, pid, exe, libraries):
+        self.info = {'pid': pid, 'name': os.path.basename(exe or 'System'), 'create_time': 1.0, 'exe': exe}
+        self.libraries = libraries
+        self.probed = False
+
+    def memory_maps(self):
+        self.probed = True
+        return [type('Mapping', (), {'path': path}) for path in self.libraries]
+
+def test_only_probes_possible_clients(monkeypatch):
+    psutil = pytest.importorskip('psutil')
+    monkeypatch.setenv('SystemRoot', 'C:\\Windows')
+    processes = [
+        FakeProcess(4, None, []),
+        FakeProcess(500, 'C:\\Windows\\System32\\svchost.exe', ['C:/Windows/System32/ntdll.dll']),
+        FakeProcess(600, 'C:\\Games\\Toontown\\ttrengine.exe', ['C:/Games/Toontown/libpanda.dll']),
+        FakeProcess(700, 'C:\\Program Files\\Editor\\editor.exe', ['C:/Windows/System32/ntdll.dll'])
+    ]
+    monkeypatch.setattr(psutil, 'process_iter', lambda attrs: iter(processes))
+
+    found = ProcessDiscovery.ProcessDiscovery().list_psutil_processes()
+    assert [process.pid for process in found if process.is_panda] == [600]
+    assert [process.info['pid'] for process in processes if process.probed] == [600, 700]
@@ -0,0 +1,63 @@
+from p3dephaser.Multifile import Multifile, MultifileException, NID_aes_256_cbc, NID_bf_cbc
+from p3dephaser.Repacker import MultifileRepacker
+from p3dephaser.SubfileReader import open_subfile
+from .multifiles import build_multifile
+import os, zlib
+import pytest
+
+FILES = [
+    ('phase_3/models/gui.bam', os.urandom(70000), False),
+    ('phase_3/etc/settings.prc', b'want-dev #f\n' * 500, True),
+    ('empty.txt', b'', False),
+    ('block.bin', b'x' * 10, False)
+]
+
+def read_subfiles(path, password=None):
+    # Returns the subfiles of a multifile with their stored data, decrypted if there is a password
+    mf = Multifile()
+
+    with open(path, 'rb') as f:
+        mf.load_header(f)
+        subfiles = []
+
+        for subfile in mf.load_subfiles(f):
+            with open_subfile(f, subfile, password) as reader:
+                subfiles.append((subfile, reader.read()))
+
+    return subfiles
+
+@pytest.mark.parametrize('nid', [NID_aes_256_cbc, NID_bf_cbc])
+def test_repack_round_trip(tmp_path, nid):
+    source = build_multifile(tmp_path / 'phase_3.mf', FILES, password=b'secret', nid=nid)
+    destination = tmp_path / 'phase_3_plain.mf'
+    count, size = MultifileRepacker(source, b'secret').repack(destination)
+
+    assert count == len(FILES)
+    assert size == os.path.getsize(destination)
+
+    repacked = read_subfiles(destination)
+    assert [data for _, data in repacked] == [data for _, data in read_subfiles(source, b'secret')]
+
+    for (subfile, data), (name, expected, compressed) in zip(repacked, FILES):
+        assert subfile.name == name
+        assert not subfile.is_encrypted()
+        assert subfile.is_compressed() == compressed
+        assert subfile.original_length == len(expected)
+        assert (zlib.decompress(data) if compressed else data) == expected
+
+def test_repack_copies_unencrypted_subfiles(tmp_path):
+    source = build_multifile(tmp_path / 'plain.mf', FILES)
+    destination = tmp_path / 'copy.mf'
+    MultifileRepacker(source, b'secret').repack(destination)
+
+    assert [data for _, data in read_subfiles(destination)] == [data for _, data in read_subfiles(source)]
+
+def test_repack_rejects_wrong_password(tmp_path):
+    source = build_multifile(tmp_path / 'phase_3.mf', FILES, password=b'secret')
+    destination = tmp_path / 'phase_3_plain.mf'
+
+    with pytest.raises(MultifileException):
+        MultifileRepacker(source, b'wrong').repack(destination)
+
+    # The password is checked before anything is written
+    assert not destination.exists()
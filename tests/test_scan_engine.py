@@ -0,0 +1,118 @@
+from p3dephaser.AES import AES
+from p3dephaser.KeyFinder import read_key_checks
+from p3dephaser.MemoryReader import MemoryRegions
+from p3dephaser.OffsetProfile import OffsetProfile
+from p3dephaser.ScanEngine import ScanEngine
+from .multifiles import build_multifile
+import ctypes, hashlib, os, struct
+import pytest
+
+FILENAME = b'/game/resources/phase_3.mf'
+PASSWORD = b'tt-secret'
+FILES = [('phase_3/etc/settings.prc', b'want-dev #f\n' * 100, False)]
+
+# Where the planted Multifile object keeps its filename and password
+ARENA_SIZE = 16384
+FILENAME_OFFSET = 64
+PASSWORD_OFFSET = 200
+HEAP_OFFSET = 2048
+SCHEDULE_OFFSET = 8192
+
+class PlantedProcess(object):
+    # Stands in for a mem_edit Process: the target is this process, and only a ctypes
+    # arena holding a libstdc++ Multifile object is mapped
+
+    def __init__(self):
+        self.arena = ctypes.create_string_buffer(ARENA_SIZE)
+        self.address = ctypes.addressof(self.arena)
+
+    def plant_string(self, offset, value, heap_offset):
+        # std::string is { char *ptr; size_t size; union { char buf[16]; size_t capacity; } }
+        if len(value) < 16:
+            struct.pack_into('<QQ16s', self.arena, offset, self.address + offset + 16, len(value), value)
+            return
+
+        self.plant(heap_offset, value + b'\0')
+        struct.pack_into('<QQQ', self.arena, offset, self.address + heap_offset, len(value), len(value))
+
+    def plant(self, offset, data):
+        ctypes.memmove(self.address + offset, data, len(data))
+
+    def read_memory(self, address, buffer):
+        ctypes.memmove(buffer, address, ctypes.sizeof(buffer))
+        return buffer
+
+    def list_mapped_regions(self, writeable_only=True):
+        return [(self.address, self.address + ARENA_SIZE)]
+
+def create_engine(process, multifiles, **kwargs):
+    engine = ScanEngine(os.getpid(), multifiles, **kwargs)
+    engine.profile = OffsetProfile()
+    engine.open_readers(process)
+    engine.regions = MemoryRegions(process.list_mapped_regions())
+    return engine
+
+@pytest.mark.parametrize('password, abis', [
+    (PASSWORD, {'libstdc++': 1}),
+    # An MSVC string also starts with its heap pointer, and reads the capacity as its size
+    (PASSWORD * 3, {'libstdc++': 1, 'msvc': 1})
+])
+def test_finds_planted_password(tmp_path, password, abis):
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=password)
+    process = PlantedProcess()
+    process.plant_string(FILENAME_OFFSET, FILENAME, HEAP_OFFSET)
+    process.plant_string(PASSWORD_OFFSET, password, HEAP_OFFSET + 256)
+    engine = create_engine(process, [path])
+    found = []
+    engine.on_progress = lambda target, password: found.append((target, password))
+
+    (multifile_name, mf), = engine.load_multifiles()
+    assert engine.search_multifile(process, multifile_name, mf)
+    assert found == [(FILENAME.decode('utf-8'), password)]
+
+    # Every layout that decoded the password is recorded, along with its offset
+    assert engine.profile.offsets == {PASSWORD_OFFSET - FILENAME_OFFSET: 1}
+    assert engine.profile.abis == abis
+
+def test_ignores_unconfirmed_filename(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=PASSWORD)
+    process = PlantedProcess()
+    # The filename is in memory, but no string points at it
+    process.plant(HEAP_OFFSET, FILENAME)
+    engine = create_engine(process, [path])
+
+    (multifile_name, mf), = engine.load_multifiles()
+    assert not engine.search_multifile(process, multifile_name, mf)
+
+def test_finds_planted_key_schedule(tmp_path):
+    pytest.importorskip('numpy')
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=PASSWORD)
+
+    # The key of the only subfile, as OpenSSL expands it once the subfile is opened
+    (_, _, key_length, iv, _), = read_key_checks(path)
+    process = PlantedProcess()
+    process.plant(SCHEDULE_OFFSET, AES.expand_key(hashlib.pbkdf2_hmac('sha1', PASSWORD, iv, 1, key_length)))
+    engine = create_engine(process, [path], key_search=True)
+    keys = []
+    engine.on_key = lambda target, key: keys.append((target, key))
+
+    engine.search_keys(process, ['phase_3.mf'])
+    (target, key), = keys
+    assert target == f'phase_3.mf/{FILES[0][0]}'
+    assert key['kind'] == 'aes_256_key' and key['address'] == process.address + SCHEDULE_OFFSET
+
+def test_skips_unreadable_multifiles(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=PASSWORD)
+    plain = build_multifile(os.path.join(tmp_path, 'phase_4.mf'), FILES)
+    garbage = os.path.join(tmp_path, 'phase_5.mf')
+    missing = os.path.join(tmp_path, 'phase_6.mf')
+
+    with open(garbage, 'wb') as f:
+        f.write(b'pmf\0\n\r' + os.urandom(64))
+
+    engine = ScanEngine(os.getpid(), [path, plain, garbage, missing])
+    warnings = []
+    engine.on_warning = warnings.append
+
+    assert [multifile_name for multifile_name, _ in engine.load_multifiles()] == ['phase_3.mf']
+    assert [warning.split()[0] for warning in warnings] == ['phase_4.mf', 'phase_5.mf', 'phase_6.mf']
@@ -0,0 +1,59 @@
+from p3dephaser.Multifile import Multifile, MultifileException
+from p3dephaser.SubfileReader import SubfileReader, PAGE_SIZE
+from .multifiles import build_multifile
+import io, os
+import pytest
+
+DATA = os.urandom(PAGE_SIZE * 4 + 123)
+FILES = [('phase_3/models/gui.bam', DATA, False)]
+
+@pytest.fixture
+def reader(tmp_path):
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=b'secret')
+
+    with io.open(path, 'rb', buffering=0) as f:
+        mf = Multifile()
+        mf.load_header(f)
+        subfile, = mf.load_subfiles(f)
+        yield SubfileReader(f, subfile, b'secret', cache_size=PAGE_SIZE)
+
+def test_seek(reader):
+    assert reader.seek(100) == 100
+    assert reader.seek(-10, io.SEEK_CUR) == 90
+    assert reader.seek(-5, io.SEEK_END) == len(DATA) - 5
+    assert reader.read(10) == DATA[-5:]
+    assert reader.read(10) == b''
+
+    with pytest.raises(ValueError):
+        reader.seek(-1)
+
+    with pytest.raises(ValueError):
+        reader.seek(0, 3)
+
+@pytest.mark.parametrize('start, size', [
+    (0, 10),
+    # The decrypted data starts with the magic header, so pages are offset by it
+    (PAGE_SIZE - 20, 40),
+    (PAGE_SIZE * 2 - 100, PAGE_SIZE * 2),
+    (len(DATA) - 50, 100)
+])
+def test_partial_reads(reader, start, size):
+    reader.seek(start)
+    assert reader.read(size) == DATA[start:start + size]
+    assert reader.tell() == min(start + size, len(DATA))
+
+def test_reads_pages_out_of_order(reader):
+    # The cache only holds one page, so going back decrypts pages again
+    for start in (PAGE_SIZE * 3, 10, PAGE_SIZE * 2 + 7, PAGE_SIZE - 3):
+        reader.seek(start)
+        assert reader.read(PAGE_SIZE // 2) == DATA[start:start + PAGE_SIZE // 2]
+
+def test_truncated_subfile(reader):
+    os.truncate(reader.f.name, reader.encrypted.address + PAGE_SIZE + 100)
+    assert reader.read(PAGE_SIZE) == DATA[:PAGE_SIZE]
+
+    # The read stops where the data does, and the next one fails
+    assert reader.read(PAGE_SIZE) == DATA[PAGE_SIZE:PAGE_SIZE + 90]
+
+    with pytest.raises(MultifileException):
+        reader.read(PAGE_SIZE)
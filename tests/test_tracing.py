@@ -0,0 +1,48 @@
+from p3dephaser import Tracing
+import json, os, threading
+import pytest
+
+@pytest.fixture
+def trace_path(tmp_path):
+    path = os.path.join(tmp_path, 'scan.json')
+    Tracing.start_tracing(path)
+    yield path
+    Tracing.disable_tracing()
+
+def test_concurrent_flushes(trace_path):
+    # Daemon jobs flush from their own threads when their scans end
+    def scan(i):
+        with Tracing.span('scan', job=i):
+            pass
+
+        for _ in range(20):
+            Tracing.flush()
+
+    threads = [threading.Thread(target=scan, args=(i,)) for i in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    Tracing.flush()
+
+    with open(trace_path) as f:
+        events = [event for event in json.load(f)['traceEvents'] if event['name'] == 'scan']
+
+    assert sorted(event['args']['job'] for event in events) == [0, 1, 2, 3]
+    assert os.listdir(os.path.dirname(trace_path)) == ['scan.json']
+
+def test_flush_survives_write_errors(tmp_path, capsys):
+    Tracing.start_tracing(os.path.join(tmp_path, 'missing', 'scan.json'))
+
+    try:
+        with Tracing.span('scan'):
+            pass
+
+        Tracing.flush()
+    finally:
+        Tracing.disable_tracing()
+
+    assert 'Could not save the trace' in capsys.readouterr().err
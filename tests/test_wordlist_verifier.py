@@ -0,0 +1,68 @@
+from p3dephaser import WordlistVerifier as wordlist_verifier
+from p3dephaser.WordlistVerifier import WordlistVerifier, get_candidates, iter_chunks
+from .multifiles import build_multifile
+import io, json, os
+
+FILES = [('phase_3/etc/settings.prc', b'want-dev #f\n' * 100, False)]
+WORDS = [b'alpha', b'bravo', b'secret', b'delta', b'echo']
+
+def create_verifier(tmp_path, words, **kwargs):
+    path = build_multifile(os.path.join(tmp_path, 'phase_3.mf'), FILES, password=b'secret')
+    wordlist = os.path.join(tmp_path, 'words.txt')
+
+    with open(wordlist, 'wb') as f:
+        f.write(b''.join(word + b'\n' for word in words))
+
+    return WordlistVerifier(wordlist, [path], processes=1, **kwargs)
+
+def test_candidates():
+    assert list(get_candidates(b'Test', ())) == [b'Test']
+    # The original word comes first, and candidates several rules produce are only tried once
+    assert list(get_candidates(b'Test', ('case', 'reverse'))) == [b'Test', b'test', b'TEST', b'tEST', b'tseT']
+    assert list(get_candidates(b'site', ('leet',))) == [b'site', b'$173']
+    assert len(get_candidates(b'pass', ('digits', 'years'))) == 1 + 10 + 41
+
+def test_chunk_offsets(monkeypatch):
+    monkeypatch.setattr(wordlist_verifier, 'CHUNK_SIZE', 2)
+    data = b'one\r\ntwo\n\nthree\nfour\nfive'
+    chunks = list(iter_chunks(io.BytesIO(data), 0))
+
+    # Every offset is just past the last line of its chunk, and blank lines are skipped
+    assert chunks == [([b'one', b'two'], 9), ([b'three', b'four'], 21), ([b'five'], len(data))]
+    assert list(iter_chunks(io.BytesIO(data), 9)) == chunks[1:]
+
+def test_finds_password(tmp_path):
+    verifier = create_verifier(tmp_path, WORDS, rules=('case',))
+    rates = []
+    verifier.on_rate = lambda words, candidates, rate: rates.append((words, candidates))
+
+    assert verifier.run() == [(verifier.multifiles[0], b'secret')]
+    assert rates[-1] == (len(WORDS), sum(len(get_candidates(word, ('case',))) for word in WORDS))
+
+def test_resumes_from_checkpoint(tmp_path):
+    checkpoint = os.path.join(tmp_path, 'checkpoint.json')
+    verifier = create_verifier(tmp_path, WORDS, checkpoint=checkpoint)
+    # The first three words were tried by an earlier run, which found the password
+    found = [(verifier.multifiles[0], b'secret')]
+    verifier.save_checkpoint(len(b'alpha\nbravo\nsecret\n'), 3, 3, found)
+    rates = []
+    verifier.on_rate = lambda words, candidates, rate: rates.append((words, candidates))
+
+    assert verifier.run() == found
+    assert rates[-1] == (len(WORDS), len(WORDS))
+
+    with open(checkpoint, 'r') as f:
+        assert json.load(f)['offset'] == os.path.getsize(verifier.wordlist)
+
+    # A checkpoint of another wordlist is ignored
+    verifier = create_verifier(tmp_path, WORDS + [b'foxtrot'], checkpoint=checkpoint)
+    assert verifier.load_checkpoint() == (0, 0, 0, [])
+
+def test_unsaved_checkpoint_warns(tmp_path):
+    verifier = create_verifier(tmp_path, WORDS, checkpoint=os.path.join(tmp_path, 'missing', 'checkpoint.json'))
+    warnings = []
+    verifier.on_warning = warnings.append
+
+    assert verifier.run() == [(verifier.multifiles[0], b'secret')]
+    assert warnings and warnings[0].startswith('Could not save the checkpoint')
+    assert 'missing' not in os.listdir(tmp_path)